@@ -215,9 +215,28 @@ class Config(dict):
             "simulation_processor"  : 'e2e', # regular, extent
             "stripe_size"           : 4,  # unit: page
             "max_victim_valid_ratio": 0.9,
+            # used by gc_victim_policy windowed_greedy and d_choices
+            "gc_victim_window"      : 16,
+            "gc_victim_d_choices"   : 8,
+            # seed of the random samples of windowed_greedy and d_choices
+            "gc_victim_seed"        : 0,
             "n_gc_procs"            : 1,
 
             "do_gc_after_workload"  : True,
+            # keep page data in the simulated flash, so it can be checked
+            # end to end. Without it, nkftl2 and dftlext only count flash
+            # operations. The e2e simulator needs it.
+            "store_page_data"       : True,
+            # clean in the background when no host request has been served
+            # for background_gc_idle_time (ns). Only dftldes supports it.
+            "background_gc"         : False,
+            "background_gc_idle_time": 1*MILISEC,
+
+            # serve flash operations waiting for a channel by priority:
+            # host reads, host writes, then GC. See controller.Channel3.
+            "channel_priority_scheduling": False,
+            # let host reads suspend programs and erases
+            "flash_suspend"         : False,
 
             'snapshot_valid_ratios' : False,
             'snapshot_erasure_count_dist': False,
@@ -473,7 +492,11 @@ class ConfigNewFlash(Config):
 
             "t_R"                   : 20*MICROSEC,
             "t_PROG"                : 200*MICROSEC,
-            "t_BERS"                : 1.5*MILISEC
+            "t_BERS"                : 1.5*MILISEC,
+            # extra time of a read that suspends a program or erase, and
+            # of resuming the suspended operation. Used with flash_suspend.
+            "t_SUSPEND"             : 20*MICROSEC,
+            "t_RESUME"              : 20*MICROSEC
             }
         return flash_config
 
@@ -440,6 +440,114 @@ class TestControllerTag(unittest.TestCase):
         self.my_run()
 
 
+class TestChannelPriority(unittest.TestCase):
+    def create_channel(self, env, flash_suspend):
+        conf = config.ConfigNewFlash()
+        conf['channel_priority_scheduling'] = True
+        conf['flash_suspend'] = flash_suspend
+        set_exp_metadata(conf, save_data = False,
+                expname = 'default',
+                subexpname = 'default-sub')
+        runtime_update(conf)
+        rec = wiscsim.recorder.Recorder(output_target = conf['output_target'],
+            output_directory = conf['result_dir'],
+            verbose_level = conf['verbose_level'],
+            print_when_finished = False
+            )
+        rec.enable()
+
+        return wiscsim.controller.Channel3(env, conf, rec, 0)
+
+    def op(self, env, channel, delay, op, tag_op, finish_times, name=None):
+        yield env.timeout(delay)
+        tag = channel.recorder.get_tag(tag_op, None)
+        if op == 'read':
+            yield env.process(channel.read_page(tag))
+        elif op == 'write':
+            yield env.process(channel.write_page(tag))
+        if name is None:
+            name = tag_op
+        finish_times[name] = env.now
+
+    def test_priority(self):
+        env = simpy.Environment()
+        channel = self.create_channel(env, flash_suspend = False)
+        rt = channel.read_time
+        wt = channel.program_time
+
+        finish_times = {}
+        env.process(self.op(env, channel, 0, 'write', 'write.data.gc',
+            finish_times))
+        # all arrive while the channel is busy, lowest priority first
+        env.process(self.op(env, channel, 1, 'read', 'read.data.gc',
+            finish_times))
+        env.process(self.op(env, channel, 2, 'write', 'write_user',
+            finish_times))
+        env.process(self.op(env, channel, 3, 'read', 'read_user',
+            finish_times))
+        env.run()
+
+        self.assertEqual(finish_times['write.data.gc'], wt)
+        self.assertEqual(finish_times['read_user'], wt + rt)
+        self.assertEqual(finish_times['write_user'], wt + rt + wt)
+        self.assertEqual(finish_times['read.data.gc'], wt + rt + wt + rt)
+
+    def test_suspend(self):
+        env = simpy.Environment()
+        channel = self.create_channel(env, flash_suspend = True)
+        rt = channel.read_time
+        wt = channel.program_time
+        st = channel.suspend_time
+        rst = channel.resume_time
+
+        finish_times = {}
+        env.process(self.op(env, channel, 0, 'write', 'write_user',
+            finish_times))
+        env.process(self.op(env, channel, 10, 'read', 'read_user',
+            finish_times))
+        env.run()
+
+        self.assertEqual(finish_times['read_user'], 10 + rt + st)
+        self.assertEqual(finish_times['write_user'], wt + rt + st + rst)
+
+    def test_resume_in_arrival_order(self):
+        env = simpy.Environment()
+        channel = self.create_channel(env, flash_suspend = True)
+        rt = channel.read_time
+        wt = channel.program_time
+        st = channel.suspend_time
+        rst = channel.resume_time
+
+        finish_times = {}
+        env.process(self.op(env, channel, 0, 'write', 'write_user',
+            finish_times, name = 'first'))
+        env.process(self.op(env, channel, 5, 'write', 'write_user',
+            finish_times, name = 'second'))
+        env.process(self.op(env, channel, 10, 'read', 'read_user',
+            finish_times))
+        env.run()
+
+        # the suspended write arrived first, so it resumes first
+        self.assertEqual(finish_times['first'], wt + rt + st + rst)
+        self.assertEqual(finish_times['second'], wt + rt + st + rst + wt)
+
+    def test_tag_to_priority(self):
+        tag_to_priority = wiscsim.controller.tag_to_priority
+        self.assertEqual(tag_to_priority({'op': 'read_user'}),
+                wiscsim.controller.PRIORITY_HOST_READ)
+        self.assertEqual(tag_to_priority({'op': 'erase.data.gc'}),
+                wiscsim.controller.PRIORITY_GC)
+        # nkftl2 tags are strings
+        for tag in ('PARTIAL.MERGE', 'SWITCH.MERGE', 'FULL.MERGE',
+                'SIMPLE.ERASE', 'wearleveling'):
+            self.assertEqual(tag_to_priority(tag),
+                    wiscsim.controller.PRIORITY_GC)
+        self.assertEqual(tag_to_priority('Unknown'),
+                wiscsim.controller.PRIORITY_HOST_WRITE)
+        self.assertEqual(tag_to_priority(None),
+                wiscsim.controller.PRIORITY_HOST_WRITE)
+
+
 
 def main():
     unittest.main()
@@ -118,6 +118,15 @@ class Test_LruCache(unittest.TestCase):
         self.assertEqual(d.victim_key(), 10)
         self.assertEqual(d.most_recently_used_key(), 9)
 
+    def test_add_to_least_used_of_empty(self):
+        d = LruCache()
+
+        d.add_as_least_used(1, 10)
+        d[2] = 20
+        self.assertEqual(d.victim_key(), 1)
+        self.assertEqual(d.most_recently_used_key(), 2)
+        self.assertListEqual([k for k, _ in d.least_to_most_items()], [1, 2])
+
     def _test_performance(self):
         d = LruDict()
         for i in range(2048):
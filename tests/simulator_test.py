@@ -44,6 +44,31 @@ class TestNCQSingleQueueWithWaitTime(unittest.TestCase):
         ncq.slots.release(req)
 
 
+class TestNCQIdleDetector(unittest.TestCase):
+    def test_wait_idle(self):
+        env = simpy.Environment()
+        detector = NCQIdleDetector(env)
+
+        env.process(self.main_proc(env, detector))
+        env.run()
+
+    def main_proc(self, env, detector):
+        env.process(self.request(env, detector, start=0, duration=5))
+        env.process(self.request(env, detector, start=12, duration=1))
+        yield env.timeout(1)
+
+        yield env.process(detector.wait_idle(10))
+        # idle from 5 to 12 is too short, so wait until 13 + 10
+        self.assertEqual(env.now, 23)
+        self.assertTrue(detector.is_idle())
+
+    def request(self, env, detector, start, duration):
+        yield env.timeout(start)
+        detector.request_started()
+        yield env.timeout(duration)
+        detector.request_finished()
+
+
 def main():
     unittest.main()
 
@@ -67,6 +67,91 @@ class TestBitmap(unittest.TestCase):
         self.assertEqual(bitmap.block_valid_ratio(0),
                 1 - 1.0/conf.n_pages_per_block)
 
+    def test_block_counters(self):
+        conf = create_config()
+        bitmap = create_bitmap(conf)
+        n = conf.n_pages_per_block
+
+        self.assertEqual(bitmap.garbage_blocks_with_valid_count(0), set())
+
+        bitmap.validate_block(1)
+        self.assertEqual(bitmap.block_valid_count(1), n)
+        self.assertEqual(bitmap.block_invalid_count(1), 0)
+        self.assertEqual(bitmap.garbage_blocks_with_valid_count(n), set())
+
+        start, _ = conf.block_to_page_range(1)
+        bitmap.invalidate_page(start)
+        bitmap.invalidate_page(start)
+        bitmap.invalidate_page(start + 1)
+        self.assertEqual(bitmap.block_valid_count(1), n - 2)
+        self.assertEqual(bitmap.block_invalid_count(1), 2)
+        self.assertEqual(bitmap.garbage_blocks_with_valid_count(n - 2), {1})
+        self.assertEqual(bitmap.block_erased_ratio(1), 0)
+
+        bitmap.invalidate_block(1)
+        self.assertEqual(bitmap.block_valid_ratio(1), 0)
+        self.assertEqual(bitmap.block_invalid_ratio(1), 1)
+        self.assertEqual(bitmap.garbage_blocks_with_valid_count(n - 2), set())
+        self.assertEqual(bitmap.garbage_blocks_with_valid_count(0), {1})
+
+        bitmap.erase_block(1)
+        self.assertEqual(bitmap.block_invalid_count(1), 0)
+        self.assertEqual(bitmap.block_erased_ratio(1), 1)
+        self.assertEqual(bitmap.garbage_blocks_with_valid_count(0), set())
+
+    def test_garbage_block_array(self):
+        conf = create_config()
+        bitmap = create_bitmap(conf)
+
+        for block in (0, 1, 2):
+            bitmap.validate_block(block)
+            start, _ = conf.block_to_page_range(block)
+            bitmap.invalidate_page(start)
+        self.assertListEqual(list(bitmap.garbage_block_array()), [0, 1, 2])
+
+        # the last block takes the place of an erased one
+        bitmap.erase_block(0)
+        self.assertListEqual(list(bitmap.garbage_block_array()), [2, 1])
+
+        bitmap.erase_block(1)
+        bitmap.erase_block(2)
+        self.assertListEqual(list(bitmap.garbage_block_array()), [])
+
+    def test_range_ops(self):
+        conf = create_config()
+        bitmap = create_bitmap(conf)
+        n = conf.n_pages_per_block
+
+        # a range across blocks 0 and 1
+        bitmap.validate_range(n - 2, n + 3)
+        self.assertEqual(bitmap.block_valid_count(0), 2)
+        self.assertEqual(bitmap.block_valid_count(1), 3)
+        self.assertEqual(bitmap.is_page_erased(n - 3), True)
+        self.assertEqual(bitmap.is_page_valid(n + 2), True)
+        self.assertEqual(bitmap.is_page_erased(n + 3), True)
+
+        bitmap.invalidate_range(n - 1, n + 1)
+        self.assertEqual(bitmap.block_valid_count(0), 1)
+        self.assertEqual(bitmap.block_invalid_count(0), 1)
+        self.assertEqual(bitmap.block_valid_count(1), 2)
+        self.assertEqual(bitmap.block_invalid_count(1), 1)
+        self.assertEqual(bitmap.garbage_blocks_with_valid_count(1), {0})
+        self.assertEqual(bitmap.garbage_blocks_with_valid_count(2), {1})
+
+        # duplicates and erased pages
+        bitmap.invalidate_many([n - 2, n - 2, n + 1, n + 2, n + 5])
+        self.assertEqual(bitmap.block_valid_count(0), 0)
+        self.assertEqual(bitmap.block_invalid_count(0), 2)
+        self.assertEqual(bitmap.block_valid_count(1), 0)
+        self.assertEqual(bitmap.block_invalid_count(1), 4)
+        self.assertEqual(bitmap.garbage_blocks_with_valid_count(0), {0, 1})
+        self.assertEqual(bitmap.is_page_invalid(n + 5), True)
+        self.assertEqual(bitmap.is_page_erased(n + 4), True)
+
+        bitmap.validate_many([n + 4, n + 5])
+        self.assertEqual(bitmap.block_valid_count(1), 2)
+        self.assertEqual(bitmap.block_invalid_count(1), 3)
+
 
 def main():
     unittest.main()
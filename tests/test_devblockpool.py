@@ -1,3 +1,4 @@
+import random
 import unittest
 from wiscsim.devblockpool import *
 from collections import Counter
@@ -358,6 +359,61 @@ class TestGettingDistribution(unittest.TestCase):
         self.assertEqual(dist[0], 64*8-5)
         self.assertEqual(dist[1], 5)
 
+    def test_erasure_count_range(self):
+        pool = MultiChannelBlockPool(
+                n_channels=2,
+                n_blocks_per_channel=4,
+                n_pages_per_block=32,
+                tags=[TDATA, TTRANS])
+
+        self.assertEqual(pool.get_erasure_count_range(), (0, 0, 0))
+
+        for i in range(3):
+            pool.change_tag(5, TFREE, TDATA)
+            pool.change_tag(5, TDATA, TFREE)
+        pool.change_tag(1, TFREE, TDATA)
+        pool.change_tag(1, TDATA, TFREE)
+        self.assertEqual(pool.get_erasure_count_range(), (0, 3, 4))
+
+        for block in range(8):
+            pool.change_tag(block, TFREE, TDATA)
+            pool.change_tag(block, TDATA, TFREE)
+        self.assertEqual(pool.get_erasure_count_range(), (1, 4, 12))
+        self.assertEqual(pool.get_erasure_count_dist(),
+                Counter({1: 6, 2: 1, 4: 1}))
+
+    def test_blocks_by_erasure(self):
+        pool = MultiChannelBlockPool(
+                n_channels=2,
+                n_blocks_per_channel=8,
+                n_pages_per_block=32,
+                tags=[TDATA, TTRANS])
+        rand = random.Random(1)
+
+        for i in range(200):
+            blocknum = rand.choice(range(16))
+            tag = pool.get_tag(blocknum)
+            if tag == TFREE:
+                pool.change_tag(blocknum, TFREE, rand.choice([TDATA, TTRANS]))
+            else:
+                pool.change_tag(blocknum, tag, TFREE)
+
+            # the order of sorting all blocks by count
+            by_cnt = [block for block, _ in
+                    reversed(pool.get_erasure_count().most_common())
+                    if pool.get_tag(block) != TFREE]
+            blocks = [block for _, block, _ in
+                    pool.iter_blocks_by_erasure([TDATA, TTRANS])]
+            self.assertListEqual(blocks, by_cnt)
+            for count, block, tag in pool.iter_blocks_by_erasure(
+                    [TDATA, TTRANS], choice=MOST_ERASED):
+                self.assertEqual(pool.get_tag(block), tag)
+            self.assertListEqual(
+                [block for _, block, _ in
+                    pool.iter_blocks_by_erasure([TDATA], MOST_ERASED)],
+                [block for block in by_cnt[::-1]
+                    if pool.get_tag(block) == TDATA])
+
 
 class TestWearLeveling(unittest.TestCase):
     def test_calulator(self):
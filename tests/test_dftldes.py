@@ -6,8 +6,10 @@ from wiscsim import ftlsim_commons
 
 from utilities import utils
 import wiscsim
+import wiscsim.ssdframework
 from wiscsim.ftlsim_commons import Extent
-from wiscsim.dftldes import LpnTable, LpnTableMvpn, UNINITIATED, \
+from wiscsim.dftldes import LpnTable, LpnTableMvpn, ArrayLpnTable, \
+        UNINITIATED, \
         split_ext_by_segment
 from config import WLRUNNER, LBAGENERATOR, LBAMULTIPROC
 from commons import *
@@ -191,6 +193,110 @@ class TestMappingCache(unittest.TestCase):
         env.run()
 
 
+class TestMappingCacheArrayTable(TestMappingCache):
+    def test_update(self):
+        conf = create_config()
+        conf.n_cache_entries = conf.n_mapping_entries_per_page
+        conf['array_lpn_table'] = True
+        conf['check_lpn_table_states'] = True
+        objs = create_obj_set(conf)
+
+        mapping_cache = create_mapping_cache(objs)
+
+        env = objs['env']
+        env.process(self.update_proc(objs, mapping_cache))
+        env.run()
+
+
+class TestMappingCacheBatch(unittest.TestCase):
+    def proc(self, conf, env, mapping_cache):
+        recorder = mapping_cache.recorder
+        recorder.enable()
+        time_read_page = mapping_cache.flash.channels[0].read_time
+
+        lpns = conf.m_vpn_to_lpns(1) + conf.m_vpn_to_lpns(2)[:8]
+        ppns = yield env.process(mapping_cache.lpns_to_ppns(lpns))
+        self.assertListEqual(ppns, [UNINITIATED] * len(lpns))
+        self.assertEqual(
+            recorder.get_count_me('translation', 'read-trans-for-load'), 2)
+        self.assertEqual(recorder.get_count_me('Mapping_Cache', 'miss'), 2)
+        self.assertEqual(recorder.get_count_me('Mapping_Cache', 'hit'),
+                len(lpns) - 2)
+        self.assertEqual(env.now, 2 * time_read_page)
+
+        new_mappings = {lpn: lpn * 10 for lpn in lpns}
+        yield env.process(mapping_cache.update_batch(new_mappings))
+        ppns = yield env.process(mapping_cache.lpns_to_ppns(lpns))
+        self.assertListEqual(ppns, [lpn * 10 for lpn in lpns])
+        self.assertEqual(env.now, 2 * time_read_page)
+
+    def test_batch(self):
+        conf = create_config()
+        conf.n_cache_entries = conf.n_mapping_entries_per_page * 4
+        objs = create_obj_set(conf)
+
+        mapping_cache = create_mapping_cache(objs)
+
+        env = objs['env']
+        env.process(self.proc(conf, env, mapping_cache))
+        env.run()
+
+    def interleaved_proc(self, conf, env, mapping_cache):
+        mapping_cache.recorder.enable()
+
+        lpns_1 = conf.m_vpn_to_lpns(1)
+        lpns_2 = conf.m_vpn_to_lpns(2)
+        lpns = [lpns_1[0], lpns_2[0], lpns_1[1], lpns_2[1], lpns_1[2]]
+
+        yield env.process(mapping_cache.update_batch(
+            {lpn: lpn * 10 for lpn in lpns}))
+        ppns = yield env.process(mapping_cache.lpns_to_ppns(lpns))
+        self.assertListEqual(ppns, [lpn * 10 for lpn in lpns])
+
+    def test_interleaved_m_vpns(self):
+        conf = create_config()
+        conf.n_cache_entries = conf.n_mapping_entries_per_page * 4
+        objs = create_obj_set(conf)
+
+        mapping_cache = create_mapping_cache(objs)
+
+        env = objs['env']
+        env.process(self.interleaved_proc(conf, env, mapping_cache))
+        env.run()
+
+    def old_mappings_proc(self, conf, env, mapping_cache):
+        mapping_cache.recorder.enable()
+
+        lpns = conf.m_vpn_to_lpns(1)[:4]
+        yield env.process(mapping_cache.update_batch(
+            {lpn: lpn * 10 for lpn in lpns}))
+
+        # lpns[1] has been remapped since it was at lpns[1] * 10
+        old_mappings = {lpn: lpn * 10 for lpn in lpns}
+        old_mappings[lpns[1]] = 1
+        updated = yield env.process(mapping_cache.update_batch(
+            {lpn: lpn * 100 for lpn in lpns}, old_mappings=old_mappings))
+        self.assertListEqual(sorted(updated),
+                [lpns[0], lpns[2], lpns[3]])
+
+        ppns = yield env.process(mapping_cache.lpns_to_ppns(lpns))
+        self.assertListEqual(ppns,
+                [lpns[0] * 100, lpns[1] * 10, lpns[2] * 100, lpns[3] * 100])
+        self.assertEqual(mapping_cache.recorder.get_count_me(
+            'translation', 'skip-stale-update'), 1)
+
+    def test_old_mappings(self):
+        conf = create_config()
+        conf.n_cache_entries = conf.n_mapping_entries_per_page * 4
+        objs = create_obj_set(conf)
+
+        mapping_cache = create_mapping_cache(objs)
+
+        env = objs['env']
+        env.process(self.old_mappings_proc(conf, env, mapping_cache))
+        env.run()
+
+
 class TestMappingCacheParallel(unittest.TestCase):
     def update_random(self, conf, env, mapping_cache):
         n = conf.total_num_pages()
@@ -959,6 +1065,47 @@ class TestRead(unittest.TestCase):
         self.assertEqual(env.now, time_read_page * 2)
 
 
+class TestLazyTranslationPages(unittest.TestCase):
+    def test_lazy(self):
+        conf = create_config()
+        conf['lazy_translation_pages'] = True
+        objs = create_obj_set(conf)
+        env = objs['env']
+
+        dftl = FtlTest(objs['conf'], objs['rec'],
+                objs['flash_controller'], objs['env'])
+
+        env.process(self.proc_test_lazy(objs, dftl))
+        env.run()
+
+    def proc_test_lazy(self, objs, dftl):
+        env = objs['env']
+        conf = objs['conf']
+        directory = dftl.get_directory()
+        time_program_page = objs['flash_controller'].channels[0].program_time
+
+        # no translation page is on flash at the beginning
+        self.assertEqual(len(dftl.block_pool.used_blocks), 0)
+        self.assertEqual(directory.m_vpn_to_m_ppn(0), UNINITIATED)
+
+        # translation pages that have never been written are not read
+        yield env.process(dftl.read_ext(Extent(0, 1)))
+        self.assertEqual(env.now, 0)
+
+        yield env.process(dftl.write_ext(Extent(0, 1)))
+        yield env.process(dftl.flush_trans_cache())
+
+        m_ppn = directory.m_vpn_to_m_ppn(0)
+        self.assertNotEqual(m_ppn, UNINITIATED)
+        self.assertTrue(dftl.oob.states.is_page_valid(m_ppn))
+        self.assertEqual(dftl.oob.ppn_to_lpn_or_mvpn(m_ppn), 0)
+        self.assertEqual(directory.m_vpn_to_m_ppn(1), UNINITIATED)
+
+        dftl.drop_trans_cache()
+        ppn = yield env.process(dftl.get_mappings().lpn_to_ppn(0))
+        self.assertNotEqual(ppn, UNINITIATED)
+
+
 class TestSplit(unittest.TestCase):
     def test(self):
         conf = create_config()
@@ -1018,8 +1165,11 @@ class TestDiscard(unittest.TestCase):
 
 
 class TestLpnTable(unittest.TestCase):
+    def create_table(self, n_rows):
+        return LpnTable(n_rows)
+
     def test_init(self):
-        table = LpnTable(8)
+        table = self.create_table(8)
         self.assertEqual(table.n_free_rows(), 8)
         self.assertEqual(table.n_locked_free_rows(), 0)
         self.assertEqual(table.n_used_rows(), 0)
@@ -1028,7 +1178,7 @@ class TestLpnTable(unittest.TestCase):
         """
         lock before adding, also you need to tell it which row you add to
         """
-        table = LpnTable(8)
+        table = self.create_table(8)
 
         rowid = table.lock_free_row()
         self.assertEqual(table.n_free_rows(), 7)
@@ -1062,7 +1212,7 @@ class TestLpnTable(unittest.TestCase):
         self.assertEqual(table.n_used_rows(), 0)
 
     def test_boundaries(self):
-        table = LpnTable(8)
+        table = self.create_table(8)
 
         for i in range(8):
             table.lock_free_row()
@@ -1070,7 +1220,7 @@ class TestLpnTable(unittest.TestCase):
         self.assertEqual(table.lock_free_row(), None)
 
     def test_multiple_adds(self):
-        table = LpnTable(8)
+        table = self.create_table(8)
 
         locked_rows = table.lock_free_rows(3)
         self.assertEqual(len(locked_rows), 3)
@@ -1086,7 +1236,7 @@ class TestLpnTable(unittest.TestCase):
         self.assertEqual(table.lpn_to_ppn(3), 33)
 
     def test_locking_lpn(self):
-        table = LpnTable(8)
+        table = self.create_table(8)
 
         locked_rows = table.lock_free_rows(3)
         self.assertEqual(len(locked_rows), 3)
@@ -1100,6 +1250,199 @@ class TestLpnTable(unittest.TestCase):
         self.assertEqual(table.n_used_rows(), 2)
         self.assertEqual(table.n_locked_used_rows(), 1)
 
+    def test_state_counts_match_rows(self):
+        table = self.create_table(8)
+
+        locked_rows = table.lock_free_rows(5)
+        table.add_lpns(locked_rows, {1:11, 2:22, 3:33, 4:44, 5:55}, False)
+        table.lock_lpn(1)
+        table.hold_used_row(table._peek_row(2).rowid)
+        rowid = table.delete_lpn_and_lock(3)
+        table.unlock_free_row(rowid)
+
+        self.assertEqual(table.stats(), table._count_states())
+        self.assertEqual(table.n_free_rows(), 4)
+
+        # freed rows are handed out again
+        self.assertEqual(len(table.lock_free_rows(8)), 4)
+        self.assertEqual(table.lock_free_row(), None)
+        self.assertEqual(table.stats(), table._count_states())
+
+    def test_only_used_rows_are_evictable(self):
+        table = self.create_table(8)
+        locked_rows = table.lock_free_rows(3)
+        for rowid, lpn in zip(locked_rows, [1, 2, 3]):
+            table.add_lpn(rowid, lpn, lpn * 10, False)
+
+        table.hold_used_row(table._peek_row(2).rowid)
+        table.lock_lpn(3)
+        lpns = [lpn for lpn, _ in table.least_to_most_lpn_items()]
+        self.assertListEqual(lpns, [1])
+
+        # pinned rows can still be translated and updated
+        self.assertEqual(table.lpn_to_ppn(2), 20)
+        table.overwrite_lpn(2, 22, dirty = True)
+        self.assertEqual(table.lpn_to_ppn(2), 22)
+        self.assertEqual(table.has_lpn(3), True)
+
+        table.unhold_used_row(table._peek_row(2).rowid)
+        table.unlock_lpn(3)
+        lpns = [lpn for lpn, _ in table.least_to_most_lpn_items()]
+        self.assertListEqual(lpns, [3, 2, 1])
+
+
+class TestArrayLpnTable(TestLpnTable):
+    def create_table(self, n_rows):
+        return ArrayLpnTable(n_rows, check_states=True)
+
+    def test_uninitiated_ppn(self):
+        table = self.create_table(8)
+        rowid = table.lock_free_row()
+        table.add_lpn(rowid = rowid, lpn = 8, ppn = UNINITIATED, dirty = False)
+        self.assertEqual(table.lpn_to_ppn(8), UNINITIATED)
+        self.assertEqual(table.lpn_to_ppn(9), wiscsim.dftldes.MISS)
+
+    def test_recency(self):
+        table = self.create_table(8)
+        locked_rows = table.lock_free_rows(3)
+        for rowid, lpn in zip(locked_rows, [1, 2, 3]):
+            table.add_lpn(rowid, lpn, lpn * 10, False)
+        table.lpn_to_ppn(1)
+        rowid = table.lock_free_row()
+        table.add_lpn(rowid, 4, 40, False, as_least_recent = True)
+
+        lpns = [lpn for lpn, _ in table.least_to_most_lpn_items()]
+        self.assertListEqual(lpns, [4, 2, 3, 1])
+
+    def test_state_checking(self):
+        table = self.create_table(8)
+        rowid = table.lock_free_row()
+        with self.assertRaises(AssertionError):
+            table.hold_used_row(rowid)
+
+    def test_mvpn_state_checking(self):
+        conf = create_config()
+        conf.n_cache_entries = 8
+        conf['check_lpn_table_states'] = True
+        table = wiscsim.dftldes.ArrayLpnTableMvpn(conf)
+        self.assertEqual(table._check_states, True)
+
+        rowid = table.lock_free_row()
+        with self.assertRaises(AssertionError):
+            table.hold_used_row(rowid)
+
+
+class TestLpnRowIndex(unittest.TestCase):
+    def test_against_dict(self):
+        rand = random.Random(1)
+        n_rows = 64
+        index = wiscsim.dftldes._LpnRowIndex(n_rows)
+        expected = {}
+
+        for i in range(5000):
+            lpn = rand.choice([rand.randint(0, 200), rand.randint(0, 8) * 1024])
+            if lpn in expected:
+                self.assertEqual(index[lpn], expected[lpn])
+                self.assertEqual(index.pop(lpn), expected.pop(lpn))
+            elif len(expected) < n_rows:
+                expected[lpn] = i
+                index[lpn] = i
+            self.assertEqual(lpn in index, lpn in expected)
+            self.assertEqual(index.get(lpn, None), expected.get(lpn, None))
+
+        for lpn, rowid in expected.items():
+            self.assertEqual(index[lpn], rowid)
+        with self.assertRaises(KeyError):
+            index.pop(100000)
+
+    def test_too_many_rows(self):
+        with self.assertRaises(AssertionError):
+            wiscsim.dftldes._LpnRowIndex(1 << 31)
+
+
+class TestLpnTableMvpn(unittest.TestCase):
+    def create_table(self, conf):
+        return LpnTableMvpn(conf)
+
+    def test_m_vpn_index(self):
+        conf = create_config()
+        conf.n_cache_entries = 8
+        table = self.create_table(conf)
+
+        lpns = conf.m_vpn_to_lpns(1)[:3]
+        locked_rows = table.lock_free_rows(3)
+        for rowid, lpn in zip(locked_rows, lpns):
+            table.add_lpn(rowid, lpn, lpn * 10, dirty = True)
+
+        self.assertEqual(table.n_dirty_of_m_vpn(1), 3)
+        self.assertEqual(table.needed_space_for_m_vpn(1),
+                conf.n_mapping_entries_per_page - 3)
+        self.assertDictEqual(table.get_m_vpn_mappings(1),
+                {lpn: lpn * 10 for lpn in lpns})
+
+        table.mark_clean(lpns[0])
+        table.overwrite_lpn(lpns[1], 88, dirty = False)
+        self.assertEqual(table.n_dirty_of_m_vpn(1), 1)
+
+        table.delete_lpn_and_lock(lpns[2])
+        self.assertEqual(table.n_dirty_of_m_vpn(1), 0)
+        self.assertListEqual(table.row_ids_of_m_vpn(1), locked_rows[:2])
+        self.assertEqual(len(table.get_un_cached_lpn_of_m_vpn(1)),
+                conf.n_mapping_entries_per_page - 2)
+        self.assertEqual(table.n_cached_of_m_vpn(0), 0)
+        self.assertListEqual(sorted(table.cached_lpns_of_m_vpn(1)), lpns[:2])
+
+    def lru_lpns(self, table):
+        return [lpn for lpn, _ in table.least_to_most_lpn_items()]
+
+    def test_victim_row(self):
+        conf = create_config()
+        conf.n_cache_entries = 8
+        table = self.create_table(conf)
+
+        lpns_0 = conf.m_vpn_to_lpns(0)[:3]
+        lpns_1 = conf.m_vpn_to_lpns(1)[:2]
+        locked_rows = table.lock_free_rows(5)
+        for rowid, lpn in zip(locked_rows, lpns_0 + lpns_1):
+            table.add_lpn(rowid, lpn, lpn * 10, dirty = False)
+        self.assertEqual(table.victim_row().lpn, lpns_0[0])
+
+        # rows of a locked m_vpn are parked when they are met
+        table.lock_m_vpn(0)
+        self.assertEqual(table.victim_row().lpn, lpns_1[0])
+        self.assertListEqual(self.lru_lpns(table), lpns_1)
+        # parked rows can still be translated
+        self.assertEqual(table.lpn_to_ppn(lpns_0[1]), lpns_0[1] * 10)
+
+        # the row used while parked becomes the most recent, the others go
+        # back to the least recent end
+        table.unlock_m_vpn(0)
+        self.assertListEqual(self.lru_lpns(table),
+                [lpns_0[0], lpns_0[2]] + lpns_1 + [lpns_0[1]])
+        self.assertEqual(table.victim_row().lpn, lpns_0[0])
+        self.assertEqual(table.stats(), table._count_states())
+
+    def test_victim_row_all_locked(self):
+        conf = create_config()
+        conf.n_cache_entries = 8
+        table = self.create_table(conf)
+
+        lpns = conf.m_vpn_to_lpns(0)[:2]
+        locked_rows = table.lock_free_rows(2)
+        for rowid, lpn in zip(locked_rows, lpns):
+            table.add_lpn(rowid, lpn, lpn * 10, dirty = False)
+
+        table.lock_m_vpn(0)
+        self.assertEqual(table.victim_row(), None)
+        table.unlock_m_vpn(0)
+        self.assertListEqual(self.lru_lpns(table), lpns)
+
+
+class TestArrayLpnTableMvpn(TestLpnTableMvpn):
+    def create_table(self, conf):
+        conf['check_lpn_table_states'] = True
+        return wiscsim.dftldes.ArrayLpnTableMvpn(conf)
+
 
 class TestLockPool(unittest.TestCase):
     def access_vpn(self, env, respool, vpn):
@@ -1493,6 +1836,31 @@ class TestWearLevelingVictimBlocks(unittest.TestCase):
         self.assertListEqual(sorted(vblocks), sorted([block1, block2, block3]))
 
 
+class TestOutOfBandAreas(unittest.TestCase):
+    def test_relocate_and_erase(self):
+        conf = create_config()
+        oob = create_oob(conf)
+
+        oob.relocate_data_page(lpn=8, old_ppn=UNINITIATED, new_ppn=1)
+        oob.relocate_data_page(lpn=9, old_ppn=UNINITIATED, new_ppn=2)
+        self.assertEqual(oob.ppn_to_lpn_or_mvpn(1), 8)
+        self.assertEqual(oob.last_inv_time_of_block[0], -1)
+
+        oob.relocate_data_page(lpn=8, old_ppn=1, new_ppn=3)
+        # invalidation is stamped with the logical clock
+        self.assertEqual(oob.last_inv_time_of_block[0], 3)
+        self.assertEqual(oob.timestamp_table[3], 2)
+
+        oob.data_page_move(lpn=8, old_ppn=3, new_ppn=4)
+        self.assertEqual(oob.timestamp_table[4], 2)
+
+        oob.erase_block(0)
+        with self.assertRaises(KeyError):
+            oob.ppn_to_lpn_or_mvpn(2)
+        self.assertEqual(oob.lpns_of_block(0)[2], 'NA')
+        self.assertEqual(oob.last_inv_time_of_block[0], -1)
+
+
 class TestVictimBlocks(unittest.TestCase):
     def test_entry(self):
         wiscsim.dftldes.VictimBlocks
@@ -1576,6 +1944,66 @@ class TestVictimBlocks(unittest.TestCase):
 
         self.assertListEqual(victims, [block1, block0, block2])
 
+    def test_victim_policy(self):
+        conf = create_config()
+        conf['flash_config']['n_channels_per_dev'] = 1
+        conf['stripe_size'] = 'infinity'
+        block_pool = create_blockpool(conf)
+        oob = create_oob(conf)
+
+        n = conf.n_pages_per_block
+        blocks = []
+        for n_valid in (2, 1, 3):
+            ppns = block_pool.next_n_data_pages_to_program_striped(n)
+            blocks.append(conf.page_to_block_off(ppns[0])[0])
+            for ppn in ppns:
+                oob.set_timestamp_of_ppn(ppn)
+                oob.states.validate_page(ppn)
+            oob.invalidate_ppns(ppns[n_valid:])
+
+        # use one more
+        block_pool.next_n_data_pages_to_program_striped(1)
+
+        # the block invalidated first is the oldest
+        conf['gc_victim_policy'] = 'fifo'
+        vbs = wiscsim.dftldes.VictimBlocks(conf, block_pool, oob)
+        self.assertListEqual(list(vbs.iterator()), blocks)
+
+        # sampling all candidates is greedy
+        conf['gc_victim_policy'] = 'd_choices'
+        conf['gc_victim_d_choices'] = 3
+        vbs = wiscsim.dftldes.VictimBlocks(conf, block_pool, oob)
+        self.assertListEqual(list(vbs.iterator()),
+                [blocks[1], blocks[0], blocks[2]])
+
+    def test_blocks_cleaned_during_iteration(self):
+        conf = create_config()
+        conf['flash_config']['n_channels_per_dev'] = 1
+        conf['stripe_size'] = 'infinity'
+        block_pool = create_blockpool(conf)
+        oob = create_oob(conf)
+
+        n = conf.n_pages_per_block
+        blocks = []
+        for n_valid in (1, 2):
+            ppns = block_pool.next_n_data_pages_to_program_striped(n)
+            blocks.append(conf.page_to_block_off(ppns[0])[0])
+            for ppn in ppns:
+                oob.states.validate_page(ppn)
+            oob.invalidate_ppns(ppns[n_valid:])
+
+        # use one more
+        block_pool.next_n_data_pages_to_program_striped(1)
+
+        vbs = wiscsim.dftldes.VictimBlocks(conf, block_pool, oob)
+        victim_iter = vbs.iterator()
+        self.assertEqual(next(victim_iter), blocks[0])
+
+        # blocks[1] gets cleaned before the iterator reaches it
+        oob.erase_block(blocks[1])
+        block_pool.move_used_data_block_to_free(blocks[1])
+        self.assertEqual(list(victim_iter), [])
+
     def test_valid_ratio_stats(self):
         vbs = create_victimblocks()
         conf = vbs._conf
@@ -1957,6 +2385,154 @@ class TestCleaningDataBlocksByCleaner(unittest.TestCase):
         self.assertNotEqual(block, victim_block)
 
 
+class TestCleaningDataBlocksInParallel(unittest.TestCase):
+    def test(self):
+        conf = create_config()
+        conf['flash_config']['n_channels_per_dev'] = 4
+        conf['stripe_size'] = 'infinity'
+        conf.set_flash_num_blocks_by_bytes(128*MB)
+        conf.GC_low_threshold_ratio = 0
+        objs = create_obj_set(conf)
+        env = objs['env']
+
+        dftl = FtlTest(objs['conf'], objs['rec'],
+                objs['flash_controller'], objs['env'])
+
+        env.process(self.proc_test_write(objs, dftl))
+        env.run()
+
+    def proc_test_write(self, objs, dftl):
+        conf = objs['conf']
+        env = objs['env']
+
+        time_read_page = objs['flash_controller'].channels[0].read_time
+        time_program_page = objs['flash_controller'].channels[0].program_time
+        time_erase_block = objs['flash_controller'].channels[0].erase_time
+
+        block_pool = dftl.block_pool
+        oob = dftl.oob
+        mappings = dftl.get_mappings()
+        cleaner = dftl.get_cleaner()
+
+        n = conf.n_pages_per_block
+        yield env.process(dftl.write_ext(Extent(0, n)))
+        yield env.process(dftl.write_ext(Extent(0, 1)))
+
+        victims = wiscsim.dftldes.VictimBlocks(conf, block_pool, oob)
+        _, _, victim_block = next(victims.iterator_verbose())
+
+        s = env.now
+        yield env.process(cleaner._clean_block(
+            wiscsim.dftldes.VictimBlocks.TYPE_DATA, victim_block,
+            wiscsim.dftldes.PURPOSE_GC))
+
+        # the n-1 valid pages are read from the victim's channel and
+        # written to all 4 channels in parallel
+        self.assertEqual(env.now, s + (n-1)*time_read_page +
+            ((n-1+3)/4)*time_program_page + time_erase_block)
+        self.assertIn(victim_block, block_pool.freeblocks)
+
+        for lpn in range(1, n):
+            ppn = yield env.process(mappings.lpn_to_ppn(lpn))
+            self.assertEqual(oob.ppn_to_lpn_or_mvpn(ppn), lpn)
+            self.assertTrue(oob.states.is_page_valid(ppn))
+
+
+class TestBackgroundCleaning(unittest.TestCase):
+    def test(self):
+        conf = create_config()
+        conf['flash_config']['n_channels_per_dev'] = 1
+        conf['stripe_size'] = 'infinity'
+        conf.set_flash_num_blocks_by_bytes(128*MB)
+        conf['background_gc_low_ratio'] = 0
+        objs = create_obj_set(conf)
+        env = objs['env']
+
+        dftl = FtlTest(objs['conf'], objs['rec'],
+                objs['flash_controller'], objs['env'])
+
+        env.process(self.proc_test_preempt(objs, dftl))
+        env.run()
+
+    def proc_test_preempt(self, objs, dftl):
+        conf = objs['conf']
+        env = objs['env']
+        rec = objs['rec']
+        rec.enable()
+
+        time_read_page = objs['flash_controller'].channels[0].read_time
+        time_program_page = objs['flash_controller'].channels[0].program_time
+
+        block_pool = dftl.block_pool
+        oob = dftl.oob
+        cleaner = dftl.get_cleaner()
+
+        n = conf.n_pages_per_block
+        yield env.process(dftl.write_ext(Extent(0, n)))
+        yield env.process(dftl.write_ext(Extent(0, 1)))
+
+        victims = wiscsim.dftldes.VictimBlocks(conf, block_pool, oob)
+        _, _, victim_block = next(victims.iterator_verbose())
+
+        # a host request arrives after 3 page moves. should_continue() is
+        # checked once before picking the block and before each page move.
+        n_checks = [0]
+        def should_continue():
+            n_checks[0] += 1
+            return n_checks[0] <= 4
+
+        s = env.now
+        yield env.process(cleaner.clean_in_background(should_continue))
+
+        self.assertEqual(env.now, s + 3*(time_read_page+time_program_page))
+        self.assertEqual(rec.get_count_me("gc", "background.preempted"), 1)
+        self.assertIn(victim_block, block_pool.used_blocks)
+        self.assertEqual(oob.states.block_valid_ratio(victim_block),
+                (n-4.0)/n)
+
+        # the half cleaned block is picked up again
+        yield env.process(cleaner.clean_in_background(lambda: True))
+        self.assertIn(victim_block, block_pool.freeblocks)
+
+
+class TestIdleBackgroundGC(unittest.TestCase):
+    def test(self):
+        conf = create_config()
+        conf['ftl_type'] = 'dftldes'
+        conf['flash_config']['n_channels_per_dev'] = 1
+        conf['stripe_size'] = 'infinity'
+        conf.set_flash_num_blocks_by_bytes(128*MB)
+        conf['background_gc'] = True
+        conf['background_gc_idle_time'] = 1*MILISEC
+        conf['background_gc_high_ratio'] = 0
+        conf['background_gc_low_ratio'] = 0
+
+        env = create_simpy_env()
+        rec = create_recorder(conf)
+        rec.enable()
+        ncq = ftlsim_commons.NCQSingleQueue(1, env)
+        ssd = wiscsim.ssdframework.Ssd(conf, env, ncq, rec)
+
+        env.process(ssd.run())
+        env.process(self.proc_host(conf, env, ncq))
+        env.run()
+
+        self.assertEqual(rec.get_count_me("gc", "erase.data.block"), 1)
+
+    def proc_host(self, conf, env, ncq):
+        page_size = conf.page_size
+        n = conf.n_pages_per_block
+
+        # fill a block, then overwrite one of its pages
+        for offset, size in ((0, n * page_size), (0, page_size)):
+            yield ncq.queue.put(wiscsim.hostevent.Event(conf['sector_size'],
+                0, OP_WRITE, offset, size))
+
+        # background GC cleans the block while the host is quiet
+        yield env.timeout(100*MILISEC)
+        yield ncq.queue.put(wiscsim.hostevent.ControlEvent(OP_SHUT_SSD))
+
+
 class TestLevelingWear(unittest.TestCase):
     def test(self):
         conf = create_config()
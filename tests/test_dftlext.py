@@ -1,5 +1,6 @@
 import unittest
 import pprint
+import random
 
 import wiscsim
 from workflow import run_workflow
@@ -409,6 +410,146 @@ class TestTimelineAndFlash(unittest.TestCase):
         self.my_run()
 
 
+def create_dftlext(logicsize_mb):
+    conf = wiscsim.dftlext.Config()
+    conf['sector_size'] = conf['flash_config']['page_size']
+    metadata_dic = choose_exp_metadata(conf, interactive = False)
+    conf.update(metadata_dic)
+
+    conf['ftl_type'] = 'dftlext'
+    conf['simulator_class'] = 'SimulatorNonDESe2e'
+    entries_need = int(logicsize_mb * 2**20 * 0.03 / \
+            conf['flash_config']['page_size'])
+    conf.mapping_cache_bytes = int(entries_need * 8)
+    conf.set_flash_num_blocks_by_bytes(int(logicsize_mb * 2**20 * 1.28))
+    runtime_update(conf)
+
+    rec = wiscsim.recorder.Recorder(
+        output_target = conf['output_target'],
+        output_directory = conf['result_dir'],
+        verbose_level = conf['verbose_level'],
+        print_when_finished = conf['print_when_finished']
+        )
+    rec.disable()
+
+    ftl = wiscsim.dftlext.Dftl(conf, rec,
+        wiscsim.flash.Flash(recorder = rec, confobj = conf))
+    return conf, ftl
+
+
+def write_random_pages(conf, ftl, seed):
+    "Overwrite half of the device three times, so GC has run"
+    rand = random.Random(seed)
+    n = conf.total_num_pages() / 2
+    for i in range(3 * n):
+        ftl.sec_write(rand.randrange(n), 1)
+
+
+class TestVictimBlocksIter(unittest.TestCase):
+    def test_only_taken_blocks_get_info(self):
+        conf, ftl = create_dftlext(2)
+        conf['record_bad_victim_block'] = True
+        write_random_pages(conf, ftl, seed = 0)
+        gc = ftl.garbage_collector
+
+        lpns_of_block_calls = []
+        lpns_of_block = ftl.oob.lpns_of_block
+        def counted_lpns_of_block(blocknum):
+            lpns_of_block_calls.append(blocknum)
+            return lpns_of_block(blocknum)
+        ftl.oob.lpns_of_block = counted_lpns_of_block
+
+        n_infos = [0]
+        block_info_class = wiscsim.dftlext.BlockInfo
+        class CountedBlockInfo(block_info_class):
+            def __init__(self, *args, **kwargs):
+                n_infos[0] += 1
+                block_info_class.__init__(self, *args, **kwargs)
+
+        wiscsim.dftlext.BlockInfo = CountedBlockInfo
+        try:
+            victims = gc.victim_blocks_iter()
+            taken = [victims.next().block_num for _ in range(2)]
+        finally:
+            wiscsim.dftlext.BlockInfo = block_info_class
+
+        self.assertEqual(n_infos[0], 2)
+        self.assertTrue(set(lpns_of_block_calls).issubset(taken))
+
+    def test_benefit_cost_order(self):
+        conf, ftl = create_dftlext(2)
+        write_random_pages(conf, ftl, seed = 0)
+        gc = ftl.garbage_collector
+        block_pool = ftl.block_pool
+        cur_time = ftl.oob.cur_timestamp
+
+        # what the old code took: blocks with benefit/cost > 0, best first
+        current_blocks = block_pool.current_blocks()
+        expected = []
+        for blocknum in block_pool.data_usedblocks + \
+                block_pool.trans_usedblocks:
+            if blocknum in current_blocks:
+                continue
+            bene_cost, _ = gc.benefit_cost(blocknum, cur_time)
+            if bene_cost != 0:
+                expected.append((-bene_cost, blocknum))
+        expected.sort()
+        self.assertGreater(len(expected), 0)
+
+        victims = [(-b_info.value, b_info.block_num)
+                for b_info in gc.victim_blocks_iter()]
+        n = len(expected)
+        # ties may be taken in another order
+        self.assertListEqual([value for value, _ in victims[:n]],
+                [value for value, _ in expected])
+        self.assertListEqual(sorted(victims[:n]), expected)
+        # the new candidates are the blocks invalidated just now
+        for value, blocknum in victims[n:]:
+            self.assertEqual(value, 0)
+            self.assertEqual(gc.block_age(blocknum, cur_time), 0)
+
+
+class TestLogicalClock(unittest.TestCase):
+    def test_block_age(self):
+        conf, ftl = create_dftlext(2)
+        oob = ftl.oob
+        gc = ftl.garbage_collector
+
+        ftl.sec_write(0, 1)
+        old_ppn = ftl.mapping_manager.lpn_to_ppn(0)
+        block, _ = conf.page_to_block_off(old_ppn)
+
+        # overwriting invalidates the old page at the current time
+        ftl.sec_write(0, 1)
+        self.assertEqual(oob.last_inv_time_of_block[block],
+                oob.cur_timestamp)
+        self.assertEqual(gc.block_age(block, oob.cur_timestamp), 0)
+
+        # the age is the number of LBA writes since
+        for sector in range(1, 6):
+            ftl.sec_write(sector, 1)
+        self.assertEqual(gc.block_age(block, oob.cur_timestamp), 5)
+
+    def victims_of_run(self):
+        conf, ftl = create_dftlext(2)
+        gc = ftl.garbage_collector
+
+        victims = []
+        victim_block_info = gc._victim_block_info
+        def recorded_victim_block_info(block_type, blocknum, current_time):
+            victims.append((blocknum, current_time))
+            return victim_block_info(block_type, blocknum, current_time)
+        gc._victim_block_info = recorded_victim_block_info
+
+        write_random_pages(conf, ftl, seed = 1)
+        return victims
+
+    def test_reproducible(self):
+        victims = self.victims_of_run()
+        self.assertGreater(len(victims), 0)
+        self.assertListEqual(self.victims_of_run(), victims)
+
+
 class TestEventIter(unittest.TestCase):
     def test_main2(self):
         conf = config.ConfigNewFlash()
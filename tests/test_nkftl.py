@@ -4,7 +4,7 @@ import simpy
 from collections import namedtuple
 
 from wiscsim.nkftl2 import *
-from wiscsim import flash
+from wiscsim import flash, hostevent
 import wiscsim
 import config
 from commons import *
@@ -364,6 +364,7 @@ class TestBlockInfo(unittest.TestCase):
         self.assertTrue(blkinfo3 < blkinfo1)
 
     def test_priority_queue(self):
+        import Queue
         priority_q = Queue.PriorityQueue()
 
         for i in range(10):
@@ -401,6 +402,23 @@ class TestOutOfBandAreas(unittest.TestCase):
         self.assertEqual(oob.states.is_page_valid(88), False)
         self.assertEqual(oob.states.is_page_valid(89), True)
 
+    def test_remap_many(self):
+        conf = create_config()
+        oob = OutOfBandAreas(conf)
+
+        oob.remap_many(lpns=[8, 9, 10], old_ppns=[None, None, None],
+                new_ppns=[88, 89, 90])
+        oob.remap_many(lpns=[10, 8, 9], old_ppns=[90, 88, None],
+                new_ppns=[92, 91, 93])
+
+        self.assertEqual(oob.translate_ppn_to_lpn(91), 8)
+        self.assertEqual(oob.translate_ppn_to_lpn(93), 9)
+        self.assertEqual(oob.translate_ppn_to_lpn(92), 10)
+        for ppn in [88, 90]:
+            self.assertEqual(oob.states.is_page_valid(ppn), False)
+        for ppn in [89, 91, 92, 93]:
+            self.assertEqual(oob.states.is_page_valid(ppn), True)
+
     def test_wipe_ppn(self):
         conf = create_config()
         oob = OutOfBandAreas(conf)
@@ -443,6 +461,31 @@ class TestOutOfBandAreas(unittest.TestCase):
         lpns_with_na = lpns + ['NA'] * (n_pages_per_block - 3)
         self.assertListEqual(sorted(oob.lpns_of_block(1)), sorted(lpns_with_na))
 
+    def test_aligned_lbn_of_block(self):
+        conf = create_config()
+        oob = OutOfBandAreas(conf)
+
+        n = conf.n_pages_per_block
+
+        self.assertEqual(oob.aligned_lbn_of_block(1), None)
+
+        # lpns of logical block 3 to their own offsets of physical block 1
+        for off in range(2):
+            oob.remap(lpn=3*n+off, old_ppn=None, new_ppn=1*n+off)
+        self.assertEqual(oob.aligned_lbn_of_block(1), 3)
+
+        # wrong offset
+        oob.remap(lpn=3*n+3, old_ppn=None, new_ppn=1*n+2)
+        self.assertEqual(oob.aligned_lbn_of_block(1), None)
+
+        oob.erase_block(1)
+        oob.remap(lpn=4*n, old_ppn=None, new_ppn=1*n)
+        self.assertEqual(oob.aligned_lbn_of_block(1), 4)
+
+        # another logical block
+        oob.remap(lpn=5*n+1, old_ppn=None, new_ppn=1*n+1)
+        self.assertEqual(oob.aligned_lbn_of_block(1), None)
+
 
 class TestLogBlockMappingTable(unittest.TestCase):
     def test_init(self):
@@ -502,6 +545,48 @@ class TestLogBlockMappingTable(unittest.TestCase):
         ppns = logmaptable.next_ppns_to_program(dgn=1, n=4, strip_unit_size=4)
         self.assertEqual(len(ppns), 4)
 
+    def test_find_group_by_pbn(self):
+        conf = create_config()
+        rec = create_recorder(conf)
+        helper = create_global_helper(conf)
+        block_pool = create_nkblockpool(conf)
+
+        logmaptable = LogMappingTable(conf, block_pool, rec, helper)
+
+        ppns = logmaptable.next_ppns_to_program(dgn=1, n=1, strip_unit_size=1)
+        pbn, _ = conf.page_to_block_off(ppns[0])
+        dgn, loggroup = logmaptable.find_group_by_pbn(pbn)
+        self.assertEqual(dgn, 1)
+        self.assertIs(loggroup, logmaptable.log_group_info[1])
+
+        other_pbn = 0 if pbn != 0 else 1
+        loggroup.register_pbn(other_pbn)
+        self.assertEqual(logmaptable.find_group_by_pbn(other_pbn)[0], 1)
+
+        logmaptable.remove_log_block(data_group_no=1, log_pbn=pbn)
+        self.assertEqual(logmaptable.find_group_by_pbn(pbn), (None, None))
+
+    def test_active_data_groups(self):
+        conf = create_config()
+        rec = create_recorder(conf)
+        helper = create_global_helper(conf)
+        block_pool = create_nkblockpool(conf)
+
+        logmaptable = LogMappingTable(conf, block_pool, rec, helper)
+        self.assertListEqual(logmaptable.active_data_groups(), [])
+
+        ppns2 = logmaptable.next_ppns_to_program(dgn=2, n=1, strip_unit_size=1)
+        logmaptable.next_ppns_to_program(dgn=1, n=1, strip_unit_size=1)
+        # in the order they got log blocks
+        self.assertListEqual(logmaptable.active_data_groups(), [2, 1])
+
+        pbn, _ = conf.page_to_block_off(ppns2[0])
+        logmaptable.remove_log_block(data_group_no=2, log_pbn=pbn)
+        self.assertListEqual(logmaptable.active_data_groups(), [1])
+
+        logmaptable.next_ppns_to_program(dgn=2, n=1, strip_unit_size=1)
+        self.assertListEqual(logmaptable.active_data_groups(), [1, 2])
+
 
 class TestDataBlockMappingTable(unittest.TestCase):
     def test_init(self):
@@ -1155,6 +1240,37 @@ class TestSwitchMerge(unittest.TestCase, UseLogBlocksMixin):
         self.assertEqual(mergable, False)
         self.assertEqual(lbn, None)
 
+class TestSwitchMergable(unittest.TestCase, UseLogBlocksMixin):
+    def test_is_switch_mergable_with_invalid_pages(self):
+        pk = create_gc()
+
+        gc, conf, block_pool, rec, oob, helper, \
+        logmaptable, datablocktable, translator, \
+        flashobj, simpy_env, des_flash = pk
+
+        n = conf.n_pages_per_block
+        used_blocks = self.use_log_blocks(conf, oob, block_pool,
+                logmaptable, cnt=n, lpn_start=n, translator=translator)
+
+        # discarded lpn is not anywhere
+        lpn = n + 1
+        _, ppn = logmaptable.lpn_to_ppn(lpn)
+        oob.wipe_ppn(ppn)
+        logmaptable.remove_lpn(lpn)
+
+        mergable, lbn = gc.is_switch_mergable(log_pbn=used_blocks[0])
+        self.assertEqual(mergable, True)
+        self.assertEqual(lbn, 1)
+
+        # overwritten lpn is in another log block
+        self.use_log_blocks(conf, oob, block_pool,
+                logmaptable, cnt=1, lpn_start=lpn, translator=translator)
+
+        mergable, lbn = gc.is_switch_mergable(log_pbn=used_blocks[0])
+        self.assertEqual(mergable, False)
+        self.assertEqual(lbn, None)
+
+
 class TestSwitchMerge(AssertFinishTestCase, UseLogBlocksMixin):
     def test_switch_merge(self):
         pk = create_gc()
@@ -1813,6 +1929,66 @@ class TestFullMerge_two_in_two(AssertFinishTestCase, UseLogBlocksMixin):
         self.set_finished()
 
 
+class TestFullMergeParallelCopy(AssertFinishTestCase, UseLogBlocksMixin):
+    def test(self):
+        """
+        Pages of one logical block are striped over log blocks on all
+        channels. The copy should read them in parallel.
+        """
+        pk = create_gc()
+
+        gc, conf, block_pool, rec, oob, helper, \
+        logmaptable, datablocktable, translator, \
+        flashobj, simpy_env, des_flash = pk
+
+        simpy_env.process(self.proc(pk))
+        simpy_env.run()
+
+    def proc(self, pk):
+        gc, conf, block_pool, rec, oob, helper, \
+        logmaptable, datablocktable, translator, \
+        flashobj, simpy_env, des_flash = pk
+
+        lbn = 1
+        ppns = logmaptable.next_ppns_to_program(dgn=0,
+                n=conf.n_pages_per_block, strip_unit_size=1)
+        lpns = self.page_ext(lbn * conf.n_pages_per_block,
+                conf.n_pages_per_block)
+        self.set_mappings(oob, block_pool, logmaptable, lpns, ppns,
+                translator)
+        used_blocks = set(conf.page_to_block_off(ppn)[0] for ppn in ppns)
+        self.assertEqual(len(used_blocks), conf.n_channels_per_dev)
+
+        start_time = simpy_env.now
+        yield simpy_env.process(
+                gc.aggregate_logical_block(lbn, TAG_FULL_MERGE))
+        elapsed = simpy_env.now - start_time
+
+        # reads of different channels overlap; all the writes go to the
+        # new data block and then the emptied log blocks are erased
+        n_pages_per_channel = conf.n_pages_per_block / conf.n_channels_per_dev
+        self.assertEqual(elapsed,
+                n_pages_per_channel * conf.page_read_time() +
+                conf.n_pages_per_block * conf.page_prog_time() +
+                len(used_blocks) * conf.block_erase_time())
+
+        found, pbn = datablocktable.lbn_to_pbn(lbn)
+        self.assertEqual(found, True)
+        for i in range(conf.n_pages_per_block):
+            ppn = conf.block_off_to_page(pbn, i)
+            self.assertTrue(oob.states.is_page_valid(ppn))
+            self.assertEqual(oob.translate_ppn_to_lpn(ppn),
+                    conf.block_off_to_page(lbn, i))
+        for i in range(conf.n_pages_per_block):
+            lpn = conf.block_off_to_page(lbn, i)
+            found, _ = logmaptable.lpn_to_ppn(lpn)
+            self.assertEqual(found, False)
+        for blocknum in used_blocks:
+            self.assertIn(blocknum, block_pool.freeblocks)
+
+        self.set_finished()
+
+
 class TestFullMerge_with_data_blocks(AssertFinishTestCase, UseLogBlocksMixin):
     def test(self):
         pk = create_gc()
@@ -2588,6 +2764,30 @@ class TestFTLOperations(AssertFinishTestCase):
 
         self.set_finished()
 
+    def test_write_without_data(self):
+        ftl, conf, rec, env = create_nkftl()
+        conf['store_page_data'] = False
+        ftl = Ftl(conf, rec, wiscsim.flash.Flash(recorder=rec, confobj=conf),
+                env, ftl.des_flash)
+
+        env.process(self.proc_test_write_without_data(env, ftl, conf))
+        env.run()
+
+    def proc_test_write_without_data(self, env, ftl, conf):
+        ext = Extent(lpn_start=1, lpn_count=20)
+        yield env.process(ftl.write_ext(ext, data=range(20)))
+        yield env.process(ftl.lba_write(30, data='x'))
+
+        for lpn in ext.lpn_iter():
+            found, ppn, _ = ftl.lpn_to_ppn(lpn)
+            self.assertEqual(found, True)
+        self.assertEqual(len(ftl.flash.data), 0)
+
+        data = yield env.process(ftl.read_ext(ext))
+        self.assertEqual(data, [None] * ext.lpn_count)
+
+        self.set_finished()
+
     def test_discard(self):
         ftl, conf, rec, env = create_nkftl()
 
@@ -3571,6 +3771,103 @@ class TestBlockIter(unittest.TestCase):
 
 
 
+class TestShardedSimulation(unittest.TestCase):
+    def create_config(self):
+        conf = wiscsim.nkftl2.Config()
+        conf['SSDFramework']['ncq_depth'] = 1
+
+        conf['flash_config']['n_pages_per_block'] = 16
+        conf['flash_config']['n_blocks_per_plane'] = 64
+        conf['flash_config']['n_planes_per_chip'] = 1
+        conf['flash_config']['n_chips_per_package'] = 1
+        conf['flash_config']['n_packages_per_channel'] = 1
+        conf['flash_config']['n_channels_per_dev'] = 4
+
+        conf['nkftl']['max_blocks_in_log_group'] = 2
+        conf['nkftl']['n_blocks_in_data_group'] = 4
+
+        conf['ftl_type'] = 'nkftl2'
+        conf['simulator_class'] = 'SimulatorNkftlSharded'
+        conf['n_simulation_shards'] = 2
+
+        utils.set_exp_metadata(conf, save_data = False,
+                expname = 'test_expname',
+                subexpname = 'test_subexpname')
+        utils.runtime_update(conf)
+
+        return conf
+
+    def test_split_events(self):
+        conf = self.create_config()
+        group_bytes = conf.n_pages_per_data_group() * conf.page_size
+
+        ctrl_event = hostevent.ControlEvent(OP_ENABLE_RECORDER)
+        # the last page of group 2 and the first page of group 3
+        event = hostevent.Event(512, 0, OP_WRITE,
+                3 * group_bytes - conf.page_size, 2 * conf.page_size)
+        shards = [list(wiscsim.simulator.shard_events(conf,
+                    [ctrl_event, event], 2, shard_id))
+                for shard_id in range(2)]
+
+        self.assertEqual(len(shards), 2)
+        self.assertIs(shards[0][0], ctrl_event)
+        self.assertIs(shards[1][0], ctrl_event)
+        # group 2 is group 1 of shard 0
+        self.assertEqual(shards[0][1].offset, 2 * group_bytes - conf.page_size)
+        self.assertEqual(shards[0][1].size, conf.page_size)
+        # group 3 is group 1 of shard 1
+        self.assertEqual(shards[1][1].offset, group_bytes)
+        self.assertEqual(shards[1][1].size, conf.page_size)
+
+    def random_write_events(self, conf):
+        rand = random.Random(1)
+        n_lpns = conf.n_pages_per_block * conf.n_blocks_per_dev / 4
+        yield hostevent.ControlEvent(OP_ENABLE_RECORDER)
+        for i in range(1000):
+            lpn = rand.randint(0, n_lpns - 1)
+            yield hostevent.Event(512, 0, OP_WRITE,
+                lpn * conf.page_size, conf.page_size)
+
+    def test_run(self):
+        conf = self.create_config()
+
+        sim = wiscsim.simulator.create_simulator(conf['simulator_class'],
+                conf, list(self.random_write_events(conf)))
+        sim.run()
+
+        rec = sim.recorder
+        self.assertEqual(rec.get_general_accumulater_cnt('traffic', 'write'),
+                1000 * conf.page_size)
+        self.assertEqual(rec.get_result_by_one_key('n_simulation_shards'), 2)
+
+    def test_run_generator(self):
+        # every shard reads its own copy of a one-pass trace
+        conf = self.create_config()
+
+        sim = wiscsim.simulator.create_simulator(conf['simulator_class'],
+                conf, self.random_write_events(conf))
+        sim.run()
+
+        self.assertEqual(sim.recorder.get_general_accumulater_cnt(
+            'traffic', 'write'), 1000 * conf.page_size)
+
+    def test_shard_sizes(self):
+        conf = self.create_config()
+        conf['n_simulation_shards'] = 4
+        # 256 blocks make 85 data groups of 3 blocks
+        conf['nkftl']['n_blocks_in_data_group'] = 3
+        self.assertEqual(conf.n_datagroups_per_dev(), 85)
+
+        with self.assertRaises(ValueError):
+            wiscsim.simulator.create_simulator(conf['simulator_class'],
+                    conf, [])
+
+        conf['flash_config']['n_blocks_per_plane'] = 66
+        with self.assertRaises(ValueError):
+            wiscsim.simulator.create_simulator(conf['simulator_class'],
+                    conf, [])
+
+
 # Add test without lpn overlap
 
 def main():
@@ -1,4 +1,5 @@
 import unittest
+import random
 from wiscsim.tagblockpool import *
 
 
@@ -34,6 +35,18 @@ class TestTagBlockPool(unittest.TestCase):
         self.assertEqual(pool.count_blocks(tag=TDATA), 1)
         self.assertEqual(pool.count_blocks(tag=TTRANS), 2)
 
+    def test_tag_order(self):
+        pool = TagBlockPool(5, [TDATA])
+        for blocknum in [3, 0, 4]:
+            pool.change_tag(blocknum, TFREE, TDATA)
+        self.assertListEqual(pool.get_blocks_of_tag(TDATA), [3, 0, 4])
+        self.assertListEqual(pool.get_blocks_of_tag(TFREE), [1, 2])
+
+        pool.change_tag(0, TDATA, TFREE)
+        self.assertListEqual(pool.get_blocks_of_tag(TDATA), [3, 4])
+        self.assertListEqual(pool.get_blocks_of_tag(TFREE), [1, 2, 0])
+        self.assertEqual(pool.get_tag(0), TFREE)
+
     def test_pick_and_change(self):
         pool = TagBlockPool(100, [TDATA, TTRANS])
         block = pool.pick_and_move(src=TFREE, dst=TDATA)
@@ -132,6 +145,30 @@ class TestTagBlockPool(unittest.TestCase):
 
         self.assertEqual(least_used, 9)
 
+    def test_free_block_pick_order(self):
+        pool = TagBlockPool(20, [TDATA])
+        rand = random.Random(1)
+
+        for i in range(300):
+            blocknum = rand.choice(range(20))
+            if pool.get_tag(blocknum) == TFREE:
+                pool.change_tag(blocknum, TFREE, TDATA)
+            else:
+                pool.change_tag(blocknum, TDATA, TFREE)
+
+            # the order of sorting all blocks by count
+            by_cnt = [block for block, _ in
+                    pool.get_erasure_count().most_common()
+                    if pool.get_tag(block) == TFREE]
+            self.assertEqual(pool.pick(TFREE, choice=MOST_ERASED),
+                    by_cnt[0] if by_cnt else None)
+            self.assertEqual(pool.pick(TFREE, choice=LEAST_ERASED),
+                    by_cnt[-1] if by_cnt else None)
+            self.assertListEqual(pool.get_least_or_most_erased_blocks(
+                TFREE, choice=MOST_ERASED, nblocks=3), by_cnt[:3])
+            self.assertListEqual(pool.get_least_or_most_erased_blocks(
+                TFREE, choice=LEAST_ERASED, nblocks=3), by_cnt[::-1][:3])
+
     def test_getting_count_distribution(self):
         pool = TagBlockPool(5, [TDATA, TTRANS])
 
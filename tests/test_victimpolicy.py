@@ -0,0 +1,141 @@
+import random
+import unittest
+from wiscsim.victimpolicy import *
+
+
+TDATA = 'TDATA'
+TTRANS = 'TTRANS'
+
+
+def create_policy(name, valid_ratios, ages, window=2, d=2, seed=0):
+    conf = {'gc_victim_policy': name,
+            'gc_victim_window': window,
+            'gc_victim_d_choices': d,
+            'gc_victim_seed': seed}
+    return create_victim_policy(conf,
+            lambda block: valid_ratios[block],
+            lambda block: ages[block])
+
+
+class TestVictimPolicy(unittest.TestCase):
+    def setUp(self):
+        # block: valid ratio, age
+        self.valid_ratios = {0: 0.5, 1: 0.1, 2: 0.9, 3: 0.25}
+        self.ages = {0: 100, 1: 1, 2: 1000, 3: 10}
+        self.candidates = [(TDATA, 0), (TDATA, 1), (TTRANS, 2), (TDATA, 3)]
+
+    def victims(self, name, **kwargs):
+        policy = create_policy(name, self.valid_ratios, self.ages, **kwargs)
+        return [block for _, block in policy.victims(list(self.candidates))]
+
+    def test_greedy(self):
+        self.assertListEqual(self.victims(GREEDY), [1, 3, 0, 2])
+
+    def test_cost_benefit(self):
+        # 50, 4.5, 55.6, 15
+        self.assertListEqual(self.victims(COST_BENEFIT), [2, 0, 3, 1])
+
+    def test_fifo(self):
+        self.assertListEqual(self.victims(FIFO), [2, 0, 3, 1])
+
+    def test_windowed_greedy(self):
+        # the window starts with the two oldest blocks, 2 and 0. Block 1
+        # has the fewest valid pages but is the youngest, so it is not
+        # taken until it is in the window.
+        self.assertListEqual(self.victims(WINDOWED_GREEDY, window=2),
+                [0, 3, 1, 2])
+
+        # with a window of one, it is fifo
+        self.assertListEqual(self.victims(WINDOWED_GREEDY, window=1),
+                self.victims(FIFO))
+
+        # with the window as large as the candidate set, it is greedy
+        self.assertListEqual(self.victims(WINDOWED_GREEDY, window=4),
+                [1, 3, 0, 2])
+
+    def test_d_choices(self):
+        victims = self.victims(D_CHOICES, d=2)
+        self.assertListEqual(sorted(victims), [0, 1, 2, 3])
+
+        # with d as large as the candidate set, it is greedy
+        self.assertListEqual(self.victims(D_CHOICES, d=4), [1, 3, 0, 2])
+
+    def test_seed(self):
+        for name in (WINDOWED_GREEDY, D_CHOICES):
+            runs = [self.victims(name, window=2, d=2, seed=7)
+                    for _ in range(3)]
+            self.assertListEqual(runs[0], runs[1])
+            self.assertListEqual(runs[0], runs[2])
+
+    def test_unknown(self):
+        with self.assertRaises(NotImplementedError):
+            create_policy('no-such-policy', self.valid_ratios, self.ages)
+
+    def test_benefit_cost(self):
+        self.assertEqual(benefit_cost(0, 1), float('inf'))
+        self.assertEqual(benefit_cost(1, 100), 0)
+        self.assertEqual(benefit_cost(0.5, 100), 50)
+
+
+class EvenBlocks(BlockCandidates):
+    "Even blocks are candidates"
+    def __init__(self, n_blocks):
+        super(EvenBlocks, self).__init__(range(n_blocks))
+        self.n_lookups = 0
+
+    def candidate_type(self, blocknum):
+        self.n_lookups += 1
+        if blocknum % 2 == 0:
+            return TDATA
+        return None
+
+
+class TestBlockCandidates(unittest.TestCase):
+    def test_sample(self):
+        candidates = EvenBlocks(1000)
+        rng = random.Random(0)
+
+        sampled = candidates.sample(rng, 8)
+        self.assertEqual(len(sampled), 8)
+        self.assertEqual(len(set(sampled)), 8)
+        for block_type, block in sampled:
+            self.assertEqual(block_type, TDATA)
+            self.assertEqual(block % 2, 0)
+        # half of the blocks are candidates
+        self.assertTrue(candidates.n_lookups < 100)
+
+    def test_sample_all(self):
+        candidates = EvenBlocks(10)
+        rng = random.Random(0)
+
+        sampled = candidates.sample(rng, 10)
+        self.assertListEqual(sorted(sampled),
+                [(TDATA, block) for block in range(0, 10, 2)])
+        # each block is looked up once
+        self.assertEqual(candidates.n_lookups, 10)
+
+    def test_discard(self):
+        candidates = EvenBlocks(10)
+        rng = random.Random(0)
+        for block in (0, 2, 4, 6):
+            candidates.discard(block)
+
+        self.assertListEqual(list(candidates), [(TDATA, 8)])
+        self.assertListEqual(candidates.sample(rng, 3), [(TDATA, 8)])
+
+        candidates.discard(8)
+        self.assertListEqual(candidates.sample(rng, 3), [])
+
+    def test_d_choices(self):
+        valid_ratios = {block: 1.0 / (block + 1) for block in range(100)}
+        policy = create_policy(D_CHOICES, valid_ratios, {}, d=100)
+
+        victims = [block for _, block in policy.victims(EvenBlocks(100))]
+        self.assertListEqual(victims, range(98, -1, -2))
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+import array
+
 import bitarray
 import config
 
@@ -18,6 +20,65 @@ class FlashBitmap2(object):
         self.bitmap = bitarray.bitarray(2 * conf.total_num_pages())
         self.bitmap.setall(0)
 
+        self._reset_counters()
+
+    def _reset_counters(self):
+        """
+        Per-block counts of valid and invalid pages, kept in step with the
+        bitmap so block ratios do not scan pages.
+
+        _garbage_blocks[k] is the set of blocks that have k valid pages and
+        at least one invalid page. GC reads victims from it in ascending k.
+        _garbage_array holds the same blocks densely, in no order, and
+        _garbage_pos[block] is the position of block in it, or -1. A block
+        is swapped out of the array when it leaves, so the array can be
+        sampled by position.
+        """
+        n_blocks = self.conf.total_num_pages() // self.conf.n_pages_per_block
+        self._valid_cnt = array.array('l', [0]) * n_blocks
+        self._invalid_cnt = array.array('l', [0]) * n_blocks
+        self._garbage_blocks = [set()
+                for _ in range(self.conf.n_pages_per_block + 1)]
+        self._garbage_array = array.array('l')
+        self._garbage_pos = array.array('l', [-1]) * n_blocks
+
+    def _change_counts(self, blocknum, valid_delta, invalid_delta):
+        old_valid = self._valid_cnt[blocknum]
+        old_invalid = self._invalid_cnt[blocknum]
+        new_valid = old_valid + valid_delta
+        new_invalid = old_invalid + invalid_delta
+        self._valid_cnt[blocknum] = new_valid
+        self._invalid_cnt[blocknum] = new_invalid
+
+        if old_invalid > 0:
+            self._garbage_blocks[old_valid].discard(blocknum)
+        if new_invalid > 0:
+            self._garbage_blocks[new_valid].add(blocknum)
+
+        if old_invalid == 0 and new_invalid > 0:
+            self._garbage_pos[blocknum] = len(self._garbage_array)
+            self._garbage_array.append(blocknum)
+        elif old_invalid > 0 and new_invalid == 0:
+            pos = self._garbage_pos[blocknum]
+            last = self._garbage_array.pop()
+            if last != blocknum:
+                self._garbage_array[pos] = last
+                self._garbage_pos[last] = pos
+            self._garbage_pos[blocknum] = -1
+
+    def _set_page_bits(self, pagenum, valid_bit, invalid_bit):
+        # bit 2p is the INVALID bit and bit 2p+1 the VALID bit
+        s = 2 * pagenum
+        bitmap = self.bitmap
+        old_invalid_bit, old_valid_bit = bitmap[s], bitmap[s + 1]
+        if old_valid_bit == valid_bit and old_invalid_bit == invalid_bit:
+            return
+        bitmap[s] = invalid_bit
+        bitmap[s + 1] = valid_bit
+        self._change_counts(pagenum // self.conf.n_pages_per_block,
+                int(valid_bit) - int(old_valid_bit),
+                int(invalid_bit) - int(old_invalid_bit))
+
     def pagenum_to_slice_range(self, pagenum):
         "2 is the number of bits representing the state of a page"
         return 2 * pagenum, 2 * (pagenum + 1)
@@ -33,55 +94,104 @@ class FlashBitmap2(object):
         return s, e
 
     def validate_page(self, pagenum):
-        s, e = self.pagenum_to_slice_range(pagenum)
-        self.bitmap[s:e] = self.VALID
+        self._set_page_bits(pagenum, True, False)
 
     def invalidate_page(self, pagenum):
-        s, e = self.pagenum_to_slice_range(pagenum)
-        self.bitmap[s:e] = self.INVALID
+        self._set_page_bits(pagenum, False, True)
+
+    def _set_range_state(self, start, end, state, valid, invalid):
+        """
+        Set pages [start, end) to state. Each piece within one block is
+        assigned with a single slice; the counters are updated from the
+        bits the slice had before.
+        """
+        n_pages_per_block = self.conf.n_pages_per_block
+        bitmap = self.bitmap
+        while start < end:
+            blocknum = start // n_pages_per_block
+            piece_end = min(end, (blocknum + 1) * n_pages_per_block)
+            n = piece_end - start
+            s, e = 2 * start, 2 * piece_end
+
+            old_invalid = bitmap[s:e:2].count()
+            old_valid = bitmap[s+1:e:2].count()
+            bitmap[s:e] = state * n
+            self._change_counts(blocknum, valid * n - old_valid,
+                    invalid * n - old_invalid)
+
+            start = piece_end
+
+    def validate_range(self, start, end):
+        "validate pages [start, end)"
+        self._set_range_state(start, end, self.VALID, 1, 0)
+
+    def invalidate_range(self, start, end):
+        "invalidate pages [start, end)"
+        self._set_range_state(start, end, self.INVALID, 0, 1)
+
+    def invalidate_many(self, sorted_ppns):
+        """
+        Invalidate pages in sorted_ppns. Contiguous runs are invalidated
+        as ranges. Duplicates are fine.
+        """
+        for start, end in contiguous_runs(sorted_ppns):
+            self.invalidate_range(start, end)
+
+    def validate_many(self, sorted_ppns):
+        for start, end in contiguous_runs(sorted_ppns):
+            self.validate_range(start, end)
 
     def validate_block(self, blocknum):
         start, end = self.conf.block_to_page_range(blocknum)
-        for pg in range(start, end):
-            self.validate_page(pg)
+        self.validate_range(start, end)
 
     def invalidate_block(self, blocknum):
         start, end = self.conf.block_to_page_range(blocknum)
-        for pg in range(start, end):
-            self.validate_page(pg)
+        self.invalidate_range(start, end)
 
     def erase_block(self, blocknum):
         s, e = self.blocknum_to_slice_range(blocknum)
         self.bitmap[s:e] = 0
+        self._change_counts(blocknum, -self._valid_cnt[blocknum],
+                -self._invalid_cnt[blocknum])
 
-    def block_invalid_ratio(self, blocknum):
-        start, end = self.conf.block_to_page_range(blocknum)
-        cnt = 0
-        for pg in range(start, end):
-            if not self.is_page_valid(pg):
-                cnt += 1
+    def block_valid_count(self, blocknum):
+        return self._valid_cnt[blocknum]
 
-        return cnt / float(self.conf.n_pages_per_block)
+    def block_invalid_count(self, blocknum):
+        return self._invalid_cnt[blocknum]
 
-    def block_valid_ratio(self, blocknum):
-        start, end = self.conf.block_to_page_range(blocknum)
-        cnt = 0
-        for pg in range(start, end):
-            if self.is_page_valid(pg):
-                cnt += 1
+    def garbage_blocks_with_valid_count(self, valid_cnt):
+        """
+        Blocks that have exactly valid_cnt valid pages and at least one
+        invalid page. The returned set is live; copy it before changing
+        the bitmap while iterating.
+        """
+        return self._garbage_blocks[valid_cnt]
+
+    def garbage_block_array(self):
+        """
+        All blocks that have at least one invalid page, in an array in no
+        particular order. The array is live.
+        """
+        return self._garbage_array
 
-        ret = cnt / float(self.conf.n_pages_per_block)
-        return ret
+    def valid_count_in_range(self, start, end):
+        "number of valid pages in [start, end)"
+        return self.bitmap[2 * start + 1:2 * end:2].count()
 
-    def block_erased_ratio(self, blocknum):
-        start, end = self.conf.block_to_page_range(blocknum)
-        cnt = 0
-        for pg in range(start, end):
-            if self.is_page_erased(pg):
-                cnt += 1
+    def block_invalid_ratio(self, blocknum):
+        # erased pages count as not valid, as they always have
+        n = self.conf.n_pages_per_block
+        return (n - self._valid_cnt[blocknum]) / float(n)
 
-        ret = cnt / float(self.conf.n_pages_per_block)
-        return ret
+    def block_valid_ratio(self, blocknum):
+        return self._valid_cnt[blocknum] / float(self.conf.n_pages_per_block)
+
+    def block_erased_ratio(self, blocknum):
+        n = self.conf.n_pages_per_block
+        return (n - self._valid_cnt[blocknum] - self._invalid_cnt[blocknum]) \
+                / float(n)
 
     def is_page_valid(self, pagenum):
         s, e = self.pagenum_to_slice_range(pagenum)
@@ -128,5 +238,26 @@ class FlashBitmap2(object):
         """ this method should be called in FTL """
         # set the state of all pages to ERASED
         self.bitmap.setall(0)
+        self._reset_counters()
 
 
+def contiguous_runs(sorted_ppns):
+    """
+    Yield (start, end) of each run of consecutive ppns, end excluded.
+    sorted_ppns must be sorted. Repeated ppns are merged into the run.
+    """
+    start = None
+    end = None
+    for ppn in sorted_ppns:
+        if start is None:
+            start, end = ppn, ppn + 1
+        elif ppn < end:
+            continue
+        elif ppn == end:
+            end += 1
+        else:
+            yield start, end
+            start, end = ppn, ppn + 1
+
+    if start is not None:
+        yield start, end
@@ -46,6 +46,9 @@ class BlockPool(object):
 
         return blocks1 + blocks2
 
+    def get_tag(self, blocknum):
+        return self.pool.get_tag(blocknum)
+
     def get_wear_status(self):
         return self.pool.get_wear_status()
 
@@ -93,6 +93,43 @@ def create_flashrequest(addr, op):
     return req
 
 
+# Channel priorities, smaller is served first
+PRIORITY_HOST_READ, PRIORITY_HOST_WRITE, PRIORITY_GC = (0, 1, 2)
+
+# recorder op name or tag -> channel priority. Translation pages are read
+# and written on behalf of host requests. nkftl2 tags its merges, erases
+# and wear leveling with plain strings (the TAG_* of nkftl2.py).
+TAG_OP_PRIORITIES = {
+    'read_user':        PRIORITY_HOST_READ,
+    'read_trans':       PRIORITY_HOST_READ,
+    'write_user':       PRIORITY_HOST_WRITE,
+    'prog_trans':       PRIORITY_HOST_WRITE,
+    'read.data.gc':     PRIORITY_GC,
+    'write.data.gc':    PRIORITY_GC,
+    'erase.data.gc':    PRIORITY_GC,
+    'read.trans.gc':    PRIORITY_GC,
+    'write.trans.gc':   PRIORITY_GC,
+    'erase.trans.gc':   PRIORITY_GC,
+    'PARTIAL.MERGE':    PRIORITY_GC,
+    'SWITCH.MERGE':     PRIORITY_GC,
+    'FULL.MERGE':       PRIORITY_GC,
+    'WRITE.DRIVEN.DIRECT.ERASE': PRIORITY_GC,
+    'THRESHOLD.GC.DIRECT.ERASE': PRIORITY_GC,
+    'SIMPLE.ERASE':     PRIORITY_GC,
+    'wearleveling':     PRIORITY_GC,
+    }
+
+
+def tag_to_priority(tag):
+    "Operations with unknown tags are served as host writes"
+    if isinstance(tag, dict):
+        tag = tag.get('op', None)
+    try:
+        return TAG_OP_PRIORITIES[tag]
+    except (KeyError, TypeError):
+        return PRIORITY_HOST_WRITE
+
+
 class Controller(object):
     """
     This base class implements the core functions of a flash controller.
@@ -415,7 +452,32 @@ class Channel2(Channel):
 class Channel3(Channel2):
     """
     Operations can be tagged
+
+    With channel_priority_scheduling, waiting operations are served by
+    priority: host reads, then host writes, then GC (see tag_to_priority).
+    Operations of the same priority are served in arrival order.
+
+    With flash_suspend, a host read suspends a program or erase that is
+    in progress. The read takes t_SUSPEND longer, and the suspended
+    operation resumes later with t_RESUME added to its remaining time.
+    It waits to resume by the time it first arrived, ahead of operations
+    of its priority that arrived after it.
     """
+    def __init__(self, simpy_env, conf, recorderobj, channel_id = None):
+        super(Channel3, self).__init__(simpy_env, conf, recorderobj,
+                channel_id)
+
+        self.priority_scheduling = conf.get('channel_priority_scheduling',
+                False)
+        self.suspend = conf.get('flash_suspend', False)
+        if self.suspend is True:
+            self.resource = simpy.PreemptiveResource(self.env, capacity = 1)
+        elif self.priority_scheduling is True:
+            self.resource = simpy.PriorityResource(self.env, capacity = 1)
+
+        self.suspend_time = conf['flash_config'].get('t_SUSPEND', 0)
+        self.resume_time = conf['flash_config'].get('t_RESUME', 0)
+
     def counter_set_name(self):
         return "channel_busy_time"
 
@@ -433,50 +495,69 @@ class Channel3(Channel2):
                 channel=channel_id, start_time=start_time, end_time=end_time,
                 **tag)
 
+    def _request(self, priority, preempt, arrival_time):
+        if self.suspend is True or self.priority_scheduling is True:
+            # simpy orders requests of the same priority by when they are
+            # made, so a resumed operation would queue behind the ones that
+            # arrived while it ran. Its arrival time in the priority keeps
+            # its place.
+            return self.resource.request(priority = (priority, arrival_time),
+                    preempt = preempt)
+        else:
+            return self.resource.request()
+
+    def _in_suspendable_op(self):
+        return any(getattr(req, 'suspendable', False)
+                for req in self.resource.users)
+
+    def _occupy(self, op, duration, tag):
+        """
+        Hold the channel for duration. A program or erase may be suspended
+        and resumed several times before it finishes.
+        """
+        priority = tag_to_priority(tag)
+        suspendable = op in ('write', 'erase')
+        preempt = self.suspend is True and op == 'read' and \
+                priority == PRIORITY_HOST_READ and self._in_suspendable_op()
+        if preempt is True:
+            duration += self.suspend_time
+            self.recorder.count_me('flash_ops', 'suspend')
+
+        remaining = duration
+        arrival_time = self.env.now
+        done = False
+        while done is False:
+            with self._request(priority, preempt, arrival_time) as request:
+                yield request
+                request.suspendable = suspendable
+                s = self.env.now
+                try:
+                    yield self.env.timeout( remaining )
+                    done = True
+                except simpy.Interrupt:
+                    remaining = remaining - (self.env.now - s) + \
+                            self.resume_time
+                e = self.env.now
+                self.recorder.add_to_timer(
+                    self.counter_set_name(),
+                    "channel_{id}-{op}-{tag}".format(id = self.channel_id,
+                        op = op, tag = self.recorder.tag_group(tag)),
+                    e - s)
+                self._write_channel_timeline(channel_id=self.channel_id,
+                        start_time=s, end_time=e, tag=tag)
+            # a resumed operation does not preempt anyone
+            preempt = False
+
     def write_page(self, tag, addr = None , data = None):
         """
         If you want to when this operation is finished, just print env.now.
         If you want to know how long it takes, use env.now before and after
         the operation.
         """
-        with self.resource.request() as request:
-            yield request
-            s = self.env.now
-            yield self.env.timeout( self.program_time )
-            e = self.env.now
-            self.recorder.add_to_timer(
-                self.counter_set_name(),
-                "channel_{id}-write-{tag}".format(id = self.channel_id,
-                    tag = self.recorder.tag_group(tag)),
-                e - s)
-            self._write_channel_timeline(channel_id=self.channel_id,
-                    start_time=s, end_time=e, tag=tag)
+        return self._occupy('write', self.program_time, tag)
 
     def read_page(self, tag, addr = None):
-        with self.resource.request() as request:
-            yield request
-            s = self.env.now
-            yield self.env.timeout( self.read_time )
-            e = self.env.now
-            self.recorder.add_to_timer(
-                self.counter_set_name(),
-                "channel_{id}-read-{tag}".format(id = self.channel_id,
-                    tag = self.recorder.tag_group(tag)),
-                e - s)
-            self._write_channel_timeline(channel_id=self.channel_id,
-                    start_time=s, end_time=e, tag=tag)
+        return self._occupy('read', self.read_time, tag)
 
     def erase_block(self, tag, addr = None):
-        with self.resource.request() as request:
-            yield request
-            s = self.env.now
-            yield self.env.timeout( self.erase_time )
-            e = self.env.now
-            self.recorder.add_to_timer(
-                self.counter_set_name(),
-                "channel_{id}-erase-{tag}".format(id = self.channel_id,
-                    tag = self.recorder.tag_group(tag)),
-                e - s)
-            self._write_channel_timeline(channel_id=self.channel_id,
-                    start_time=s, end_time=e, tag=tag)
-
+        return self._occupy('erase', self.erase_time, tag)
@@ -1,3 +1,5 @@
+import heapq
+
 from tagblockpool import *
 from ftlsim_commons import random_channel_id
 from utilities import utils
@@ -13,8 +15,12 @@ class MultiChannelBlockPoolBase(object):
         self.total_blocks = n_blocks_per_channel * n_channels
         self.tags = tags
 
+        # erase counts of all blocks on the device, kept by channel pools
+        self._erasure_hist = EraseCountHistogram()
+
         self._channel_pool = [
-            ChannelBlockPool(n_blocks_per_channel, tags, n_pages_per_block, i) \
+            ChannelBlockPool(n_blocks_per_channel, tags, n_pages_per_block, i,
+                erasure_hists=[self._erasure_hist]) \
                 for i in range(n_channels)]
 
         # TODO: each tag has its own _next_channel
@@ -56,15 +62,10 @@ class MultiChannelBlockPoolBase(object):
         return ret
 
     def get_erasure_count_dist(self):
-        aggregated_dist = Counter()
-        for pool in self._channel_pool:
-            dist = pool.get_erasure_count_dist()
-            aggregated_dist += dist
-
-        return aggregated_dist
+        return Counter(self._erasure_hist.dist)
 
     def get_top_or_bottom_erasure_total(self, choice, need_nblocks):
-        dist = self.get_erasure_count_dist()
+        dist = self._erasure_hist.dist
         erase_cnt, block_cnt = utils.top_or_bottom_total(dist, need_nblocks, choice)
 
         return erase_cnt, block_cnt
@@ -90,7 +91,17 @@ class MultiChannelBlockPoolBase(object):
 
         return factor, diff
 
+    def get_erasure_count_range(self):
+        "Return the smallest and largest erase counts and their sum"
+        hist = self._erasure_hist
+        return hist.min_cnt, hist.max_cnt, hist.total
+
     def need_wear_leveling(self):
+        min_cnt, max_cnt, _ = self.get_erasure_count_range()
+        if max_cnt - min_cnt <= self.leveling_diff:
+            # top and bottom averages cannot differ by more than this
+            return False
+
         factor, diff = self.get_wear_status()
 
         print factor, self.leveling_factor
@@ -122,6 +133,29 @@ class MultiChannelBlockPoolBase(object):
 
         return blocks
 
+    def iter_blocks_by_erasure(self, tags, choice=LEAST_ERASED):
+        """
+        Yield (erase count, blocknum, tag) of blocks of tags on all channels,
+        in the order of reversed(get_erasure_count().most_common()) for
+        LEAST_ERASED. Only the blocks visited are sorted.
+        """
+        if choice == LEAST_ERASED:
+            sign = 1
+        elif choice == MOST_ERASED:
+            sign = -1
+        else:
+            raise NotImplementedError
+
+        def channel_blocks(pool, tag):
+            for count, block_off in pool.iter_blocks_by_erasure(tag, choice):
+                blocknum = self._channel_to_global(pool.channel_id, block_off)
+                yield sign * count, -sign * blocknum, tag
+
+        merged = heapq.merge(*[channel_blocks(pool, tag)
+            for pool in self._channel_pool for tag in tags])
+        for key_count, key_blocknum, tag in merged:
+            yield sign * key_count, -sign * key_blocknum, tag
+
     def get_erasure_count(self):
         global_counter = Counter()
         for pool in self._channel_pool:
@@ -162,6 +196,10 @@ class MultiChannelBlockPoolBase(object):
         channel_id, block_off = self._global_to_channel(blocknum)
         self._channel_pool[channel_id].change_tag(block_off, src, dst)
 
+    def get_tag(self, blocknum):
+        channel_id, block_off = self._global_to_channel(blocknum)
+        return self._channel_pool[channel_id].get_tag(block_off)
+
     def _channel_to_global(self, channel_id, blocknum):
         ret = channel_id * self.n_blocks_per_channel + blocknum
         assert ret < self.total_blocks
@@ -266,8 +304,10 @@ class MultiChannelBlockPool(MultiChannelBlockPoolBase):
 
 
 class ChannelBlockPool(BlockPoolWithCurBlocks):
-    def __init__(self, n, tags, n_pages_per_block, channel_id):
-        super(ChannelBlockPool, self).__init__(n, tags, n_pages_per_block)
+    def __init__(self, n, tags, n_pages_per_block, channel_id,
+            erasure_hists=()):
+        super(ChannelBlockPool, self).__init__(n, tags, n_pages_per_block,
+                erasure_hists)
         self.channel_id = channel_id
 
 
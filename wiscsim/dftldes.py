@@ -1,5 +1,6 @@
+import array
 import bitarray
-from collections import deque, Counter
+from collections import deque, Counter, OrderedDict
 import csv
 import datetime
 import heapq
@@ -20,8 +21,9 @@ import recorder
 from utilities import utils
 from commons import *
 from ftlsim_commons import *
-from .blkpool import BlockPool, MOST_ERASED, LEAST_ERASED
+from .blkpool import BlockPool, MOST_ERASED, LEAST_ERASED, TDATA, TTRANS
 from .bitmap import FlashBitmap2
+from . import victimpolicy
 
 
 
@@ -223,10 +225,14 @@ class Ftl(object):
         old_ppns = yield self.env.process(
                 self._mappings.lpns_to_ppns(lpns, tag))
 
-        for lpn, old_ppn, new_ppn in zip(lpns, old_ppns, new_ppns):
-            yield self.env.process(
-                self._update_metadata_for_relocating_lpn(
-                    lpn, old_ppn, new_ppn, tag))
+        # mappings in cache, one batch per m_vpn
+        yield self.env.process(
+            self._mappings.update_batch(dict(zip(lpns, new_ppns)), tag))
+
+        # oob state
+        # oob ppn->lpn/vpn
+        self.oob.relocate_data_pages(lpns=lpns, old_ppns=old_ppns,
+                new_ppns=new_ppns, update_time=True)
 
     def _update_metadata_for_relocating_lpn(self, lpn, old_ppn, new_ppn,
             tag=None):
@@ -364,6 +370,13 @@ class Ftl(object):
     def clean(self, forced=True):
         yield self.env.process(self._cleaner.clean())
 
+    def is_background_cleaning_needed(self):
+        return self._cleaner.is_background_cleaning_needed()
+
+    def clean_in_background(self, should_continue):
+        yield self.env.process(self._cleaner.clean_in_background(
+            should_continue))
+
     def level_wear(self):
         yield self.env.process(self._cleaner.level_wear())
 
@@ -390,6 +403,26 @@ class Ftl(object):
                 dist)
 
 
+def valid_ppns_in_range(oob, ppn_start, ppn_end):
+    return [ppn for ppn in range(ppn_start, ppn_end)
+            if oob.states.is_page_valid(ppn)]
+
+
+def gc_block_choice(purpose):
+    "GC writes to the least erased blocks, wear leveling to the most"
+    if purpose == PURPOSE_GC:
+        return LEAST_ERASED
+    elif purpose == PURPOSE_WEAR_LEVEL:
+        return MOST_ERASED
+
+
+def count_page_move(recorder, purpose, item):
+    if purpose == PURPOSE_GC:
+        recorder.count_me("gc", item)
+    elif purpose == PURPOSE_WEAR_LEVEL:
+        recorder.count_me("wearleveling", item)
+
+
 def remove_invalid_ppns(ppns):
     return [ppn for ppn in ppns if not ppn in (UNINITIATED, MISS)]
 
@@ -456,6 +489,10 @@ class FlashTransmitMixin(object):
 
         # as if we readlly read from flash
         m_ppn = self.directory.m_vpn_to_m_ppn(m_vpn)
+        if m_ppn == UNINITIATED:
+            # never written, all entries are UNINITIATED and there is
+            # nothing to read on flash.
+            self.env.exit(mapping_dict)
 
         op_id = self.recorder.get_unique_num()
         start_time = self.env.now
@@ -503,7 +540,8 @@ class FlashTransmitMixin(object):
             new_ppn = new_m_ppn, update_time=True)
         self.directory.update_mapping(m_vpn = m_vpn, m_ppn = new_m_ppn)
 
-        assert self.oob.states.is_page_valid(old_m_ppn) == False
+        if old_m_ppn != UNINITIATED:
+            assert self.oob.states.is_page_valid(old_m_ppn) == False
         assert self.oob.states.is_page_valid(new_m_ppn) == True
         assert self.oob.ppn_to_lpn_mvpn[new_m_ppn] == m_vpn
         assert self.directory.m_vpn_to_m_ppn(m_vpn) == new_m_ppn
@@ -536,7 +574,7 @@ class InsertMixin(object):
         self.env.exit(locked_row_ids)
 
     def __evict_entry_for_insert(self, tag=None):
-        victim_row = self._victim_row(avoid_m_vpns=[])
+        victim_row = self._victim_row()
         victim_row.state = USED_AND_HOLD
 
         yield self._concurrent_trans_quota.get(1)
@@ -545,7 +583,7 @@ class InsertMixin(object):
         m_vpn = self.conf.lpn_to_m_vpn(lpn = victim_row.lpn)
         tp_req = self._trans_page_locks.get_request(m_vpn)
         yield tp_req
-        self._trans_page_locks.locked_addrs.add(m_vpn)
+        self._mark_trans_page_locked(m_vpn)
 
         if victim_row.dirty == True:
             self.recorder.count_me('translation', 'write-back-dirty-for-insert')
@@ -564,8 +602,7 @@ class InsertMixin(object):
         self.recorder.count_me('translation', 'delete-lpn-in-table-for-insert')
         locked_row_id = self._lpn_table.delete_lpn_and_lock(victim_row.lpn)
 
-        self._trans_page_locks.release_request(m_vpn, tp_req)
-        self._trans_page_locks.locked_addrs.remove(m_vpn)
+        self._unlock_trans_page(m_vpn, tp_req)
 
         yield self._concurrent_trans_quota.put(1)
 
@@ -580,7 +617,7 @@ class LoadMixin(object):
         yield self._concurrent_trans_quota.get(2)
         tp_req = self._trans_page_locks.get_request(m_vpn)
         yield tp_req
-        self._trans_page_locks.locked_addrs.add(m_vpn)
+        self._mark_trans_page_locked(m_vpn)
 
         # check again before really loading
         if wanted_lpn is not None and not self._lpn_table.has_lpn(wanted_lpn):
@@ -590,8 +627,7 @@ class LoadMixin(object):
 
             if n_more > 0:
                 more_locked_rows = yield self.env.process(
-                    self.__add_locked_room_for_load(n_more, loading_m_vpn=m_vpn,
-                        tag=tag))
+                    self.__add_locked_room_for_load(n_more, tag=tag))
                 locked_rows += more_locked_rows
 
             yield self.env.process(
@@ -603,32 +639,30 @@ class LoadMixin(object):
 
         ppn = self._lpn_table.lpn_to_ppn(wanted_lpn)
 
-        self._trans_page_locks.release_request(m_vpn, tp_req)
-        self._trans_page_locks.locked_addrs.remove(m_vpn)
+        self._unlock_trans_page(m_vpn, tp_req)
 
         yield self._concurrent_trans_quota.put(2)
 
         self.env.exit((loaded, ppn))
 
-    def __add_locked_room_for_load(self, n_needed, loading_m_vpn, tag=None):
+    def __add_locked_room_for_load(self, n_needed, tag=None):
         locked_row_ids = []
         for i in range(n_needed):
             row_id = yield self.env.process(
-                    self.__evict_entry_for_load(loading_m_vpn, tag))
+                    self.__evict_entry_for_load(tag))
             locked_row_ids.append(row_id)
 
         self.env.exit(locked_row_ids)
 
-    def __evict_entry_for_load(self, loading_m_vpn, tag=None):
-        victim_row = self._victim_row(
-                [loading_m_vpn] + list(self._trans_page_locks.locked_addrs))
+    def __evict_entry_for_load(self, tag=None):
+        victim_row = self._victim_row()
         victim_row.state = USED_AND_HOLD
 
         m_vpn = self.conf.lpn_to_m_vpn(lpn = victim_row.lpn)
 
         tp_req = self._trans_page_locks.get_request(m_vpn)
         yield tp_req
-        self._trans_page_locks.locked_addrs.add(m_vpn)
+        self._mark_trans_page_locked(m_vpn)
 
         if victim_row.dirty == True:
             self.recorder.count_me('translation', 'write-back-dirty-for-load')
@@ -646,8 +680,7 @@ class LoadMixin(object):
         self.recorder.count_me('translation', 'delete-lpn-in-table-for-load')
         locked_row_id = self._lpn_table.delete_lpn_and_lock(victim_row.lpn)
 
-        self._trans_page_locks.release_request(m_vpn, tp_req)
-        self._trans_page_locks.locked_addrs.remove(m_vpn)
+        self._unlock_trans_page(m_vpn, tp_req)
 
         self.env.exit(locked_row_id)
 
@@ -691,13 +724,12 @@ class FlushMixin(object):
 
                 tp_req = self._trans_page_locks.get_request(m_vpn)
                 yield tp_req
-                self._trans_page_locks.locked_addrs.add(m_vpn)
+                self._mark_trans_page_locked(m_vpn)
 
                 self.recorder.count_me('translation', 'write-back-dirty-for-flush')
                 yield self.env.process(self._write_back(m_vpn, tag))
 
-                self._trans_page_locks.release_request(m_vpn, tp_req)
-                self._trans_page_locks.locked_addrs.remove(m_vpn)
+                self._unlock_trans_page(m_vpn, tp_req)
 
 
 class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
@@ -715,7 +747,10 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
         self.directory = directory
         self.mapping_on_flash = mapping_on_flash
 
-        self._lpn_table = LpnTableMvpn(confobj)
+        if self.conf['array_lpn_table'] is True:
+            self._lpn_table = ArrayLpnTableMvpn(confobj)
+        else:
+            self._lpn_table = LpnTableMvpn(confobj)
 
         self._trans_page_locks = trans_page_locks
 
@@ -726,39 +761,101 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
                 capacity=capsize)
         self._m_vpn_interface_lock = LockPool(self.env)
 
-    def update_batch(self, mapping_dict, tag=None):
-        for lpn, ppn in mapping_dict.items():
-            yield self.env.process(self.update(lpn, ppn, tag))
+    def m_vpn_locked(self, m_vpn):
+        """
+        Call when the translation page lock of m_vpn is granted. The cached
+        entries of m_vpn are not picked as victims until m_vpn_unlocked()
+        is called.
+        """
+        self._lpn_table.lock_m_vpn(m_vpn)
+
+    def m_vpn_unlocked(self, m_vpn):
+        self._lpn_table.unlock_m_vpn(m_vpn)
+
+    def _mark_trans_page_locked(self, m_vpn):
+        self._trans_page_locks.locked_addrs.add(m_vpn)
+        self.m_vpn_locked(m_vpn)
+
+    def _unlock_trans_page(self, m_vpn, tp_req):
+        self._trans_page_locks.release_request(m_vpn, tp_req)
+        self._trans_page_locks.locked_addrs.remove(m_vpn)
+        self.m_vpn_unlocked(m_vpn)
+
+    def update_batch(self, mapping_dict, tag=None, old_mappings=None):
+        """
+        Mappings of the same m_vpn are updated with the m_vpn locked once.
+
+        If old_mappings ({lpn: ppn}) is given, an lpn is only updated if it
+        still maps to its old ppn. Return the lpns updated.
+        """
+        updated = []
+        for m_vpn, items in self._group_by_m_vpn(mapping_dict.items()):
+            lpns = yield self.env.process(
+                    self._update_of_m_vpn(m_vpn, items, tag, old_mappings))
+            updated.extend(lpns)
+        self.env.exit(updated)
 
     def update(self, lpn, ppn, tag=None):
         """
         All translation and update of the same m_vpn are serialized.
         """
         m_vpn = self.conf.lpn_to_m_vpn(lpn)
+        yield self.env.process(self._update_of_m_vpn(m_vpn, [(lpn, ppn)], tag))
+
+    def _update_of_m_vpn(self, m_vpn, items, tag=None, old_mappings=None):
+        """
+        items are (lpn, ppn) pairs, all lpns must belong to m_vpn.
+        Return the lpns updated, see update_batch().
+        """
         req = self._m_vpn_interface_lock.get_request(m_vpn)
         yield req
 
-        if self._lpn_table.has_lpn(lpn):
-            self.recorder.count_me('translation', 'overwrite-in-cache')
-            self._lpn_table.overwrite_lpn(lpn, ppn, dirty=True)
-        else:
-            if self._lpn_table.n_free_rows() > 0:
-                self.recorder.count_me('translation', 'insert-to-free')
-                self._add_to_free(lpn, ppn)
+        updated = []
+        for lpn, ppn in items:
+            if old_mappings is not None and \
+                    self._cur_ppn(lpn) != old_mappings[lpn]:
+                self.recorder.count_me('translation', 'skip-stale-update')
+                continue
+            updated.append(lpn)
+
+            if self._lpn_table.has_lpn(lpn):
+                self.recorder.count_me('translation', 'overwrite-in-cache')
+                self._lpn_table.overwrite_lpn(lpn, ppn, dirty=True)
             else:
-                yield self.env.process(self._insert_new_mapping(lpn, ppn, tag))
+                if self._lpn_table.n_free_rows() > 0:
+                    self.recorder.count_me('translation', 'insert-to-free')
+                    self._add_to_free(lpn, ppn)
+                else:
+                    yield self.env.process(
+                            self._insert_new_mapping(lpn, ppn, tag))
 
         self._m_vpn_interface_lock.release_request(m_vpn, req)
+        self.env.exit(updated)
+
+    def _cur_ppn(self, lpn):
+        """
+        The caller must hold the m_vpn of lpn, so an entry not in the table
+        is not dirty and the copy on flash is the latest.
+        """
+        ppn = self._lpn_table.lpn_to_ppn(lpn)
+        if ppn == MISS:
+            ppn = self.mapping_on_flash.lpn_to_ppn(lpn)
+        return ppn
 
     def lpns_to_ppns(self, lpns, tag=None):
         """
-        If lpns are of the same m_vpn, this process will only
-        have one cache miss.
+        lpns of the same m_vpn are translated with the m_vpn locked once,
+        and the translation page is loaded at most once.
+        ppns[i] is the mapping of lpns[i].
         """
-        ppns = []
-        for lpn in lpns:
-            ppn = yield self.env.process(self.lpn_to_ppn(lpn, tag))
-            ppns.append(ppn)
+        ppns = [None] * len(lpns)
+        indexed_lpns = [(lpn, i) for i, lpn in enumerate(lpns)]
+        for m_vpn, items in self._group_by_m_vpn(indexed_lpns):
+            ppns_of_m_vpn = yield self.env.process(
+                self._lpns_to_ppns_of_m_vpn(m_vpn,
+                    [lpn for lpn, _ in items], tag))
+            for (_, i), ppn in zip(items, ppns_of_m_vpn):
+                ppns[i] = ppn
         self.env.exit(ppns)
 
     def lpn_to_ppn(self, lpn, tag=None):
@@ -767,25 +864,61 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
         All translation and update of the same m_vpn are serialized.
         """
         m_vpn = self.conf.lpn_to_m_vpn(lpn)
+        ppns = yield self.env.process(
+                self._lpns_to_ppns_of_m_vpn(m_vpn, [lpn], tag))
+        self.env.exit(ppns[0])
 
+    def _lpns_to_ppns_of_m_vpn(self, m_vpn, lpns, tag=None):
+        """
+        All lpns must belong to m_vpn.
+        """
         req = self._m_vpn_interface_lock.get_request(m_vpn)
         yield req
 
-        ppn = self._lpn_table.lpn_to_ppn(lpn)
-        if ppn == MISS:
-            loaded, ppn = yield self.env.process(
-                self._load_missing(m_vpn, wanted_lpn=lpn, tag=tag))
-            assert ppn != MISS
-        else:
+        ppns = []
+        has_loaded = False
+        for lpn in lpns:
+            ppn = self._lpn_table.lpn_to_ppn(lpn)
             loaded = False
+            if ppn == MISS:
+                if has_loaded is False:
+                    loaded, ppn = yield self.env.process(
+                        self._load_missing(m_vpn, wanted_lpn=lpn, tag=tag))
+                    has_loaded = loaded
+                else:
+                    # The entry was loaded by this group but evicted by
+                    # others. It is not dirty because we hold the m_vpn,
+                    # so the copy on flash is the latest.
+                    ppn = self.mapping_on_flash.lpn_to_ppn(lpn)
+                assert ppn != MISS
+
+            if loaded == True:
+                self.recorder.count_me("Mapping_Cache", "miss")
+            else:
+                self.recorder.count_me("Mapping_Cache", "hit")
 
-        if loaded == True:
-            self.recorder.count_me("Mapping_Cache", "miss")
-        else:
-            self.recorder.count_me("Mapping_Cache", "hit")
+            ppns.append(ppn)
 
         self._m_vpn_interface_lock.release_request(m_vpn, req)
-        self.env.exit(ppn)
+        self.env.exit(ppns)
+
+    def _group_by_m_vpn(self, items):
+        """
+        items are lpns or tuples starting with lpn. Return a list of
+        (m_vpn, items of m_vpn), m_vpns are in the order of their first
+        appearance.
+        """
+        groups = {}
+        m_vpns = []
+        for item in items:
+            lpn = item[0] if isinstance(item, tuple) else item
+            m_vpn = self.conf.lpn_to_m_vpn(lpn)
+            group = groups.get(m_vpn)
+            if group is None:
+                group = groups[m_vpn] = []
+                m_vpns.append(m_vpn)
+            group.append(item)
+        return [(m_vpn, groups[m_vpn]) for m_vpn in m_vpns]
 
     def flush(self):
         yield self.env.process(self._flush())
@@ -797,40 +930,145 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
             self._lpn_table.delete_lpn_and_lock(lpn)
             row.state = FREE
 
-    def _victim_row(self, avoid_m_vpns):
-        for lpn, row in self._lpn_table.least_to_most_lpn_items():
-            if row.state == USED:
-                m_vpn = self.conf.lpn_to_m_vpn(lpn)
-                if not m_vpn in avoid_m_vpns:
-                    return row
+    def _victim_row(self):
+        """
+        Rows of locked m_vpns, including the one being loaded, cannot be
+        victims. The lpn table parks them off its LRU as it meets them.
+        """
+        row = self._lpn_table.victim_row()
+        if row is not None:
+            return row
         raise RuntimeError("Cannot find a victim. Current stats: {}"\
-                ", avoid_m_vpns: {}.\n"
-                .format(str(self._lpn_table.stats()), avoid_m_vpns))
+                ", locked m_vpns: {}.\n"
+                .format(str(self._lpn_table.stats()),
+                    self._trans_page_locks.locked_addrs))
 
 
 FREE, FREE_AND_LOCKED, USED, USED_AND_LOCKED, USED_AND_HOLD = \
         'FREE', 'FREE_AND_LOCKED', 'USED', 'USED_AND_LOCKED', 'USED_AND_HOLD'
 
+def check_row_state_transition(cur_state, state_value):
+    """
+    State graph:
+        FREE <----> FREE & LOCKED <----> USED <----> USED & LOCKED
+                                          ^
+                                          |
+                                          v
+                                    USED & HOLD
+    """
+    if state_value == FREE:
+        assert cur_state == FREE_AND_LOCKED, \
+                "current state {}".format(cur_state)
+    elif state_value == FREE_AND_LOCKED:
+        assert cur_state in (FREE, USED), \
+                "current state {}".format(cur_state)
+    elif state_value == USED:
+        assert cur_state in (FREE_AND_LOCKED, USED_AND_LOCKED, USED_AND_HOLD), \
+                "current state {}".format(cur_state)
+    elif state_value == USED_AND_LOCKED:
+        assert cur_state == USED, \
+                "current state {}".format(cur_state)
+    elif state_value == USED_AND_HOLD:
+        assert cur_state == USED, \
+                "current state {}".format(cur_state)
+    else:
+        raise RuntimeError("{} is not a valid state".format(state_value))
+
+
 class LpnTable(object):
     def __init__(self, n_rows):
         self._n_rows = n_rows
 
+        # number of rows in each state and a stack of FREE row ids. Both are
+        # maintained by row state transitions (see _row_state_changed), so
+        # counting and finding free rows do not scan the table.
+        # The stack may hold stale ids of rows that have left FREE; they are
+        # skipped when popped.
+        self._state_counts = Counter({FREE: n_rows})
+        self._free_row_stack = self._fresh_free_row_stack()
+
         self._rows = self._fresh_rows()
 
         # lpns to Row instances, it is a dict
         # {lpn1: row1, lpn2: row2, ...}
+        # Only evictable (USED) rows are here so the LRU end is always a
+        # victim candidate. Rows that are locked or held, or that a
+        # subclass does not let evict (see _evictable), are moved to
+        # _pinned_rows until they become evictable again.
         # self._lpn_to_row = SegmentedLruCache(n_rows, 0.5)
         # self._lpn_to_row = LruDict()
         self._lpn_to_row = LruCache()
+        self._pinned_rows = {}
+
+    def _fresh_free_row_stack(self):
+        return range(self._n_rows - 1, -1, -1)
 
     def _fresh_rows(self):
          return [
-            Row(lpn = None, ppn = None, dirty = False, state = FREE, rowid = i)
+            Row(lpn = None, ppn = None, dirty = False, state = FREE, rowid = i,
+                table = self)
             for i in range(self._n_rows) ]
 
     def rows(self):
         return self._rows
 
+    def _row_state_changed(self, rowid, old_state, new_state):
+        self._state_counts[old_state] -= 1
+        self._state_counts[new_state] += 1
+        if new_state == FREE:
+            self._free_row_stack.append(rowid)
+        # FREE_AND_LOCKED <-> USED is handled by add_lpn and
+        # delete_lpn_and_lock
+        elif old_state == USED and new_state != FREE_AND_LOCKED:
+            if self._evictable(rowid):
+                self._pin_row(rowid)
+        elif new_state == USED and old_state != FREE_AND_LOCKED:
+            if self._evictable(rowid):
+                self._unpin_row(rowid)
+
+    def _evictable(self, rowid):
+        """
+        A USED row is on the LRU only if this is True. Subclasses may keep
+        USED rows off it.
+        """
+        return True
+
+    def _touched_while_pinned(self, rowid):
+        "A pinned row has been used"
+        pass
+
+    def _touch(self, rowid):
+        "Mark an evictable row as most recently used"
+        # LruCache's [] changes recency
+        self._lpn_to_row[self._rows[rowid].lpn]
+
+    def _pin_row(self, rowid):
+        """Take a row out of the evictable LRU"""
+        row = self._rows[rowid]
+        del self._lpn_to_row[row.lpn]
+        self._pinned_rows[row.lpn] = row
+
+    def _unpin_row(self, rowid):
+        """
+        Put a row back to the evictable LRU. Rows are pinned when they are
+        picked as victims, so they go back to the least recent end.
+        """
+        row = self._rows[rowid]
+        del self._pinned_rows[row.lpn]
+        self._lpn_to_row.add_as_least_used(row.lpn, row)
+
+    def _recent_row(self, lpn):
+        """
+        Return the row of lpn and mark it as most recently used if it is
+        evictable. Raise KeyError if lpn is not in the table.
+        """
+        try:
+            return self._lpn_to_row[lpn]
+        except KeyError:
+            row = self._pinned_rows[lpn]
+            self._touched_while_pinned(row.rowid)
+            return row
+
     def _count_states(self):
         """
         slower but reduces duplication
@@ -841,20 +1079,22 @@ class LpnTable(object):
         return counter
 
     def n_free_rows(self):
-        return self._count_states()[FREE]
+        return self._state_counts[FREE]
 
     def n_locked_free_rows(self):
-        return self._count_states()[FREE_AND_LOCKED]
+        return self._state_counts[FREE_AND_LOCKED]
 
     def n_used_rows(self):
-        return self._count_states()[USED]
+        return self._state_counts[USED]
 
     def n_locked_used_rows(self):
-        return self._count_states()[USED_AND_LOCKED]
+        return self._state_counts[USED_AND_LOCKED]
 
     def lock_free_row(self):
         """FREE TO FREE_AND_LOCKED"""
-        for row in self._rows:
+        stack = self._free_row_stack
+        while len(stack) > 0:
+            row = self._rows[stack.pop()]
             if row.state == FREE:
                 row.state = FREE_AND_LOCKED
                 return row.rowid
@@ -878,15 +1118,11 @@ class LpnTable(object):
 
     def lock_free_rows(self, n):
         row_ids = []
-        got = 0
-        for row in self._rows:
-            if row.state == FREE:
-                row.state = FREE_AND_LOCKED
-                row_ids.append(row.rowid)
-                got += 1
-
-                if got == n:
-                    break
+        while len(row_ids) < n:
+            rowid = self.lock_free_row()
+            if rowid is None:
+                break
+            row_ids.append(rowid)
         return row_ids
 
     def unlock_free_row(self, rowid):
@@ -899,11 +1135,11 @@ class LpnTable(object):
             self.unlock_free_row(row_id)
 
     def lock_lpn(self, lpn):
-        row = self._lpn_to_row.peek(lpn)
+        row = self._peek_row(lpn)
         row.state = USED_AND_LOCKED
 
     def unlock_lpn(self, lpn):
-        row = self._lpn_to_row.peek(lpn)
+        row = self._peek_row(lpn)
         assert row.state == USED_AND_LOCKED
         row.state = USED
 
@@ -946,7 +1182,7 @@ class LpnTable(object):
 
     def lpn_to_ppn(self, lpn):
         try:
-            row = self._lpn_to_row[lpn]
+            row = self._recent_row(lpn)
         except KeyError:
             return MISS
         else:
@@ -957,18 +1193,18 @@ class LpnTable(object):
             self.mark_clean(lpn)
 
     def mark_clean(self, lpn):
-        row = self._lpn_to_row.peek(lpn)
+        row = self._peek_row(lpn)
         assert row.state in (USED, USED_AND_HOLD)
         row.dirty = False
 
     def overwrite_lpn(self, lpn, ppn, dirty):
-        row = self._lpn_to_row[lpn]
+        row = self._recent_row(lpn)
         row.lpn = lpn
         row.ppn = ppn
         row.dirty = dirty
 
     def is_dirty(self, lpn):
-        row = self._lpn_to_row.peek(lpn)
+        row = self._peek_row(lpn)
         return row.dirty
 
     def row_state(self, rowid):
@@ -976,40 +1212,188 @@ class LpnTable(object):
 
     def delete_lpn_and_lock(self, lpn):
         assert self.has_lpn(lpn)
-        row = self._lpn_to_row.peek(lpn)
+        row = self._peek_row(lpn)
         assert row.state == USED
-        del self._lpn_to_row[lpn]
+        if self._evictable(row.rowid):
+            del self._lpn_to_row[lpn]
+        else:
+            del self._pinned_rows[lpn]
         row.clear_data()
         row.state = FREE_AND_LOCKED
 
         return row.rowid
 
     def has_lpn(self, lpn):
+        # LruCache's "in" changes recency, so use has_key()
+        return self._lpn_to_row.has_key(lpn) or lpn in self._pinned_rows
+
+    def _peek_row(self, lpn):
+        """
+        Return the row of lpn without changing recency. Raise KeyError if
+        lpn is not in the table.
+        """
         try:
-            row = self._lpn_to_row.peek(lpn)
+            return self._lpn_to_row.peek(lpn)
         except KeyError:
-            return False
-        else:
-            return True
+            return self._pinned_rows[lpn]
+
+    def least_to_most_lpn_items(self):
+        """
+        Evictable rows from least to most recently used
+        """
+        return self._lpn_to_row.least_to_most_items()
 
     def stats(self):
-        return self._count_states()
+        return Counter({state: cnt for state, cnt in self._state_counts.items()
+            if cnt > 0})
 
 
 class LpnTableMvpn(LpnTable):
     """
     With addition supports related to m_vpn
+
+    It keeps an index of the cached lpns of each m_vpn and the number of
+    dirty ones, so queries about a translation page cost proportional to
+    its cached entries, not to the number of entries in the page.
     """
     def __init__(self, conf):
         super(LpnTableMvpn, self).__init__(conf.n_cache_entries)
         self.conf = conf
 
-    def least_to_most_lpn_items(self):
-        return self._lpn_to_row.least_to_most_items()
+        self._init_m_vpn_index()
+        # {m_vpn: number of dirty cached lpns}
+        self._m_vpn_dirty_cnt = Counter()
+        # Rows of a locked m_vpn cannot be evicted. When victim_row() meets
+        # one, it is parked off the LRU until the m_vpn is unlocked, so it
+        # is not met again.
+        # {locked m_vpn: OrderedDict of its parked rowids, least recent
+        #  first}
+        self._parked_rows = {}
+        # {locked m_vpn: OrderedDict of its parked rowids used while
+        #  parked, least recent first}
+        self._parked_used_rows = {}
+        # {parked rowid: m_vpn}
+        self._parked_m_vpn = {}
+
+    def lock_m_vpn(self, m_vpn):
+        "The translation page of m_vpn is locked"
+        assert m_vpn not in self._parked_rows
+        self._parked_rows[m_vpn] = OrderedDict()
+        self._parked_used_rows[m_vpn] = OrderedDict()
+
+    def unlock_m_vpn(self, m_vpn):
+        """
+        Put the parked rows of m_vpn back on the LRU. They were the least
+        recent rows when they were parked, so they go back to the least
+        recent end, unless they have been used since.
+        """
+        parked_rowids = self._parked_rows.pop(m_vpn)
+        used_rowids = self._parked_used_rows.pop(m_vpn)
+        for rowid in parked_rowids:
+            del self._parked_m_vpn[rowid]
+
+        for rowid in reversed(parked_rowids.keys()):
+            if self.row_state(rowid) == USED:
+                self._unpin_row(rowid)
+        for rowid in used_rowids:
+            if self.row_state(rowid) == USED:
+                self._touch(rowid)
+
+    def victim_row(self):
+        """
+        Return the least recently used row that can be evicted, or None.
+        """
+        while True:
+            for lpn, row in self.least_to_most_lpn_items():
+                break
+            else:
+                return None
+
+            m_vpn = self.conf.lpn_to_m_vpn(lpn)
+            parked_rowids = self._parked_rows.get(m_vpn)
+            if parked_rowids is None:
+                return row
+
+            self._pin_row(row.rowid)
+            parked_rowids[row.rowid] = True
+            self._parked_m_vpn[row.rowid] = m_vpn
+
+    def _evictable(self, rowid):
+        return rowid not in self._parked_m_vpn
+
+    def _touched_while_pinned(self, rowid):
+        m_vpn = self._parked_m_vpn.get(rowid)
+        if m_vpn is not None and self.row_state(rowid) == USED:
+            used_rowids = self._parked_used_rows[m_vpn]
+            used_rowids.pop(rowid, None)
+            used_rowids[rowid] = True
+
+    def _init_m_vpn_index(self):
+        # {m_vpn: set of cached lpns}
+        self._m_vpn_lpns = {}
+
+    def _index_lpn(self, m_vpn, lpn):
+        self._m_vpn_lpns.setdefault(m_vpn, set()).add(lpn)
+
+    def _unindex_lpn(self, m_vpn, lpn):
+        lpns = self._m_vpn_lpns[m_vpn]
+        lpns.remove(lpn)
+        if len(lpns) == 0:
+            del self._m_vpn_lpns[m_vpn]
+
+    def add_lpn(self, rowid, lpn, ppn, dirty, as_least_recent = False):
+        super(LpnTableMvpn, self).add_lpn(rowid, lpn, ppn, dirty,
+                as_least_recent)
+        m_vpn = self.conf.lpn_to_m_vpn(lpn)
+        self._index_lpn(m_vpn, lpn)
+        if dirty is True:
+            self._m_vpn_dirty_cnt[m_vpn] += 1
+
+    def overwrite_lpn(self, lpn, ppn, dirty):
+        was_dirty = self.is_dirty(lpn)
+        super(LpnTableMvpn, self).overwrite_lpn(lpn, ppn, dirty)
+        self._update_dirty_cnt(lpn, was_dirty, dirty)
+
+    def mark_clean(self, lpn):
+        was_dirty = self.is_dirty(lpn)
+        super(LpnTableMvpn, self).mark_clean(lpn)
+        self._update_dirty_cnt(lpn, was_dirty, False)
+
+    def delete_lpn_and_lock(self, lpn):
+        was_dirty = self.is_dirty(lpn)
+        rowid = super(LpnTableMvpn, self).delete_lpn_and_lock(lpn)
+        self._update_dirty_cnt(lpn, was_dirty, False)
+
+        parked_m_vpn = self._parked_m_vpn.pop(rowid, None)
+        if parked_m_vpn is not None:
+            del self._parked_rows[parked_m_vpn][rowid]
+            self._parked_used_rows[parked_m_vpn].pop(rowid, None)
+
+        self._unindex_lpn(self.conf.lpn_to_m_vpn(lpn), lpn)
+
+        return rowid
+
+    def _update_dirty_cnt(self, lpn, was_dirty, dirty):
+        was_dirty = was_dirty is True
+        dirty = dirty is True
+        if was_dirty != dirty:
+            m_vpn = self.conf.lpn_to_m_vpn(lpn)
+            self._m_vpn_dirty_cnt[m_vpn] += 1 if dirty else -1
+            if self._m_vpn_dirty_cnt[m_vpn] == 0:
+                del self._m_vpn_dirty_cnt[m_vpn]
+
+    def cached_lpns_of_m_vpn(self, m_vpn):
+        return self._m_vpn_lpns.get(m_vpn, ())
+
+    def n_cached_of_m_vpn(self, m_vpn):
+        return len(self.cached_lpns_of_m_vpn(m_vpn))
+
+    def n_dirty_of_m_vpn(self, m_vpn):
+        return self._m_vpn_dirty_cnt[m_vpn]
 
     def needed_space_for_m_vpn(self, m_vpn):
-        cached_mappings = self.get_m_vpn_mappings(m_vpn)
-        return self.conf.n_mapping_entries_per_page - len(cached_mappings)
+        return self.conf.n_mapping_entries_per_page - \
+                self.n_cached_of_m_vpn(m_vpn)
 
     def get_m_vpn_mappings(self, m_vpn):
         """ return all the mappings of m_vpn that are in cache
@@ -1031,25 +1415,413 @@ class LpnTableMvpn(LpnTable):
         return row_ids
 
     def _rows_of_m_vpn(self, m_vpn):
-        lpns = self.conf.m_vpn_to_lpns(m_vpn)
-        rows = []
-        for lpn in lpns:
-            try:
-                row = self._lpn_to_row.peek(lpn)
-            except KeyError:
-                pass
-            else:
-                rows.append(row)
-
-        return rows
+        return [self._peek_row(lpn)
+                for lpn in sorted(self.cached_lpns_of_m_vpn(m_vpn))]
 
     def get_un_cached_lpn_of_m_vpn(self, m_vpn):
         lpns = self.conf.m_vpn_to_lpns(m_vpn)
-        cached_dict = self.get_m_vpn_mappings(m_vpn)
-        uncached_lpns = set(lpns) - set(cached_dict.keys())
+        uncached_lpns = set(lpns) - set(self.cached_lpns_of_m_vpn(m_vpn))
         return uncached_lpns
 
 
+_ROW_STATES = (FREE, FREE_AND_LOCKED, USED, USED_AND_LOCKED, USED_AND_HOLD)
+_ROW_STATE_CODES = {state: code for code, state in enumerate(_ROW_STATES)}
+_NO_VALUE, _UNINITIATED_PPN = (-1, -2)
+
+
+class _LpnRowIndex(object):
+    """
+    {lpn: rowid} of at most n_rows lpns in two integer arrays, with open
+    addressing. The arrays have at least twice as many slots as rows, so
+    probes are short. A deleted entry is filled by shifting later entries
+    of its probe sequence back, so there are no tombstones.
+    """
+    def __init__(self, n_rows):
+        # _home() hashes to at most 32 bits, which is 2 * n_rows slots
+        assert n_rows < 1 << 31, \
+                "{} rows are too many for the index".format(n_rows)
+        n_bits = 1
+        while (1 << n_bits) < 2 * n_rows:
+            n_bits += 1
+        self._shift = 32 - n_bits
+        self._mask = (1 << n_bits) - 1
+        self._keys = array.array('l', [_NO_VALUE]) * (1 << n_bits)
+        self._values = array.array('l', [_NO_VALUE]) * (1 << n_bits)
+
+    def _home(self, lpn):
+        # multiplicative hashing, the top n_bits of the low 32 bits
+        return ((lpn * 2654435761) & 0xffffffff) >> self._shift
+
+    def _slot(self, lpn):
+        "Return the slot of lpn, or the empty slot it would take"
+        keys = self._keys
+        mask = self._mask
+        i = self._home(lpn)
+        while keys[i] != lpn and keys[i] != _NO_VALUE:
+            i = (i + 1) & mask
+        return i
+
+    def __contains__(self, lpn):
+        return self._keys[self._slot(lpn)] == lpn
+
+    def get(self, lpn, default=None):
+        i = self._slot(lpn)
+        if self._keys[i] == lpn:
+            return self._values[i]
+        return default
+
+    def __getitem__(self, lpn):
+        i = self._slot(lpn)
+        if self._keys[i] != lpn:
+            raise KeyError(lpn)
+        return self._values[i]
+
+    def __setitem__(self, lpn, rowid):
+        i = self._slot(lpn)
+        self._keys[i] = lpn
+        self._values[i] = rowid
+
+    def pop(self, lpn):
+        keys = self._keys
+        values = self._values
+        mask = self._mask
+        i = self._slot(lpn)
+        if keys[i] != lpn:
+            raise KeyError(lpn)
+        rowid = values[i]
+
+        # i is the hole. An entry after it moves into the hole unless its
+        # home is cyclically in (i, j].
+        j = i
+        while True:
+            j = (j + 1) & mask
+            key = keys[j]
+            if key == _NO_VALUE:
+                break
+            home = self._home(key)
+            if (i < j and (home <= i or home > j)) or \
+                    (i > j and home <= i and home > j):
+                keys[i] = key
+                values[i] = values[j]
+                i = j
+        keys[i] = _NO_VALUE
+        values[i] = _NO_VALUE
+
+        return rowid
+
+
+class ArrayLpnTable(LpnTable):
+    """
+    The same interface as LpnTable, but rows are kept in a structure of
+    arrays instead of Row instances: integer arrays for lpn and ppn, a bitset
+    for dirty and small integers for state. Recency is a doubly linked list
+    threaded through two index arrays. A cached entry costs tens of bytes
+    instead of hundreds. Like LpnTable, only USED rows are on the recency
+    list. The lpn index and the stack of free rows are integer arrays as
+    well.
+
+    State transitions are only checked when check_states is True. A
+    subclass may set _check_states before calling this constructor and
+    leave check_states None.
+    """
+    _check_states = False
+
+    def __init__(self, n_rows, check_states=None):
+        if check_states is not None:
+            self._check_states = check_states
+        super(ArrayLpnTable, self).__init__(n_rows)
+
+        # {lpn: rowid}
+        self._lpn_to_row = _LpnRowIndex(n_rows)
+
+    def _fresh_free_row_stack(self):
+        return array.array('l', xrange(self._n_rows - 1, -1, -1))
+
+    def _fresh_rows(self):
+        n = self._n_rows
+        self._lpns = array.array('l', [_NO_VALUE]) * n
+        self._ppns = array.array('l', [_NO_VALUE]) * n
+        self._dirty = bitarray.bitarray(n)
+        self._dirty.setall(False)
+        self._states = array.array('b', [_ROW_STATE_CODES[FREE]]) * n
+
+        # recency list, the guard is at index n.
+        # _newer[guard] is the least recently used row,
+        # _older[guard] is the most recently used row.
+        self._lru_guard = n
+        self._newer = array.array('l', [n]) * (n + 1)
+        self._older = array.array('l', [n]) * (n + 1)
+
+        return None
+
+    def rows(self):
+        return [_RowView(self, rowid) for rowid in range(self._n_rows)]
+
+    def _count_states(self):
+        counter = Counter()
+        for code in self._states:
+            counter[_ROW_STATES[code]] += 1
+        return counter
+
+    def _get_state(self, rowid):
+        return _ROW_STATES[self._states[rowid]]
+
+    def _set_state(self, rowid, state_value):
+        old_state = _ROW_STATES[self._states[rowid]]
+        if self._check_states is True:
+            check_row_state_transition(old_state, state_value)
+        self._states[rowid] = _ROW_STATE_CODES[state_value]
+        self._row_state_changed(rowid, old_state, state_value)
+
+    def _assert_modification_allowed(self, rowid):
+        if self._check_states is True:
+            assert self._get_state(rowid) in \
+                    (FREE_AND_LOCKED, USED, USED_AND_HOLD), \
+                    "current state {}".format(self._get_state(rowid))
+
+    def _get_ppn(self, rowid):
+        ppn = self._ppns[rowid]
+        if ppn == _UNINITIATED_PPN:
+            return UNINITIATED
+        elif ppn == _NO_VALUE:
+            return None
+        else:
+            return ppn
+
+    def _set_ppn(self, rowid, ppn):
+        if ppn == UNINITIATED:
+            ppn = _UNINITIATED_PPN
+        elif ppn is None:
+            ppn = _NO_VALUE
+        self._ppns[rowid] = ppn
+
+    def _get_lpn(self, rowid):
+        lpn = self._lpns[rowid]
+        return None if lpn == _NO_VALUE else lpn
+
+    def _link_as_most_recent(self, rowid):
+        guard = self._lru_guard
+        head = self._older[guard]
+        self._newer[rowid] = guard
+        self._older[rowid] = head
+        self._newer[head] = rowid
+        self._older[guard] = rowid
+
+    def _link_as_least_recent(self, rowid):
+        guard = self._lru_guard
+        tail = self._newer[guard]
+        self._older[rowid] = guard
+        self._newer[rowid] = tail
+        self._older[tail] = rowid
+        self._newer[guard] = rowid
+
+    def _unlink(self, rowid):
+        newer = self._newer[rowid]
+        older = self._older[rowid]
+        self._older[newer] = older
+        self._newer[older] = newer
+
+    def _touch(self, rowid):
+        if self._states[rowid] == _ROW_STATE_CODES[USED]:
+            if self._evictable(rowid):
+                self._unlink(rowid)
+                self._link_as_most_recent(rowid)
+            else:
+                self._touched_while_pinned(rowid)
+
+    def _pin_row(self, rowid):
+        self._unlink(rowid)
+
+    def _unpin_row(self, rowid):
+        self._link_as_least_recent(rowid)
+
+    def lock_free_row(self):
+        """FREE TO FREE_AND_LOCKED"""
+        stack = self._free_row_stack
+        free_code = _ROW_STATE_CODES[FREE]
+        while len(stack) > 0:
+            rowid = stack.pop()
+            if self._states[rowid] == free_code:
+                self._set_state(rowid, FREE_AND_LOCKED)
+                return rowid
+        return None
+
+    def lock_used_row(self, row_id):
+        self._set_state(row_id, USED_AND_LOCKED)
+
+    def unlock_used_row(self, row_id):
+        self._set_state(row_id, USED)
+
+    def unlock_free_row(self, rowid):
+        """FREE_AND_LOCKED -> FREE"""
+        self._set_state(rowid, FREE)
+
+    def lock_lpn(self, lpn):
+        self._set_state(self._lpn_to_row[lpn], USED_AND_LOCKED)
+
+    def unlock_lpn(self, lpn):
+        rowid = self._lpn_to_row[lpn]
+        assert self._get_state(rowid) == USED_AND_LOCKED
+        self._set_state(rowid, USED)
+
+    def hold_used_row(self, rowid):
+        self._set_state(rowid, USED_AND_HOLD)
+
+    def unhold_used_row(self, rowid):
+        self._set_state(rowid, USED)
+
+    def add_lpn(self, rowid, lpn, ppn, dirty, as_least_recent = False):
+        assert self.has_lpn(lpn) == False, "lpn is {}.".format(lpn)
+        self._assert_modification_allowed(rowid)
+
+        self._lpns[rowid] = lpn
+        self._set_ppn(rowid, ppn)
+        self._dirty[rowid] = bool(dirty)
+        self._set_state(rowid, USED)
+
+        if as_least_recent:
+            self._link_as_least_recent(rowid)
+        else:
+            self._link_as_most_recent(rowid)
+        self._lpn_to_row[lpn] = rowid
+
+    def lpn_to_ppn(self, lpn):
+        rowid = self._lpn_to_row.get(lpn, None)
+        if rowid is None:
+            return MISS
+        self._touch(rowid)
+        return self._get_ppn(rowid)
+
+    def mark_clean(self, lpn):
+        rowid = self._lpn_to_row[lpn]
+        assert self._get_state(rowid) in (USED, USED_AND_HOLD)
+        self._dirty[rowid] = False
+
+    def overwrite_lpn(self, lpn, ppn, dirty):
+        rowid = self._lpn_to_row[lpn]
+        self._touch(rowid)
+        self._assert_modification_allowed(rowid)
+        self._set_ppn(rowid, ppn)
+        self._dirty[rowid] = bool(dirty)
+
+    def is_dirty(self, lpn):
+        return self._dirty[self._lpn_to_row[lpn]]
+
+    def row_state(self, rowid):
+        return self._get_state(rowid)
+
+    def delete_lpn_and_lock(self, lpn):
+        assert self.has_lpn(lpn)
+        rowid = self._lpn_to_row.pop(lpn)
+        assert self._get_state(rowid) == USED
+        if self._evictable(rowid):
+            self._unlink(rowid)
+        self._lpns[rowid] = _NO_VALUE
+        self._ppns[rowid] = _NO_VALUE
+        self._dirty[rowid] = False
+        self._set_state(rowid, FREE_AND_LOCKED)
+
+        return rowid
+
+    def has_lpn(self, lpn):
+        return lpn in self._lpn_to_row
+
+    def _peek_row(self, lpn):
+        return _RowView(self, self._lpn_to_row[lpn])
+
+    def least_to_most_lpn_items(self):
+        guard = self._lru_guard
+        rowid = self._newer[guard]
+        while rowid != guard:
+            # read the next one first, the current row may be deleted by
+            # the caller.
+            newer = self._newer[rowid]
+            yield self._lpns[rowid], _RowView(self, rowid)
+            rowid = newer
+
+
+class ArrayLpnTableMvpn(LpnTableMvpn, ArrayLpnTable):
+    """
+    Instead of a set of cached lpns per m_vpn, it only counts them. The
+    cached lpns of an m_vpn are found by looking up the lpns of the m_vpn
+    in the lpn index, in ascending order, so a cached entry costs no more
+    than in ArrayLpnTable.
+    """
+    def __init__(self, conf):
+        self._check_states = conf['check_lpn_table_states']
+        super(ArrayLpnTableMvpn, self).__init__(conf)
+
+    def _init_m_vpn_index(self):
+        # {m_vpn: number of cached lpns}
+        self._m_vpn_cached_cnt = Counter()
+
+    def _index_lpn(self, m_vpn, lpn):
+        self._m_vpn_cached_cnt[m_vpn] += 1
+
+    def _unindex_lpn(self, m_vpn, lpn):
+        self._m_vpn_cached_cnt[m_vpn] -= 1
+        if self._m_vpn_cached_cnt[m_vpn] == 0:
+            del self._m_vpn_cached_cnt[m_vpn]
+
+    def cached_lpns_of_m_vpn(self, m_vpn):
+        n_cached = self._m_vpn_cached_cnt.get(m_vpn, 0)
+        lpns = []
+        if n_cached == 0:
+            return lpns
+
+        index = self._lpn_to_row
+        start_lpn = m_vpn * self.conf.n_mapping_entries_per_page
+        for lpn in xrange(start_lpn,
+                start_lpn + self.conf.n_mapping_entries_per_page):
+            if lpn in index:
+                lpns.append(lpn)
+                if len(lpns) == n_cached:
+                    break
+        return lpns
+
+    def n_cached_of_m_vpn(self, m_vpn):
+        return self._m_vpn_cached_cnt.get(m_vpn, 0)
+
+
+class _RowView(object):
+    """
+    A Row-like handle of a row in ArrayLpnTable
+    """
+    __slots__ = ('_table', '_rowid')
+
+    def __init__(self, table, rowid):
+        self._table = table
+        self._rowid = rowid
+
+    @property
+    def lpn(self):
+        return self._table._get_lpn(self._rowid)
+
+    @property
+    def ppn(self):
+        return self._table._get_ppn(self._rowid)
+
+    @property
+    def dirty(self):
+        return self._table._dirty[self._rowid]
+
+    @property
+    def state(self):
+        return self._table._get_state(self._rowid)
+
+    @state.setter
+    def state(self, state_value):
+        self._table._set_state(self._rowid, state_value)
+
+    @property
+    def rowid(self):
+        return self._rowid
+
+    def __repr__(self):
+        return "lpn:{}, ppn:{}, dirty:{}, rowid:{}".format(self.lpn,
+            self.ppn, self.dirty, self._rowid)
+
+
 class _Row(object):
     def __init__(self, lpn, ppn, dirty, state, rowid):
         self.lpn = lpn
@@ -1065,12 +1837,14 @@ class _Row(object):
 
 
 class Row(object):
-    def __init__(self, lpn, ppn, dirty, state, rowid):
+    def __init__(self, lpn, ppn, dirty, state, rowid, table=None):
         self._lpn = lpn
         self._ppn = ppn
         self._dirty = dirty
         self._state = state
         self._rowid = rowid
+        # the LpnTable to be notified of state transitions
+        self._table = table
 
     def _assert_modification_allowed(self):
          assert self._state in (FREE_AND_LOCKED, USED, USED_AND_HOLD), \
@@ -1109,33 +1883,11 @@ class Row(object):
 
     @state.setter
     def state(self, state_value):
-        """
-        State graph:
-            FREE <----> FREE & LOCKED <----> USED <----> USED & LOCKED
-                                              ^
-                                              |
-                                              v
-                                        USED & HOLD
-        """
-        # check state transition
-        if state_value == FREE:
-            assert self._state == FREE_AND_LOCKED, \
-                    "current state {}".format(self._state)
-        elif state_value == FREE_AND_LOCKED:
-            assert self._state in (FREE, USED), \
-                    "current state {}".format(self._state)
-        elif state_value == USED:
-            assert self._state in (FREE_AND_LOCKED, USED_AND_LOCKED, USED_AND_HOLD), \
-                    "current state {}".format(self._state)
-        elif state_value == USED_AND_LOCKED:
-            assert self._state == USED, \
-                    "current state {}".format(self._state)
-        elif state_value == USED_AND_HOLD:
-            assert self._state == USED, \
-                    "current state {}".format(self._state)
-        else:
-            raise RuntimeError("{} is not a valid state".format(state_value))
+        check_row_state_transition(self._state, state_value)
+        old_state = self._state
         self._state = state_value
+        if self._table is not None:
+            self._table._row_state_changed(self._rowid, old_state, state_value)
 
     @property
     def rowid(self):
@@ -1179,9 +1931,10 @@ class MappingOnFlash(object):
 
         self.n_entries_per_page = self.conf.n_mapping_entries_per_page
 
-        # do the easy thing first, if necessary, we can later use list or
-        # other data structure
-        self.entries = {}
+        # lpn -> ppn, _NO_VALUE means the lpn has never been mapped
+        n_entries = self.conf.total_translation_pages() * \
+                self.n_entries_per_page
+        self.entries = array.array('l', [_NO_VALUE]) * n_entries
 
     def lpn_to_ppn(self, lpn):
         """
@@ -1189,9 +1942,12 @@ class MappingOnFlash(object):
         None because at the beginning there is no mapping. No valid data block
         on device.
         """
-        return self.entries.get(lpn, UNINITIATED)
+        ppn = self.entries[lpn]
+        return UNINITIATED if ppn == _NO_VALUE else ppn
 
     def update(self, lpn, ppn):
+        if ppn == UNINITIATED:
+            ppn = _NO_VALUE
         self.entries[lpn] = ppn
 
     def batch_update(self, mapping_dict):
@@ -1206,7 +1962,9 @@ class MappingOnFlash(object):
         return d
 
     def __repr__(self):
-        return "global mapping table: {}".format(repr(self.entries))
+        return "global mapping table: {}".format(repr(
+            {lpn: ppn for lpn, ppn in enumerate(self.entries)
+                if ppn != _NO_VALUE}))
 
 
 class GlobalTranslationDirectory(object):
@@ -1228,10 +1986,14 @@ class GlobalTranslationDirectory(object):
 
         # M_VPN -> M_PPN
         # Virtual translation page number --> Physical translation page number
-        # Dftl should initialize
-        self.mapping = {}
+        # _NO_VALUE means the translation page has never been written.
+        self.mapping = array.array('l', [_NO_VALUE]) * \
+                self.conf.total_translation_pages()
 
-        self._initialize()
+        # With lazy_translation_pages, a translation page gets its flash
+        # page when it is written back for the first time.
+        if self.conf['lazy_translation_pages'] is False:
+            self._initialize()
 
     def _initialize(self):
         """
@@ -1255,12 +2017,14 @@ class GlobalTranslationDirectory(object):
 
     def m_vpn_to_m_ppn(self, m_vpn):
         """
-        m_vpn virtual translation page number. It should always be successfull.
+        m_vpn virtual translation page number. It returns UNINITIATED if
+        the translation page has never been written.
         """
-        return self.mapping[m_vpn]
+        m_ppn = self.mapping[m_vpn]
+        return UNINITIATED if m_ppn == _NO_VALUE else m_ppn
 
     def add_mapping(self, m_vpn, m_ppn):
-        if self.mapping.has_key(m_vpn):
+        if self.mapping[m_vpn] != _NO_VALUE:
             raise RuntimeError("self.mapping already has m_vpn:{}"\
                 .format(m_vpn))
         self.mapping[m_vpn] = m_ppn
@@ -1269,7 +2033,7 @@ class GlobalTranslationDirectory(object):
         self.mapping[m_vpn] = m_ppn
 
     def remove_mapping(self, m_vpn):
-        del self.mapping[m_vpn]
+        self.mapping[m_vpn] = _NO_VALUE
 
     def lpn_to_m_ppn(self, lpn):
         m_vpn = self.conf.lpn_to_m_vpn(lpn)
@@ -1277,7 +2041,8 @@ class GlobalTranslationDirectory(object):
         return m_ppn
 
     def __repr__(self):
-        return repr(self.mapping)
+        return repr({m_vpn: m_ppn for m_vpn, m_ppn in enumerate(self.mapping)
+            if m_ppn != _NO_VALUE})
 
 class WearLevelingVictimBlocks(object):
     TYPE_DATA = 'TYPE_DATA'
@@ -1324,10 +2089,18 @@ class WearLevelingVictimBlocks(object):
 class VictimBlocks(object):
     TYPE_DATA = 'TYPE_DATA'
     TYPE_TRANS = 'TYPE_TRANS'
-    def __init__(self, conf, block_pool, oob):
+    def __init__(self, conf, block_pool, oob, policy=None):
+        """
+        policy orders the victims if conf['gc_victim_policy'] is not greedy.
+        Pass the same policy to all rounds so that its random samples go on
+        instead of starting over.
+        """
         self._conf = conf
         self._block_pool = block_pool
         self._oob = oob
+        if policy is None:
+            policy = create_victim_policy(conf, oob)
+        self._policy = policy
 
     def iterator(self):
         for (_, _, block_num) in self.iterator_verbose():
@@ -1337,14 +2110,62 @@ class VictimBlocks(object):
         return repr(list(self.iterator_verbose()))
 
     def iterator_verbose(self):
-        candidate_tuples = self._candidate_priorityq()
-        while True:
-            try:
-                valid_ratio, block_type, block_num = heapq.heappop(candidate_tuples)
-                yield valid_ratio, block_type, block_num
-            except IndexError:
-                # Out of victim blocks
-                raise StopIteration
+        """
+        Yield (valid_ratio, block_type, block_num), best victim first as
+        decided by conf['gc_victim_policy'].
+
+        Each block is checked again right before it is yielded, so the
+        caller may clean blocks between steps.
+        """
+        if self._conf['gc_victim_policy'] == victimpolicy.GREEDY:
+            return self._greedy_iterator_verbose()
+        else:
+            return self._policy_iterator_verbose()
+
+    def _greedy_iterator_verbose(self):
+        """
+        Yield from the fewest valid pages up, in the same order as sorting
+        all candidates would.
+
+        Candidates come from the bitmap's garbage buckets, so blocks without
+        invalid pages are never looked at. A bucket is read only when the
+        iteration reaches it.
+        """
+        self._block_pool.remove_full_cur_blocks()
+        states = self._oob.states
+        yielded = set()
+        for valid_cnt in range(self._conf.n_pages_per_block):
+            bucket = states.garbage_blocks_with_valid_count(valid_cnt)
+            if len(bucket) == 0:
+                continue
+
+            cur_blocks = set(self._block_pool.current_blocks())
+            candidate_tuples = []
+            for block in bucket:
+                victim_tuple = self._victim_tuple(block, cur_blocks)
+                if victim_tuple is not None:
+                    candidate_tuples.append(victim_tuple)
+            candidate_tuples.sort()
+
+            for _, _, block in candidate_tuples:
+                if block in yielded:
+                    continue
+                victim_tuple = self._victim_tuple(block,
+                        set(self._block_pool.current_blocks()))
+                if victim_tuple is not None:
+                    yielded.add(block)
+                    yield victim_tuple
+
+    def _policy_iterator_verbose(self):
+        self._block_pool.remove_full_cur_blocks()
+        candidates = _VictimCandidates(self,
+                set(self._block_pool.current_blocks()))
+
+        for _, block in self._policy.victims(candidates):
+            victim_tuple = self._victim_tuple(block,
+                    set(self._block_pool.current_blocks()))
+            if victim_tuple is not None:
+                yield victim_tuple
 
     def get_valid_ratio_counter_of_used_blocks(self):
         used_blocks = self._block_pool.used_blocks
@@ -1355,44 +2176,57 @@ class VictimBlocks(object):
             counter[ratio_str] += 1
         return counter
 
-    def _candidate_priorityq(self):
-        candidate_tuples = self._victim_candidates()
-        heapq.heapify(candidate_tuples)
-        return candidate_tuples
-
-    def _form_tuples(self, used_blocks, block_type):
-        assert block_type in (self.TYPE_DATA, self.TYPE_TRANS)
+    def _victim_tuple(self, block, cur_blocks):
+        """
+        Return (valid_ratio, block_type, block) if block can be cleaned now,
+        otherwise None.
+        """
+        tag = self._block_pool.get_tag(block)
+        if tag == TDATA:
+            block_type = self.TYPE_DATA
+        elif tag == TTRANS:
+            block_type = self.TYPE_TRANS
+        else:
+            return None
 
-        self._block_pool.remove_full_cur_blocks()
-        cur_blocks = self._block_pool.current_blocks()
+        if block in cur_blocks:
+            # skip current blocks
+            return None
 
-        victim_candidates = []
-        for block in used_blocks:
-            if block in cur_blocks:
-                # skip current blocks
-                continue
+        valid_ratio = self._oob.states.block_valid_ratio(block)
+        if valid_ratio == 1:
+            # skip all-valid blocks
+            return None
+        if valid_ratio > self._conf['max_victim_valid_ratio']:
+            # If valid ratio is too big, moving it does not provide
+            # too much benefit.
+            return None
 
-            valid_ratio = self._oob.states.block_valid_ratio(block)
-            if valid_ratio == 1:
-                # skip all-valid blocks
-                continue
-            if valid_ratio > self._conf['max_victim_valid_ratio']:
-                # If valid ratio is too big, moving it does not provide
-                # too much benefit.
-                continue
+        return valid_ratio, block_type, block
 
-            victim_candidates.append( (valid_ratio, block_type, block) )
 
-        return victim_candidates
+def create_victim_policy(conf, oob):
+    return victimpolicy.create_victim_policy(conf,
+            oob.states.block_valid_ratio, oob.block_age)
 
-    def _victim_candidates(self):
-        used_data_blocks = self._block_pool.data_usedblocks
-        used_trans_blocks = self._block_pool.trans_usedblocks
 
-        candidate_tuples = self._form_tuples(used_data_blocks, self.TYPE_DATA) + \
-            self._form_tuples(used_trans_blocks, self.TYPE_TRANS)
+class _VictimCandidates(victimpolicy.BlockCandidates):
+    """
+    Blocks that VictimBlocks may clean. They are the garbage blocks of the
+    bitmap, so they are drawn from the bitmap's garbage block array.
+    """
+    def __init__(self, victim_blocks, cur_blocks):
+        super(_VictimCandidates, self).__init__(
+                victim_blocks._oob.states.garbage_block_array())
+        self._victim_blocks = victim_blocks
+        self._cur_blocks = cur_blocks
 
-        return candidate_tuples
+    def candidate_type(self, blocknum):
+        victim_tuple = self._victim_blocks._victim_tuple(blocknum,
+                self._cur_blocks)
+        if victim_tuple is None:
+            return None
+        return victim_tuple[1]
 
 
 class Cleaner(object):
@@ -1410,6 +2244,7 @@ class Cleaner(object):
         self.assert_threshold_sanity()
 
         self._trans_page_locks = trans_page_locks
+        self._victim_policy = create_victim_policy(self.conf, self.oob)
 
         self._datablockcleaner = DataBlockCleaner(
             conf = self.conf,
@@ -1474,6 +2309,10 @@ class Cleaner(object):
     def is_stopping_needed(self):
         return self.block_pool.used_ratio() < self.conf.GC_low_threshold_ratio
 
+    def is_background_cleaning_needed(self):
+        return self.block_pool.used_ratio() > \
+                self.conf['background_gc_high_ratio']
+
     def level_wear(self):
         """
         Move victim to a new location
@@ -1505,7 +2344,8 @@ class Cleaner(object):
         req = self._cleaner_res.request()
         yield req
 
-        victim_blocks = VictimBlocks(self.conf, self.block_pool, self.oob)
+        victim_blocks = VictimBlocks(self.conf, self.block_pool, self.oob,
+                self._victim_policy)
         self.recorder.append_to_value_list('clean_func_valid_ratio_snapshot',
                 victim_blocks.get_valid_ratio_counter_of_used_blocks())
 
@@ -1515,16 +2355,41 @@ class Cleaner(object):
             self.gc_time_recorded = True
             print 'GC time recorded!........!'
 
-        all_victim_tuples = list(victim_blocks.iterator_verbose())
-        batches = utils.group_to_batches(all_victim_tuples, self.n_victim_per_batch)
-
-        for batch in batches:
-            if self.is_stopping_needed():
+        # take victims batch by batch, so we only rank as many blocks as
+        # we end up cleaning
+        victim_iter = victim_blocks.iterator_verbose()
+        while not self.is_stopping_needed():
+            batch = list(itertools.islice(victim_iter, self.n_victim_per_batch))
+            if len(batch) == 0:
                 break
             yield self.env.process(self._clean_batch(batch, purpose=PURPOSE_GC))
 
         self._cleaner_res.release(req)
 
+    def clean_in_background(self, should_continue):
+        """
+        Clean one block at a time until the used ratio drops below
+        background_gc_low_ratio or should_continue() is False. Block
+        cleaners check should_continue() between page moves. A block left
+        half cleaned stays used and can be picked again later.
+        """
+        req = self._cleaner_res.request()
+        yield req
+
+        victim_blocks = VictimBlocks(self.conf, self.block_pool, self.oob,
+                self._victim_policy)
+        victim_iter = victim_blocks.iterator_verbose()
+        while should_continue() and self.block_pool.used_ratio() >= \
+                self.conf['background_gc_low_ratio']:
+            try:
+                _, block_type, block_num = next(victim_iter)
+            except StopIteration:
+                break
+            yield self.env.process(self._clean_block(block_type, block_num,
+                PURPOSE_GC, should_continue))
+
+        self._cleaner_res.release(req)
+
     def _clean_batch(self, victim_tuples, purpose):
         procs = []
         for valid_ratio, block_type, block_num in victim_tuples:
@@ -1534,16 +2399,17 @@ class Cleaner(object):
 
         yield simpy.AllOf(self.env, procs)
 
-    def _clean_block(self, block_type, block_num, purpose):
+    def _clean_block(self, block_type, block_num, purpose,
+            should_continue=None):
         req = self._block_cleaner_res.request()
         yield req
 
         if block_type == VictimBlocks.TYPE_DATA:
-            yield self.env.process(
-                    self._datablockcleaner.clean(block_num, purpose))
+            yield self.env.process(self._datablockcleaner.clean(
+                block_num, purpose, should_continue))
         elif block_type == VictimBlocks.TYPE_TRANS:
-            yield self.env.process(
-                    self._transblockcleaner.clean(block_num, purpose))
+            yield self.env.process(self._transblockcleaner.clean(
+                block_num, purpose, should_continue))
 
         self._block_cleaner_res.release(req)
 
@@ -1586,10 +2452,13 @@ class DataBlockCleaner(object):
                     valid=self.oob.states.is_page_valid(ppn))
         self.gcid += 1
 
-    def clean(self, blocknum, purpose = PURPOSE_GC):
+    def clean(self, blocknum, purpose = PURPOSE_GC, should_continue=None):
         '''
         for each valid page, move it to another block
         invalidate pages in blocknum and erase block
+
+        If should_continue() turns False, stop after the current page move
+        and leave the block used.
         '''
         assert blocknum in self.block_pool.used_blocks
         # assert blocknum not in self.block_pool.current_blocks()
@@ -1597,9 +2466,17 @@ class DataBlockCleaner(object):
         self.log(blocknum)
 
         ppn_start, ppn_end = self.conf.block_to_page_range(blocknum)
-        for ppn in range(ppn_start, ppn_end):
-            if self.oob.states.is_page_valid(ppn):
-                yield self.env.process(self._clean_page(ppn, purpose))
+        if should_continue is None:
+            yield self.env.process(self._clean_pages(
+                valid_ppns_in_range(self.oob, ppn_start, ppn_end), purpose))
+        else:
+            # page by page, so we can stop between page moves
+            for ppn in range(ppn_start, ppn_end):
+                if self.oob.states.is_page_valid(ppn):
+                    if not should_continue():
+                        self.recorder.count_me("gc", "background.preempted")
+                        return
+                    yield self.env.process(self._clean_page(ppn, purpose))
 
         yield self.env.process(
             self.flash.erase_pbn_extent(blocknum, 1,
@@ -1609,6 +2486,49 @@ class DataBlockCleaner(object):
         self.oob.erase_block(blocknum)
         self.block_pool.move_used_data_block_to_free(blocknum)
 
+    def _clean_pages(self, ppns, purpose):
+        """
+        Move valid pages ppns together: read them all, write them all, and
+        then update the mappings grouped by m_vpn.
+
+        A host write may remap an lpn while its page is being moved. Such
+        an lpn keeps the host's mapping and its new copy is invalid.
+        """
+        if len(ppns) == 0:
+            return
+
+        for _ in ppns:
+            count_page_move(self.recorder, purpose, "user.page.moves")
+
+        yield self.env.process(
+            self.flash.rw_ppns(ppns, 'read',
+                tag=self.recorder.get_tag('read.data.gc', None)))
+
+        choice = gc_block_choice(purpose)
+        new_ppns = [self.block_pool.next_gc_data_page_to_program(choice)
+                for _ in ppns]
+
+        yield self.env.process(
+            self.flash.rw_ppns(new_ppns, 'write',
+                tag=self.recorder.get_tag('write.data.gc', None)))
+
+        lpns = [self.oob.ppn_to_lpn_or_mvpn(ppn) for ppn in ppns]
+
+        # mappings in cache, on flash and in the translation directory
+        updated = yield self.env.process(
+            self.mappings.update_batch(dict(zip(lpns, new_ppns)),
+                old_mappings=dict(zip(lpns, ppns))))
+
+        updated = set(updated)
+        moved = [i for i, lpn in enumerate(lpns) if lpn in updated]
+        stale = [i for i, lpn in enumerate(lpns) if lpn not in updated]
+
+        self.oob.relocate_data_pages(lpns=[lpns[i] for i in moved],
+                old_ppns=[ppns[i] for i in moved],
+                new_ppns=[new_ppns[i] for i in moved], update_time=False)
+        # copies of remapped lpns
+        self.oob.invalidate_ppns([new_ppns[i] for i in stale])
+
     def _clean_page(self, ppn, purpose):
         """
         read ppn, write to new ppn, update metadata
@@ -1675,14 +2595,25 @@ class TransBlockCleaner(object):
         self.env = env
         self._trans_page_locks = trans_page_locks
 
-    def clean(self, blocknum, purpose = PURPOSE_GC):
+        # pages moved with their m_vpns locked at a time
+        self.n_pages_per_batch = self.conf.n_channels_per_dev
+
+    def clean(self, blocknum, purpose = PURPOSE_GC, should_continue=None):
         assert blocknum in self.block_pool.used_blocks
         # assert blocknum not in self.block_pool.current_blocks()
 
         ppn_start, ppn_end = self.conf.block_to_page_range(blocknum)
-        for ppn in range(ppn_start, ppn_end):
-            if self.oob.states.is_page_valid(ppn):
-                yield self.env.process(self._clean_page(ppn, purpose))
+        if should_continue is None:
+            yield self.env.process(self._clean_pages(
+                valid_ppns_in_range(self.oob, ppn_start, ppn_end), purpose))
+        else:
+            # page by page, so we can stop between page moves
+            for ppn in range(ppn_start, ppn_end):
+                if self.oob.states.is_page_valid(ppn):
+                    if not should_continue():
+                        self.recorder.count_me("gc", "background.preempted")
+                        return
+                    yield self.env.process(self._clean_page(ppn, purpose))
 
         yield self.env.process(
             self.flash.erase_pbn_extent(blocknum, 1,
@@ -1692,6 +2623,65 @@ class TransBlockCleaner(object):
         self.oob.erase_block(blocknum)
         self.block_pool.move_used_trans_block_to_free(blocknum)
 
+    def _clean_pages(self, ppns, purpose):
+        """
+        Move valid translation pages ppns, n_pages_per_batch pages at a
+        time. The m_vpns of a batch are locked in ascending order, as all
+        cleaners do, while the pages are read and written.
+        """
+        moves = sorted((self.oob.ppn_to_lpn_or_mvpn(ppn), ppn)
+                for ppn in ppns)
+        for i in range(0, len(moves), self.n_pages_per_batch):
+            yield self.env.process(self._clean_page_batch(
+                moves[i:i + self.n_pages_per_batch], purpose))
+
+    def _clean_page_batch(self, moves, purpose):
+        """
+        moves are (m_vpn, ppn) in ascending m_vpn. A page rewritten while
+        we wait for its m_vpn is not moved.
+        """
+        tp_reqs = []
+        for m_vpn, _ in moves:
+            tp_req = self._trans_page_locks.get_request(m_vpn)
+            yield tp_req
+            self._trans_page_locks.locked_addrs.add(m_vpn)
+            self.mappings.m_vpn_locked(m_vpn)
+            tp_reqs.append(tp_req)
+
+        m_vpns = [m_vpn for m_vpn, ppn in moves
+                if self.directory.m_vpn_to_m_ppn(m_vpn) == ppn]
+        ppns = [ppn for m_vpn, ppn in moves
+                if self.directory.m_vpn_to_m_ppn(m_vpn) == ppn]
+
+        for _ in ppns:
+            count_page_move(self.recorder, purpose, "trans.page.moves")
+
+        if len(ppns) > 0:
+            yield self.env.process(
+                self.flash.rw_ppns(ppns, 'read',
+                    tag=self.recorder.get_tag('read.trans.gc', None)))
+
+            choice = gc_block_choice(purpose)
+            new_ppns = [
+                self.block_pool.next_gc_translation_page_to_program(choice)
+                for _ in ppns]
+
+            yield self.env.process(
+                self.flash.rw_ppns(new_ppns, 'write',
+                    tag=self.recorder.get_tag('write.trans.gc', None)))
+
+            # translation directory
+            for m_vpn, new_ppn in zip(m_vpns, new_ppns):
+                self.directory.update_mapping(m_vpn=m_vpn, m_ppn=new_ppn)
+            # oob state
+            self.oob.relocate_trans_pages(m_vpns=m_vpns, old_ppns=ppns,
+                    new_ppns=new_ppns, update_time=False)
+
+        for (m_vpn, _), tp_req in zip(moves, tp_reqs):
+            self._trans_page_locks.release_request(m_vpn, tp_req)
+            self._trans_page_locks.locked_addrs.remove(m_vpn)
+            self.mappings.m_vpn_unlocked(m_vpn)
+
     def _clean_page(self, ppn, purpose):
         assert self.oob.states.is_page_valid(ppn) is True
 
@@ -1705,6 +2695,7 @@ class TransBlockCleaner(object):
         tp_req = self._trans_page_locks.get_request(m_vpn)
         yield tp_req
         self._trans_page_locks.locked_addrs.add(m_vpn)
+        self.mappings.m_vpn_locked(m_vpn)
 
         yield self.env.process(
             self.flash.rw_ppn_extent(ppn, 1, 'read',
@@ -1742,6 +2733,7 @@ class TransBlockCleaner(object):
 
         self._trans_page_locks.release_request(m_vpn, tp_req)
         self._trans_page_locks.locked_addrs.remove(m_vpn)
+        self.mappings.m_vpn_unlocked(m_vpn)
 
 
 class OutOfBandAreas(object):
@@ -1749,7 +2741,7 @@ class OutOfBandAreas(object):
     It is used to hold page state and logical page number of a page.
     It is not necessary to implement it as list. But the interface should
     appear to be so.  It consists of page state (bitmap) and logical page
-    number (dict).  Let's proivde more intuitive interfaces: OOB should accept
+    number (array).  Let's proivde more intuitive interfaces: OOB should accept
     events, and react accordingly to this event. The action may involve state
     and lpn_of_phy_page.
     """
@@ -1763,8 +2755,8 @@ class OutOfBandAreas(object):
         # Key data structures
         self.states = FlashBitmap2(confobj)
         # ppn->lpn mapping stored in OOB, Note that for translation pages, this
-        # mapping is ppn -> m_vpn
-        self.ppn_to_lpn_mvpn = {}
+        # mapping is ppn -> m_vpn. _NO_VALUE means nothing is stored.
+        self.ppn_to_lpn_mvpn = array.array('l', [_NO_VALUE]) * self.total_pages
         # Timestamp table PPN -> timestamp
         # Here are the rules:
         # 1. only programming a PPN updates the timestamp of PPN
@@ -1775,12 +2767,14 @@ class OutOfBandAreas(object):
         # 2. discarding, and reading a ppn does not change it.
         # 3. erasing a block will remove all the timestamps of the block
         # 4. so cur_timestamp can only be advanced by LBA operations
-        self.timestamp_table = {}
+        self.timestamp_table = array.array('l', [_NO_VALUE]) * self.total_pages
         self.cur_timestamp = 0
 
         # flash block -> last invalidation time
-        # int -> timedate.timedate
-        self.last_inv_time_of_block = {}
+        # The time is cur_timestamp, a logical clock of page programs, so
+        # ages are deterministic across runs. _NO_VALUE means never.
+        self.last_inv_time_of_block = array.array('l', [_NO_VALUE]) * \
+                self.flash_num_blocks
 
     ############# Time stamp related ############
     def _incr_timestamp(self):
@@ -1791,6 +2785,16 @@ class OutOfBandAreas(object):
         self.cur_timestamp += 1
         return t
 
+    def block_age(self, flash_block):
+        """
+        Number of timestamps issued since the block was last invalidated.
+        A block that has never been invalidated is 0 old.
+        """
+        last_inv_time = self.last_inv_time_of_block[flash_block]
+        if last_inv_time == _NO_VALUE:
+            return 0
+        return self.cur_timestamp - last_inv_time
+
     def set_timestamp_of_ppn(self, ppn):
         self.timestamp_table[ppn] = self._incr_timestamp()
 
@@ -1798,25 +2802,20 @@ class OutOfBandAreas(object):
         self.timestamp_table[dst_ppn] = self.timestamp_table[src_ppn]
 
     def ppn_to_lpn_or_mvpn(self, ppn):
-        return self.ppn_to_lpn_mvpn[ppn]
+        virtual_pn = self.ppn_to_lpn_mvpn[ppn]
+        if virtual_pn == _NO_VALUE:
+            raise KeyError(ppn)
+        return virtual_pn
 
     def erase_block(self, flash_block):
         self.states.erase_block(flash_block)
 
         start, end = self.conf.block_to_page_range(flash_block)
-        for ppn in range(start, end):
-            try:
-                del self.ppn_to_lpn_mvpn[ppn]
-                # if you try to erase translation block here, it may fail,
-                # but it is expected.
-                del self.timestamp_table[ppn]
-            except KeyError:
-                pass
+        no_values = array.array('l', [_NO_VALUE]) * (end - start)
+        self.ppn_to_lpn_mvpn[start:end] = no_values
+        self.timestamp_table[start:end] = no_values
 
-        try:
-            del self.last_inv_time_of_block[flash_block]
-        except KeyError:
-            pass
+        self.last_inv_time_of_block[flash_block] = _NO_VALUE
 
     def relocate_data_page(self, lpn, old_ppn, new_ppn, update_time=True):
         self._relocate_page(virtual_pn=lpn, old_ppn=old_ppn, new_ppn=new_ppn,
@@ -1843,18 +2842,49 @@ class OutOfBandAreas(object):
         if old_ppn != UNINITIATED:
             self.invalidate_ppn(old_ppn)
 
+    def relocate_data_pages(self, lpns, old_ppns, new_ppns,
+            update_time=True):
+        self._relocate_pages(virtual_pns=lpns, old_ppns=old_ppns,
+                new_ppns=new_ppns, update_time=update_time)
+
+    def relocate_trans_pages(self, m_vpns, old_ppns, new_ppns,
+            update_time=True):
+        self._relocate_pages(virtual_pns=m_vpns, old_ppns=old_ppns,
+                new_ppns=new_ppns, update_time=update_time)
+
+    def _relocate_pages(self, virtual_pns, old_ppns, new_ppns,
+            update_time=True):
+        """
+        _relocate_page() for each page. Page states are changed by runs of
+        contiguous ppns.
+        """
+        for virtual_pn, old_ppn, new_ppn in zip(virtual_pns, old_ppns,
+                new_ppns):
+            if update_time is True:
+                self.set_timestamp_of_ppn(new_ppn)
+            else:
+                self.copy_timestamp(old_ppn, new_ppn)
+            self.ppn_to_lpn_mvpn[new_ppn] = virtual_pn
+
+        self.validate_ppns(new_ppns)
+        self.invalidate_ppns(
+                [ppn for ppn in old_ppns if ppn != UNINITIATED])
+
     def invalidate_ppns(self, ppns):
-        for ppn in ppns:
-            self.invalidate_ppn(ppn)
+        ppns = sorted(ppns)
+        self.states.invalidate_many(ppns)
+
+        n_pages_per_block = self.conf.n_pages_per_block
+        for block in set(ppn // n_pages_per_block for ppn in ppns):
+            self.last_inv_time_of_block[block] = self.cur_timestamp
 
     def invalidate_ppn(self, ppn):
         self.states.invalidate_page(ppn)
         block, _ = self.conf.page_to_block_off(ppn)
-        self.last_inv_time_of_block[block] = datetime.datetime.now()
+        self.last_inv_time_of_block[block] = self.cur_timestamp
 
     def validate_ppns(self, ppns):
-        for ppn in ppns:
-            self.validate_ppn(ppn)
+        self.states.validate_many(sorted(ppns))
 
     def validate_ppn(self, ppn):
         self.states.validate_page(ppn)
@@ -1869,7 +2899,8 @@ class OutOfBandAreas(object):
         s, e = self.conf.block_to_page_range(flash_block)
         lpns = []
         for ppn in range(s, e):
-            lpns.append(self.ppn_to_lpn_mvpn.get(ppn, 'NA'))
+            virtual_pn = self.ppn_to_lpn_mvpn[ppn]
+            lpns.append('NA' if virtual_pn == _NO_VALUE else virtual_pn)
 
         return lpns
 
@@ -1884,10 +2915,24 @@ class Config(config.ConfigNCQFTL):
             "cache_entry_bytes": 8, # 4 bytes for lpn, 4 bytes for ppn
             "GC_high_threshold_ratio": 0.95,
             "GC_low_threshold_ratio": 0.9,
+            # background GC starts above the high ratio and stops below
+            # the low ratio
+            "background_gc_high_ratio": 0.85,
+            "background_gc_low_ratio": 0.8,
             "over_provisioning": 1.28, #TODO: this is not used
             "mapping_cache_bytes": None, # cmt: cached mapping table
             "do_not_check_gc_setting": False,
             "write_gc_log": True,
+            # keep the cached mapping table in arrays instead of Row objects
+            "array_lpn_table": False,
+            # check row state transitions of the array table, for debugging
+            "check_lpn_table_states": False,
+            # assign flash pages to translation pages on first write-back
+            # instead of at initialization
+            "lazy_translation_pages": False,
+            # greedy, cost_benefit, fifo, windowed_greedy or d_choices.
+            # See victimpolicy.py
+            "gc_victim_policy": "greedy",
             }
         self.update(local_itmes)
         self['segment_bytes'] = 1*TB
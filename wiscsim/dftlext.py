@@ -1,10 +1,8 @@
 import bitarray
 from collections import deque, Counter
 import csv
-import datetime
 import random
 import os
-import Queue
 import sys
 
 import bidict
@@ -15,8 +13,9 @@ import ftlbuilder
 import lrulist
 import recorder
 from utilities import utils
-from .blkpool import BlockPool
+from .blkpool import BlockPool, TDATA, TTRANS
 from .bitmap import FlashBitmap2
+from . import victimpolicy
 
 """
 This refactors Dftl
@@ -207,7 +206,10 @@ class Config(config.ConfigNCQFTL):
             "GC_threshold_ratio": 0.95,
             "GC_low_threshold_ratio": 0.9,
             "over_provisioning": 1.28,
-            "mapping_cache_bytes": None # cmt: cached mapping table
+            "mapping_cache_bytes": None, # cmt: cached mapping table
+            # greedy, cost_benefit, fifo, windowed_greedy or d_choices.
+            # See victimpolicy.py
+            "gc_victim_policy": "cost_benefit",
             }
         self.update(local_itmes)
 
@@ -392,8 +394,9 @@ class OutOfBandAreas(object):
         self.timestamp_table = {}
         self.cur_timestamp = 0
 
-        # flash block -> last invalidation time
-        # int -> timedate.timedate
+        # flash block -> last invalidation time, in cur_timestamp, so ages
+        # are counted in LBA writes and do not depend on the host machine
+        # int -> int
         self.last_inv_time_of_block = {}
 
     ############# Time stamp related ############
@@ -417,7 +420,7 @@ class OutOfBandAreas(object):
     def wipe_ppn(self, ppn):
         self.states.invalidate_page(ppn)
         block, _ = self.conf.page_to_block_off(ppn)
-        self.last_inv_time_of_block[block] = datetime.datetime.now()
+        self.last_inv_time_of_block[block] = self.cur_timestamp
 
         # It is OK to delay it until we erase the block
         # try:
@@ -1080,6 +1083,39 @@ class BlockInfo(object):
         # return cmp(self.value, other.value)
 
 
+class VictimCandidates(victimpolicy.BlockCandidates):
+    """
+    Used data and translation blocks that have invalid pages, except the
+    current blocks. They are drawn from the bitmap's garbage block array
+    and told apart by the tag of the block.
+    """
+    def __init__(self, confobj, block_pool, oobobj):
+        super(VictimCandidates, self).__init__(
+                oobobj.states.garbage_block_array())
+        self.block_pool = block_pool
+        self.oob = oobobj
+        self.current_blocks = set(block_pool.current_blocks())
+
+    def candidate_type(self, blocknum):
+        tag = self.block_pool.get_tag(blocknum)
+        if tag == TDATA:
+            block_type = DATA_BLOCK
+        elif tag == TTRANS:
+            block_type = TRANS_BLOCK
+        else:
+            return None
+
+        if blocknum in self.current_blocks:
+            return None
+
+        if self.oob.states.block_valid_ratio(blocknum) == 1:
+            # none of the pages has been invalidated, we
+            # cannot get any free pages from it
+            return None
+
+        return block_type
+
+
 class GarbageCollector(object):
     def __init__(self, confobj, flashobj, oobobj, block_pool, mapping_manager,
         recorderobj):
@@ -1095,6 +1131,11 @@ class GarbageCollector(object):
 
         self.victim_block_seqid = 0
 
+        # one policy for all rounds, so its random samples go on
+        self.victim_policy = victimpolicy.create_victim_policy(self.conf,
+            self.oob.states.block_valid_ratio,
+            lambda blocknum: self.block_age(blocknum, self.oob.cur_timestamp))
+
     def try_gc(self):
         triggered = False
 
@@ -1184,15 +1225,15 @@ class GarbageCollector(object):
         old_ppn = ppn
 
         # read the the data page
-        pagedata = self.flash.read_pages(ppns = [old_ppn],
-                tag = DATA_CLEANING)[0]
+        ppn_data = self.flash.read_pages(ppns = [old_ppn],
+                tag = DATA_CLEANING)
 
         # find the mapping
         lpn = self.oob.translate_ppn_to_lpn(old_ppn)
 
         # write to new page
         new_ppn = self.block_pool.next_gc_data_page_to_program()
-        self.flash.write_pages(ppns = [new_ppn], ppn_data = [pagedata],
+        self.flash.write_pages(ppns = [new_ppn], ppn_data = ppn_data,
                 tag = DATA_CLEANING)
 
         # update new page and old page's OOB
@@ -1356,89 +1397,77 @@ class GarbageCollector(object):
                 "valid ratio:{}."
                 .format(blocknum, valid_ratio))
 
-        age = current_time - self.oob.last_inv_time_of_block[blocknum]
-        age = age.total_seconds()
-        bene_cost = age * ( 1 - valid_ratio ) / ( 2 * valid_ratio )
+        age = self.block_age(blocknum, current_time)
+        bene_cost = victimpolicy.benefit_cost(valid_ratio, age)
 
         return bene_cost, valid_ratio
 
+    def block_age(self, blocknum, current_time):
+        "LBA writes since the last invalidation in the block"
+        last_inv_time = self.oob.last_inv_time_of_block.get(blocknum, None)
+        if last_inv_time is None:
+            return 0
+        return current_time - last_inv_time
+
     def victim_blocks_iter(self):
         """
-        Calculate benefit/cost and put it to a priority queue
-        """
-        current_blocks = self.block_pool.current_blocks()
-        current_time = datetime.datetime.now()
-        priority_q = Queue.PriorityQueue()
-
-        for usedblocks, block_type in (
-            (self.block_pool.data_usedblocks, DATA_BLOCK),
-            (self.block_pool.trans_usedblocks, TRANS_BLOCK)):
-            for blocknum in usedblocks:
-                if blocknum in current_blocks:
-                    continue
-
-                bene_cost, valid_ratio = self.benefit_cost(blocknum,
-                    current_time)
-
-                if bene_cost == 0:
-                    # valid_ratio must be zero, we definitely don't
-                    # want to cleaning it because we cannot get any
-                    # free pages from it
-                    continue
-
-                blk_info = BlockInfo(block_type = block_type,
-                    block_num = blocknum, value = bene_cost)
-                blk_info.valid_ratio = valid_ratio
-
-                if blk_info.valid_ratio > 0:
-                    lpns = self.oob.lpns_of_block(blocknum)
-                    s, e = self.conf.block_to_page_range(blocknum)
-                    ppns = range(s, e)
-
-                    ppn_states = [self.oob.states.page_state_human(ppn)
-                        for ppn in ppns]
-                    blk_info.mappings = zip(ppns, lpns, ppn_states)
-
-                priority_q.put(blk_info)
-
-        while not priority_q.empty():
-            b_info =  priority_q.get()
+        Let conf['gc_victim_policy'] pick the order in which the candidate
+        blocks are cleaned. Only the blocks that are taken get a BlockInfo.
+        """
+        current_time = self.oob.cur_timestamp
+        candidates = VictimCandidates(self.conf, self.block_pool, self.oob)
+
+        for block_type, blocknum in self.victim_policy.victims(candidates):
+            yield self._victim_block_info(block_type, blocknum, current_time)
+
+    def _victim_block_info(self, block_type, blocknum, current_time):
+        bene_cost, valid_ratio = self.benefit_cost(blocknum, current_time)
+
+        b_info = BlockInfo(block_type = block_type,
+            block_num = blocknum, value = bene_cost)
+        b_info.valid_ratio = valid_ratio
+
+        # record the information of victim block
+        self.recorder.count_me('block.info.valid_ratio',
+            round(b_info.valid_ratio, 2))
+        self.recorder.count_me('block.info.bene_cost',
+            round(b_info.value))
+
+        if self.conf['record_bad_victim_block'] == True and \
+            b_info.valid_ratio > 0:
+            self.recorder.write_file('bad_victim_blocks',
+                block_type = b_info.block_type,
+                block_num = b_info.block_num,
+                bene_cost = b_info.value,
+                valid_ratio = round(b_info.valid_ratio, 2))
+
+            lpns = self.oob.lpns_of_block(blocknum)
+            s, e = self.conf.block_to_page_range(blocknum)
+            ppns = range(s, e)
+            ppn_states = [self.oob.states.page_state_human(ppn)
+                for ppn in ppns]
+
+            # lpn ppn ppn_states blocknum
+            for ppn, lpn, ppn_state in zip(ppns, lpns, ppn_states):
+                if b_info.block_type == DATA_BLOCK:
+                    lpn_timestamp = self.oob.timestamp_table[ppn]
+                else:
+                    lpn_timestamp = -1
+
+                self.recorder.write_file('bad.block.mappings',
+                    ppn = ppn,
+                    lpn = lpn,
+                    ppn_state = ppn_state,
+                    block_num = b_info.block_num,
+                    valid_ratio = b_info.valid_ratio,
+                    block_type = b_info.block_type,
+                    victim_block_seqid = self.victim_block_seqid,
+                    lpn_timestamp = lpn_timestamp
+                    )
 
-            # record the information of victim block
-            self.recorder.count_me('block.info.valid_ratio',
-                round(b_info.valid_ratio, 2))
-            self.recorder.count_me('block.info.bene_cost',
-                round(b_info.value))
+        self.victim_block_seqid += 1
 
-            if self.conf['record_bad_victim_block'] == True and \
-                b_info.valid_ratio > 0:
-                self.recorder.write_file('bad_victim_blocks',
-                    block_type = b_info.block_type,
-                    block_num = b_info.block_num,
-                    bene_cost = b_info.value,
-                    valid_ratio = round(b_info.valid_ratio, 2))
-
-                # lpn ppn ppn_states blocknum
-                for ppn, lpn, ppn_state in b_info.mappings:
-                    if b_info.block_type == DATA_BLOCK:
-                        lpn_timestamp = self.oob.timestamp_table[ppn]
-                    else:
-                        lpn_timestamp = -1
-
-                    self.recorder.write_file('bad.block.mappings',
-                        ppn = ppn,
-                        lpn = lpn,
-                        ppn_state = ppn_state,
-                        block_num = b_info.block_num,
-                        valid_ratio = b_info.valid_ratio,
-                        block_type = b_info.block_type,
-                        victim_block_seqid = self.victim_block_seqid,
-                        lpn_timestamp = lpn_timestamp
-                        )
-
-            self.victim_block_seqid += 1
-
-            yield b_info
+        return b_info
 
     def erase_block(self, blocknum, tag):
         """
@@ -1602,6 +1631,9 @@ class Dftl(ftlbuilder.FtlBuilder):
             range(lpn_start, lpn_start + lpn_count))
 
         data = self.flash.read_pages(ppns = ppns_to_read, tag = DATA_USER)
+        if data is None:
+            # page data is not stored
+            return None
         data = self.page_to_sec_items(data)
 
         self.check_read(sector, count, data)
@@ -1657,7 +1689,10 @@ class Dftl(ftlbuilder.FtlBuilder):
         ppns_to_write = self.mapping_manager.ppns_for_writing(
             range(lpn_start, lpn_start + lpn_count))
 
-        ppn_data = self.sec_to_page_items(data)
+        if self.flash.store_data is True:
+            ppn_data = self.sec_to_page_items(data)
+        else:
+            ppn_data = None
         self.flash.write_pages(ppns = ppns_to_write, ppn_data = ppn_data,
                 tag = DATA_USER)
 
@@ -1734,6 +1769,7 @@ class ParallelFlash(object):
         self.recorder = recorderobj
         self.global_helper = globalhelper
         self.flash_backend = flash.SimpleFlash(recorderobj, confobj)
+        self.store_data = confobj['store_page_data']
 
     def get_max_channel_page_count(self, ppns):
         """
@@ -1773,6 +1809,11 @@ class ParallelFlash(object):
         self.global_helper.timeline.incr_time_stamp('flash.read',
                 max_count)
 
+        if self.store_data is False:
+            for ppn in ppns:
+                self.flash_backend.page_read(ppn, tag)
+            return None
+
         data = []
         for ppn in ppns:
             data.append( self.flash_backend.page_read(ppn, tag) )
@@ -1791,7 +1832,7 @@ class ParallelFlash(object):
                 max_count)
 
         # save the data to flash
-        if ppn_data == None:
+        if ppn_data == None or self.store_data is False:
             for ppn in ppns:
                 self.flash_backend.page_write(ppn, tag)
         else:
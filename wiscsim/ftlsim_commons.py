@@ -95,6 +95,55 @@ class NCQSingleQueue(object):
             self.slots.release(req)
 
 
+class NCQIdleDetector(object):
+    """
+    Tracks how many host requests are being served. The device is idle when
+    there is none. Background work waits on it and gives way to new requests.
+    """
+    def __init__(self, simpy_env):
+        self.env = simpy_env
+        self.n_outstanding = 0
+        self.idle_since = 0
+        self._arrival_event = self.env.event()
+        self._idle_event = self.env.event()
+
+    def request_started(self):
+        self.n_outstanding += 1
+        self._arrival_event = self._fire(self._arrival_event)
+
+    def request_finished(self):
+        assert self.n_outstanding > 0
+        self.n_outstanding -= 1
+        if self.n_outstanding == 0:
+            self.idle_since = self.env.now
+            self._idle_event = self._fire(self._idle_event)
+
+    def _fire(self, event):
+        event.succeed()
+        return self.env.event()
+
+    def is_idle(self):
+        return self.n_outstanding == 0
+
+    def arrival_event(self):
+        "It fires when the next request starts"
+        return self._arrival_event
+
+    def wait_idle(self, duration):
+        """
+        Return when no request has been served for duration
+        """
+        while True:
+            if self.n_outstanding > 0:
+                yield self._idle_event
+                continue
+
+            remaining = self.idle_since + duration - self.env.now
+            if remaining <= 0:
+                break
+            yield self.env.timeout(remaining) | self._arrival_event
+
+
 def split_ext_by_segment(n_pages_per_segment, extent):
     if extent.lpn_count == 0:
         return None
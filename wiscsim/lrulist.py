@@ -87,7 +87,8 @@ class LinkedList(object):
         self.add_before(node, old_head)
 
     def add_to_tail(self, node):
-        self.add_before(node, self._end_guard)
+        # the node is also the head if the list is empty
+        self.add_before2(node, self._end_guard)
 
     def move_toward_head_by_one(self, node):
         "Boolean is returned to indicate status"
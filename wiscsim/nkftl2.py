@@ -1,9 +1,9 @@
 import bidict
 import sys
 import copy
-from collections import deque, OrderedDict
+from collections import deque, OrderedDict, Counter
 import datetime
-import Queue
+import heapq
 import itertools
 
 import config
@@ -63,6 +63,9 @@ class Config(config.ConfigNCQFTL):
                 "max_ratio_of_log_blocks": 2.0,
             },
             "write_gc_log": False,
+            # number of worker processes of SimulatorNkftlSharded. Each one
+            # gets 1/n_simulation_shards of the blocks.
+            "n_simulation_shards": 4,
         }
         self.update(local_itmes)
 
@@ -154,6 +157,9 @@ class OutOfBandAreas(object):
         # Key data structures
         self.states = FlashBitmap2(confobj)
         self.ppn_to_lpn = {}
+        # {pbn: lbn} if every page programmed to pbn since its last erase is
+        # at its own offset of logical block lbn, {pbn: None} if not
+        self._aligned_lbn = {}
 
     def display_bitmap_by_block(self):
         npages_per_block = self.conf.n_pages_per_block
@@ -177,6 +183,9 @@ class OutOfBandAreas(object):
 
         # It is OK to delay deleting ppn_to_lpn[ppn] until we erase the block
 
+    def wipe_ppns(self, ppns):
+        self.states.invalidate_many(sorted(ppns))
+
     def erase_block(self, flash_block):
         """
         Note that it does not call flash.block_erase(), because that's not
@@ -193,6 +202,8 @@ class OutOfBandAreas(object):
             except KeyError:
                 pass
 
+        self._aligned_lbn.pop(flash_block, None)
+
     def remap(self, lpn, old_ppn, new_ppn):
         """
         It remaps lpn from old_ppn to new_ppn
@@ -202,11 +213,41 @@ class OutOfBandAreas(object):
         """
         self.states.validate_page(new_ppn)
         self.ppn_to_lpn[new_ppn] = lpn
+        self._track_alignment(lpn, new_ppn)
 
         if old_ppn != None:
             # the lpn has mapping before this write
             self.states.invalidate_page(old_ppn)
 
+    def remap_many(self, lpns, old_ppns, new_ppns):
+        """
+        remap() for each lpn. Page states are changed by runs of contiguous
+        ppns. old_ppns may have None, for lpns without old mappings.
+        """
+        for lpn, new_ppn in zip(lpns, new_ppns):
+            self.ppn_to_lpn[new_ppn] = lpn
+            self._track_alignment(lpn, new_ppn)
+
+        self.states.validate_many(sorted(new_ppns))
+        self.states.invalidate_many(
+                sorted(ppn for ppn in old_ppns if ppn != None))
+
+    def _track_alignment(self, lpn, ppn):
+        pbn, physical_off = self.conf.page_to_block_off(ppn)
+        lbn, logical_off = self.conf.page_to_block_off(lpn)
+        if logical_off != physical_off:
+            self._aligned_lbn[pbn] = None
+        elif pbn not in self._aligned_lbn:
+            self._aligned_lbn[pbn] = lbn
+        elif self._aligned_lbn[pbn] != lbn:
+            self._aligned_lbn[pbn] = None
+
+    def aligned_lbn_of_block(self, flash_block):
+        """
+        Return the logical block that all pages programmed to flash_block
+        are aligned to, or None if there is no such logical block.
+        """
+        return self._aligned_lbn.get(flash_block, None)
 
     def lpns_of_block(self, flash_block):
         s, e = self.conf.block_to_page_range(flash_block)
@@ -217,18 +258,11 @@ class OutOfBandAreas(object):
         return lpns
 
     def is_any_page_valid(self, flash_block):
-        ppn_start, ppn_end = self.conf.block_to_page_range(flash_block)
-        for ppn in range(ppn_start, ppn_end):
-            if self.states.is_page_valid(ppn):
-                return True
-        return False
+        return self.states.block_valid_count(flash_block) > 0
 
     def are_all_pages_invalid(self, flash_block):
-        ppn_start, ppn_end = self.conf.block_to_page_range(flash_block)
-        for ppn in range(ppn_start, ppn_end):
-            if not self.states.is_page_invalid(ppn):
-                return False
-        return True
+        return self.states.block_invalid_count(flash_block) == \
+                self.conf.n_pages_per_block
 
     def are_all_pages_erased(self, flash_block):
         ppn_start, ppn_end = self.conf.block_to_page_range(flash_block)
@@ -360,9 +394,22 @@ class LogGroup2(object):
     - allocate pages from blocks of this group
     - report need to merge
     """
-    def __init__(self, conf, block_pool, max_n_log_blocks):
+    def __init__(self, conf, block_pool, max_n_log_blocks, dgn=None,
+            block_owners=None, active_groups=None):
+        """
+        block_owners ({pbn: dgn}) and active_groups (OrderedDict of dgns
+        that have log blocks, used as an ordered set) are shared by all log
+        groups. This group keeps its own blocks and dgn in them.
+        """
         self.conf = conf
         self.block_pool = block_pool
+        self.dgn = dgn
+        if block_owners is None:
+            block_owners = {}
+        self._block_owners = block_owners
+        if active_groups is None:
+            active_groups = OrderedDict()
+        self._active_groups = active_groups
         self.n_channels = block_pool.n_channels
         self.n_pages_per_block = block_pool.n_pages_per_block
 
@@ -373,13 +420,19 @@ class LogGroup2(object):
         self._cur_channel_used_pages = 0
 
         self._page_map = bidict.bidict() # lpn->ppn
+        # lbn -> number of lpns of lbn in _page_map
+        self._n_mapped_lpns = Counter()
 
     def update_block_use_time(self, blocknum):
         pass
 
     def clear(self):
         self._page_map.clear()
+        self._n_mapped_lpns.clear()
+        for blocknum in self.log_block_numbers():
+            del self._block_owners[blocknum]
         self.log_channels = [[] for i in range(self.n_channels)]
+        self._active_groups.pop(self.dgn, None)
 
     def add_mapping(self, lpn, ppn):
         """
@@ -388,10 +441,23 @@ class LogGroup2(object):
         """
         blk, off = self.conf.page_to_block_off(ppn)
         assert blk in self.log_block_numbers()
+        if lpn not in self._page_map:
+            self._incr_mapped_lpns(lpn, 1)
         self._page_map[lpn] = ppn
 
     def remove_lpn(self, lpn):
         del self._page_map[lpn]
+        self._incr_mapped_lpns(lpn, -1)
+
+    def _incr_mapped_lpns(self, lpn, n):
+        lbn, _ = self.conf.page_to_block_off(lpn)
+        self._n_mapped_lpns[lbn] += n
+        if self._n_mapped_lpns[lbn] == 0:
+            del self._n_mapped_lpns[lbn]
+
+    def n_mapped_lpns_of_lbn(self, lbn):
+        "Return the number of lpns of logical block lbn mapped here"
+        return self._n_mapped_lpns[lbn]
 
     def lpn_to_ppn(self, lpn):
         """
@@ -426,11 +492,11 @@ class LogGroup2(object):
         # remove all page maps
         ppn_start, ppn_end = self.conf.block_to_page_range(log_pbn)
         for ppn in range(ppn_start, ppn_end):
-            try:
+            lpn = self._page_map.inv.get(ppn, None)
+            if lpn is not None:
                 # del self._page_map[:ppn]
                 del self._page_map.inv[ppn]
-            except KeyError:
-                pass
+                self._incr_mapped_lpns(lpn, -1)
 
         self._remove_block(log_pbn)
 
@@ -443,6 +509,15 @@ class LogGroup2(object):
                 to_del = cur_block
                 break
         channel_blocks.remove(to_del)
+        del self._block_owners[blocknum]
+        if self.n_log_blocks() == 0:
+            self._active_groups.pop(self.dgn, None)
+
+    def _add_block(self, channel_id, curblock):
+        self.log_channels[channel_id].append(curblock)
+        self._block_owners[curblock.blocknum] = self.dgn
+        # a group that is already active keeps its place
+        self._active_groups.setdefault(self.dgn, None)
 
     def reached_max_log_blocks(self):
         return self.n_log_blocks() == self.max_n_log_blocks
@@ -541,7 +616,7 @@ class LogGroup2(object):
         # set the curblock as fully used so nobody accidentally use it
         curblock.next_page_offset = self.conf.n_pages_per_block
 
-        self.log_channels[channel_id].append( curblock )
+        self._add_block(channel_id, curblock)
 
     def _allocate_block_in_channel(self, channel_id):
         cnt = self.block_pool.count_blocks(tag=TFREE, channels=[channel_id])
@@ -553,8 +628,8 @@ class LogGroup2(object):
 
         blocknum = self.block_pool.pick(tag=TFREE, channel_id=channel_id)
         self.block_pool.change_tag(blocknum, src=TFREE, dst=TLOG)
-        self.log_channels[channel_id].append(
-                CurrentBlock(self.n_pages_per_block, blocknum) )
+        self._add_block(channel_id,
+                CurrentBlock(self.n_pages_per_block, blocknum))
 
         assert self.n_log_blocks() <= self.max_n_log_blocks, "{} > {}".format(
                 self.n_log_blocks(), self.max_n_log_blocks)
@@ -633,23 +708,35 @@ class LogMappingTable(MappingBase):
 
         # dgn -> log block info of data group (LogGroup2)
         self.log_group_info = {}
+        # log pbn -> dgn, kept by the log groups
+        self._log_block_owners = {}
+        # dgns that have log blocks, kept by the log groups in the order
+        # they got their first log block
+        self._active_data_groups = OrderedDict()
 
     def find_group_by_pbn(self, pbn):
-        dgn = None
-        loggroup = None
-        for i_dgn, i_loggroup in self.log_group_info.items():
-            if pbn in i_loggroup.log_block_numbers():
-                dgn = i_dgn
-                loggroup = i_loggroup
-
-        return dgn, loggroup
+        dgn = self._log_block_owners.get(pbn, None)
+        if dgn is None:
+            return None, None
+        return dgn, self.log_group_info[dgn]
 
     def next_ppns_to_program(self, dgn, n, strip_unit_size):
-        loggroup = self.log_group_info.setdefault(dgn,
-            LogGroup2(self.conf, self.block_pool,
-                max_n_log_blocks=self.conf['nkftl']['max_blocks_in_log_group']))
+        loggroup = self.log_group_info.get(dgn, None)
+        if loggroup is None:
+            loggroup = LogGroup2(self.conf, self.block_pool,
+                max_n_log_blocks=self.conf['nkftl']['max_blocks_in_log_group'],
+                dgn=dgn, block_owners=self._log_block_owners,
+                active_groups=self._active_data_groups)
+            self.log_group_info[dgn] = loggroup
         return loggroup.next_ppns(n, strip_unit_size=strip_unit_size)
 
+    def active_data_groups(self):
+        """
+        Return dgns that have log blocks, the one that has had log blocks
+        for the longest time first
+        """
+        return self._active_data_groups.keys()
+
     def add_mapping(self, lpn, ppn):
         dgn = self.conf.nkftl_data_group_number_of_lpn(lpn)
         self.log_group_info[dgn].add_mapping(lpn, ppn)
@@ -674,6 +761,17 @@ class LogMappingTable(MappingBase):
             return False, None
         return log_group_info.lpn_to_ppn(lpn)
 
+    def n_mapped_lpns_of_lbn(self, lbn):
+        """
+        Return the number of lpns of logical block lbn mapped in log blocks
+        """
+        dgn = self.conf.nkftl_data_group_number_of_lpn(
+                self.conf.block_off_to_page(lbn, 0))
+        log_group_info = self.log_group_info.get(dgn, None)
+        if log_group_info == None:
+            return 0
+        return log_group_info.n_mapped_lpns_of_lbn(lbn)
+
     def remove_log_block(self, data_group_no, log_pbn):
         """
         It completely removes mapping info of log block log_lbn.
@@ -787,22 +885,23 @@ class WearLevelingVictimBlocks(object):
         """
         Pick the 10% least erased USED Blocks
         """
-        erasure_cnt = self._block_pool.get_erasure_count()
-        least_used_blocks = reversed(erasure_cnt.most_common())
-
-        used_data_blocks = self._block_pool.data_usedblocks
-        used_log_blocks = self._block_pool.log_usedblocks
+        # used data or log blocks, from least erased to most erased
+        least_used_blocks = self._block_pool.iter_blocks_by_erasure(
+                tags=[TDATA, TLOG], choice=LEAST_ERASED)
 
-        # we need used data or trans block
         victim_cnt = 0
-        for blocknum, count in least_used_blocks:
+        for count, blocknum, tag in least_used_blocks:
+            if self._block_pool.get_tag(blocknum) != tag:
+                # it has been moved since the iteration started
+                continue
+
             valid_ratio = self._oob.states.block_valid_ratio(blocknum)
-            if blocknum in used_data_blocks:
+            if tag == TDATA:
                 found, _ = self.data_block_mapping_table.pbn_to_lbn(blocknum)
                 if found is True:
                     yield valid_ratio, self.TYPE_DATA, blocknum
                     victim_cnt += 1
-            elif blocknum in used_log_blocks:
+            else:
                 dgn, _ = self.log_mapping_table.find_group_by_pbn(blocknum)
                 if dgn is not None:
                     yield valid_ratio, self.TYPE_LOG, blocknum
@@ -819,19 +918,19 @@ class VictimBlocksBase(object):
         self.block_pool = block_pool
         self.oob = oob
         self.rec = rec
-        self.priority_q = Queue.PriorityQueue()
+        self.priority_q = []
         self.log_mapping = log_mapping_table
         self.data_mapping = data_block_mapping_table
 
         self._init()
 
     def __iter__(self):
-        while not self.priority_q.empty():
-            b_info = self.priority_q.get()
+        while len(self.priority_q) > 0:
+            b_info = heapq.heappop(self.priority_q)
             yield b_info
 
     def __len__(self):
-        return self.priority_q.qsize()
+        return len(self.priority_q)
 
 
 class VictimDataBlocks(VictimBlocksBase):
@@ -845,7 +944,7 @@ class VictimDataBlocks(VictimBlocksBase):
                     block_num = blocknum,
                     valid_ratio = self.oob.states.block_valid_ratio(blocknum),
                     last_used_time = -1)  # high priority
-                self.priority_q.put(blk_info)
+                heapq.heappush(self.priority_q, blk_info)
 
 
 class VictimLogBlocks(VictimBlocksBase):
@@ -854,7 +953,8 @@ class VictimLogBlocks(VictimBlocksBase):
         TODO: is there any log blocks that are not in log mapping but in
         log_usedblocks?
         """
-        for data_group_no, log_group_info in self.log_mapping.log_group_info.items():
+        for data_group_no in self.log_mapping.active_data_groups():
+            log_group_info = self.log_mapping.log_group_info[data_group_no]
             for curblock in log_group_info.cur_blocks():
                 blk_info = BlockInfo(
                     block_type = TYPE_LOG_BLOCK,
@@ -863,7 +963,7 @@ class VictimLogBlocks(VictimBlocksBase):
                         curblock.blocknum),
                     last_used_time = 0,
                     data_group_no = data_group_no)
-                self.priority_q.put(blk_info)
+                heapq.heappush(self.priority_q, blk_info)
 
 
 class GarbageCollector(object):
@@ -904,10 +1004,9 @@ class GarbageCollector(object):
             return
 
         procs = []
-        for dgn in range(self.conf.n_datagroups_per_dev()):
-            if dgn in self.log_mapping_table.log_group_info.keys():
-                p = self.env.process(self.clean_data_group(dgn, merge=merge))
-                procs.append(p)
+        for dgn in self.log_mapping_table.active_data_groups():
+            p = self.env.process(self.clean_data_group(dgn, merge=merge))
+            procs.append(p)
         yield simpy.AllOf(self.env, procs)
 
         self._cleaning_lock.release(req)
@@ -1093,64 +1192,65 @@ class GarbageCollector(object):
         if dst_phy_block_num is None:
             raise OutOfSpaceError("Fail to find free block for full merge")
 
+        data_group_no = self.conf.nkftl_data_group_number_of_logical_block(
+            lbn)
+
+        # Find the valid pages of lbn. A page that does not exist is left
+        # erased in the new block.
+        # moves: [(lpn, src_ppn, dst_ppn, location), ...]
+        moves = []
         lpn_start, lpn_end = self.conf.block_to_page_range(lbn)
         for lpn in range(lpn_start, lpn_end):
             in_block_page_off = lpn - lpn_start
             dst_ppn = self.conf.block_off_to_page(dst_phy_block_num,
                 in_block_page_off)
-            data_group_no = self.conf.nkftl_data_group_number_of_lpn(lpn)
 
             found, src_ppn, loc = self.translator.lpn_to_ppn(lpn)
             if found == True and self.oob.states.is_page_valid(src_ppn):
-                data = self.flash.page_read(src_ppn, cat = tag)
-                yield self.env.process(
-                    self.des_flash.rw_ppns([src_ppn], 'read', tag = tag))
-                self.flash.page_write(dst_ppn, cat = tag, data = data)
-                yield self.env.process(
-                    self.des_flash.rw_ppns([dst_ppn], 'write', tag = tag))
-
-                self.oob.remap(lpn = lpn, old_ppn = src_ppn,
-                    new_ppn = dst_ppn)
-
-                src_block, _ = self.conf.page_to_block_off(src_ppn)
-                if self.conf['write_gc_log'] is True:
-                    self.recorder.write_file('gc.log',
-                        gcid=self.gcid,
-                        blocknum=src_block,
-                        lpn=lpn,
-                        ppn=src_ppn,
-                        merge_type='full',
-                        valid=True)
-
-                # Now you've moved lpn, you need to remove lpn mapping if it is
-                # in log blocks
-                if loc == IN_LOG_BLOCK:
-                    self.translator.log_mapping_table.remove_lpn(lpn)
-
-                # After moving, you need to check if the source block of src_ppn
-                # is totally free. If it is, we have to erase it and put it to
-                # free block pool
-                src_pbn, _ = self.conf.page_to_block_off(src_ppn)
-                if not self.oob.is_any_page_valid(src_pbn):
-                    if loc == IN_DATA_BLOCK:
-                        yield self.env.process(
-                                self.recycle_empty_data_block(data_block=src_pbn,
-                                tag=TAG_FULL_MERGE))
-
-                    elif loc == IN_LOG_BLOCK:
-                        yield self.env.process(
-                            self._recycle_empty_log_block(
-                                data_group_no=data_group_no,
-                                log_pbn=src_pbn,
-                                tag=TAG_FULL_MERGE))
+                moves.append((lpn, src_ppn, dst_ppn, loc))
+
+        # Copy all of them at once, so pages on different channels are
+        # read and written in parallel
+        yield self.env.process(self._copy_pages(moves, tag))
+
+        self._remap_moves(moves)
+
+        # src_blocks: {src block: location}, in the order we met them
+        src_blocks = OrderedDict()
+        for lpn, src_ppn, dst_ppn, loc in moves:
+            src_block, _ = self.conf.page_to_block_off(src_ppn)
+            if self.conf['write_gc_log'] is True:
+                self.recorder.write_file('gc.log',
+                    gcid=self.gcid,
+                    blocknum=src_block,
+                    lpn=lpn,
+                    ppn=src_ppn,
+                    merge_type='full',
+                    valid=True)
+
+            # Now you've moved lpn, you need to remove lpn mapping if it is
+            # in log blocks
+            if loc == IN_LOG_BLOCK:
+                self.translator.log_mapping_table.remove_lpn(lpn)
+
+            src_blocks[src_block] = loc
+
+        # After moving, you need to check if the source blocks are totally
+        # free. If they are, we have to erase them and put them to free
+        # block pool
+        for src_pbn, loc in src_blocks.items():
+            if not self.oob.is_any_page_valid(src_pbn):
+                if loc == IN_DATA_BLOCK:
+                    yield self.env.process(
+                            self.recycle_empty_data_block(data_block=src_pbn,
+                            tag=TAG_FULL_MERGE))
 
-            else:
-                # This lpn does not exist, so we just invalidate the
-                # destination page. We have to do this because we can only
-                # program flash sequentially.
-                # self.flash.page_write(dst_ppn, tag, data = -1)
-                # self.oob.states.invalidate_page(dst_ppn)
-                pass
+                elif loc == IN_LOG_BLOCK:
+                    yield self.env.process(
+                        self._recycle_empty_log_block(
+                            data_group_no=data_group_no,
+                            log_pbn=src_pbn,
+                            tag=TAG_FULL_MERGE))
 
         # Now we have all the pages in new block, we make the new block
         # the data block for lbn
@@ -1165,6 +1265,35 @@ class GarbageCollector(object):
 
         self.logical_block_locks.release_request(lbn, req)
 
+    def _copy_pages(self, moves, tag):
+        """
+        Copy src_ppn to dst_ppn of each (lpn, src_ppn, dst_ppn, location) in
+        moves. All pages are read in one batch and then written in one
+        batch.
+        """
+        if len(moves) == 0:
+            return
+
+        src_ppns = [src_ppn for _, src_ppn, _, _ in moves]
+        dst_ppns = [dst_ppn for _, _, dst_ppn, _ in moves]
+
+        contents = [self.flash.page_read(src_ppn, cat = tag)
+                for src_ppn in src_ppns]
+        yield self.env.process(
+            self.des_flash.rw_ppns(src_ppns, 'read', tag = tag))
+
+        for dst_ppn, data in zip(dst_ppns, contents):
+            self.flash.page_write(dst_ppn, cat = tag, data = data)
+        yield self.env.process(
+            self.des_flash.rw_ppns(dst_ppns, 'write', tag = tag))
+
+    def _remap_moves(self, moves):
+        "remap OOB of (lpn, src_ppn, dst_ppn, location) in moves"
+        self.oob.remap_many(
+            lpns = [lpn for lpn, _, _, _ in moves],
+            old_ppns = [src_ppn for _, src_ppn, _, _ in moves],
+            new_ppns = [dst_ppn for _, _, dst_ppn, _ in moves])
+
     def _is_any_lpn_in_logmapping(self, lbn):
         start, end = self.conf.block_to_page_range(lbn)
         for lpn in range(start, end):
@@ -1200,40 +1329,29 @@ class GarbageCollector(object):
         if not log_pbn in self.block_pool.log_usedblocks:
             return False, None, None
 
-        # first k pages must be valid
-        last_valid_ppn = None
-        for ppn in range(ppn_start, ppn_end):
-            if self.oob.states.is_page_valid(ppn):
-                last_valid_ppn = ppn
-            else:
-                break
-
-        if last_valid_ppn == None or last_valid_ppn == ppn_end - 1:
+        states = self.oob.states
+        n_valid = states.block_valid_count(log_pbn)
+        if n_valid == 0 or n_valid == self.conf.n_pages_per_block:
             # nobody is valid or everybody is valid
             # if everybody is valid, it could be switch mergable, but not
             # partial mergable.
             return False, None, None
 
-        # the rest must be erased
-        for ppn in range(last_valid_ppn + 1, ppn_end):
-            if not self.oob.states.is_page_erased(ppn):
-                return False, None, None
-
-        # the valid pages must be aligned between logical and physical address
-        lpn_start = self.oob.ppn_to_lpn[ppn_start]
-        logical_block, off = self.conf.page_to_block_off(lpn_start)
-        if off != 0:
-            # the first lpn is not aligned
+        # first k pages must be valid and the rest must be erased
+        if states.block_invalid_count(log_pbn) != 0 or \
+                states.valid_count_in_range(ppn_start, ppn_start + n_valid) \
+                != n_valid:
             return False, None, None
 
-        for ppn in range(ppn_start, last_valid_ppn + 1):
-            lpn = self.oob.ppn_to_lpn[ppn]
-            if lpn - lpn_start != ppn - ppn_start:
-                # not aligned
-                return False, None, None
+        # the valid pages must be aligned between logical and physical
+        # address. They are the only programmed pages, so it is what the
+        # OOB has tracked since they were programmed.
+        logical_block = self.oob.aligned_lbn_of_block(log_pbn)
+        if logical_block is None:
+            return False, None, None
 
         # now we know it is parital mergable
-        return True, logical_block, last_valid_ppn + 1 - ppn_start
+        return True, logical_block, n_valid
 
     def partial_merge(self, log_pbn, lbn, first_free_offset):
         """
@@ -1269,7 +1387,9 @@ class GarbageCollector(object):
 
         data_group_no = self.conf.nkftl_data_group_number_of_logical_block(
             lbn)
-        # Copy
+        # Find what to copy
+        # moves: [(lpn, src_ppn, dst_ppn, location), ...]
+        moves = []
         for offset in range(first_free_offset,
                 self.conf.n_pages_per_block):
             lpn = self.conf.block_off_to_page(lbn, offset)
@@ -1281,77 +1401,42 @@ class GarbageCollector(object):
                 # 1. cannot find
                 # 2. found, but not valid
                 self.oob.states.invalidate_page(dst_ppn)
-            elif found == True and location == IN_DATA_BLOCK:
-                src_block, _ = self.conf.page_to_block_off(src_ppn)
-                data = self.flash.page_read(src_ppn, cat = TAG_PARTIAL_MERGE)
-                yield self.env.process(
-                    self.des_flash.rw_ppns([src_ppn], 'read', tag=TAG_PARTIAL_MERGE))
-                self.flash.page_write(dst_ppn, cat = TAG_PARTIAL_MERGE,
-                    data = data)
-                yield self.env.process(
-                    self.des_flash.rw_ppns([dst_ppn], 'write', tag=TAG_PARTIAL_MERGE))
-                self.oob.remap(lpn, old_ppn = src_ppn, new_ppn = dst_ppn)
-
-                if self.conf['write_gc_log'] is True:
-                    self.recorder.write_file('gc.log',
-                        gcid=self.gcid,
-                        blocknum=src_block,
-                        lpn=lpn,
-                        ppn=src_ppn,
-                        merge_type='partial-data',
-                        valid=True)
-
-                # This branch may never be called because the none of the rest
-                # of the pages is valid, thus you don't have the change
-                # to recyle the old data block
-                # for example:
-                #         - Log BLock -
-                #          pages: 0123
-                #          state: VEEE
-                #  logical block:   7
-                #
-                #         - Data BLock -
-                #          pages: 0123
-                #          state: IIII
-                #  logical block:   7
-                # In the case above, log block is partial mergable. When you
-                # try to partial merge it, you try to find valid pages of page
-                # 123. But none of them is valid. So you will not come to this
-                # branch. So the data block will not be recyled.
-                #
-                # Actually it is not a good idea to recyle the data block here.
-                # Because there should be only one data block associated with
-                # on partial merge. You can just find out which one it is and
-                # try to recycle it once.
-                # self.recycle_empty_data_block(src_block,
-                    # tag = TAG_PARTIAL_MERGE ) # check and then recycle
-            elif found == True and location == IN_LOG_BLOCK:
-                src_block, _ = self.conf.page_to_block_off(src_ppn)
-                # If the lpn is in log block
-                data = self.flash.page_read(src_ppn, cat = TAG_PARTIAL_MERGE)
-                yield self.env.process(
-                    self.des_flash.rw_ppns([src_ppn], 'read', tag = TAG_PARTIAL_MERGE))
-                self.flash.page_write(dst_ppn, cat = TAG_PARTIAL_MERGE,
-                    data = data)
-                yield self.env.process(
-                    self.des_flash.rw_ppns([dst_ppn], 'write', tag = TAG_PARTIAL_MERGE))
-                self.oob.remap(lpn, old_ppn = src_ppn, new_ppn = dst_ppn)
-
-                if self.conf['write_gc_log'] is True:
-                    self.recorder.write_file('gc.log',
-                        gcid=self.gcid,
-                        blocknum=src_block,
-                        lpn=lpn,
-                        ppn=src_ppn,
-                        merge_type='partial-log',
-                        valid=True)
+            else:
+                moves.append((lpn, src_ppn, dst_ppn, location))
 
+        # Copy, in one batch of reads and one batch of writes
+        yield self.env.process(self._copy_pages(moves, TAG_PARTIAL_MERGE))
+
+        self._remap_moves(moves)
+
+        src_log_blocks = OrderedDict()
+        for lpn, src_ppn, dst_ppn, location in moves:
+            src_block, _ = self.conf.page_to_block_off(src_ppn)
+
+            if location == IN_DATA_BLOCK:
+                merge_type = 'partial-data'
+                # We do not recycle the old data block here. There should
+                # be only one data block associated with one partial merge,
+                # so we recycle it once below.
+            else:
+                merge_type = 'partial-log'
                 # you need to remove lpn from log mapping here
                 self.translator.log_mapping_table.remove_lpn(lpn=lpn)
-
-                yield self.env.process(
-                    self._recycle_empty_log_block(data_group_no = data_group_no,
-                    log_pbn = src_block, tag = TAG_PARTIAL_MERGE))
+                src_log_blocks[src_block] = True
+
+            if self.conf['write_gc_log'] is True:
+                self.recorder.write_file('gc.log',
+                    gcid=self.gcid,
+                    blocknum=src_block,
+                    lpn=lpn,
+                    ppn=src_ppn,
+                    merge_type=merge_type,
+                    valid=True)
+
+        for src_block in src_log_blocks:
+            yield self.env.process(
+                self._recycle_empty_log_block(data_group_no = data_group_no,
+                log_pbn = src_block, tag = TAG_PARTIAL_MERGE))
 
         # If there is an old data block, we need to recycle it because we
         # now have a new one.
@@ -1383,40 +1468,33 @@ class GarbageCollector(object):
 
         Return Mergable?, logical_block
         """
-        ppn_start, ppn_end = self.conf.block_to_page_range(log_pbn)
-        lpn_start = None
-
         if not log_pbn in self.block_pool.log_usedblocks:
             return False, None
 
-        logical_blocks = set()
-        # valid pages should be aligned to the same logical block
-        for ppn in range(ppn_start, ppn_end):
-            if self.oob.states.is_page_valid(ppn) is True:
-                lpn = self.oob.ppn_to_lpn[ppn]
-                logical_block, logical_off = self.conf.page_to_block_off(lpn)
-                _, physical_off = self.conf.page_to_block_off(ppn)
+        n_valid = self.oob.states.block_valid_count(log_pbn)
+        if n_valid == 0:
+            return False, None
 
-                if logical_off != physical_off:
-                    return False, None
+        # valid pages should be aligned to the same logical block. We only
+        # take blocks whose programmed pages are all aligned.
+        logical_block = self.oob.aligned_lbn_of_block(log_pbn)
+        if logical_block is None:
+            return False, None
 
-                logical_blocks.add(logical_block)
+        if n_valid == self.conf.n_pages_per_block:
+            return True, logical_block
 
-        if len(logical_blocks) != 1:
+        # invalid pages should not be anywhere. Lpns of logical_block at
+        # invalid offsets are mapped in data blocks if logical_block has
+        # one, and they are mapped in log blocks if logical_block has
+        # more log-mapped lpns than the valid ones here.
+        found, _ = self.data_block_mapping_table.lbn_to_pbn(logical_block)
+        if found is True:
             return False, None
 
-        # invalid pages should not be anywhere
-        logical_block = logical_blocks.pop()
-        for ppn in range(ppn_start, ppn_end):
-            if self.oob.states.is_page_valid(ppn) is False:
-                _, physical_off = self.conf.page_to_block_off(ppn)
-                lpn = self.conf.block_off_to_page(logical_block, physical_off)
-                found, _ = self.log_mapping_table.lpn_to_ppn(lpn)
-                if found is True:
-                    return False, None
-                found, _ = self.data_block_mapping_table.lpn_to_ppn(lpn)
-                if found is True:
-                    return False, None
+        n_mapped = self.log_mapping_table.n_mapped_lpns_of_lbn(logical_block)
+        if n_mapped != n_valid:
+            return False, None
 
         return True, logical_block
 
@@ -1471,7 +1549,7 @@ class GarbageCollector(object):
         # Need to mark the log block as used data block now
         try:
             self.block_pool.move_used_log_to_data_block(log_pbn)
-        except ValueError:
+        except KeyError:
             print 'log_pbn............', log_pbn
             raise
 
@@ -1779,6 +1857,11 @@ class Ftl(ftlbuilder.FtlBuilder):
         self.pre_read_bytes = 0
         self.display_interval = 4 * MB
 
+        # without page data, flash only counts operations and writes
+        # carry no payload
+        self.store_data = self.conf['store_page_data']
+        self.flash.store_data = self.store_data
+
 
     def lpn_to_ppn(self, lpn):
         found, ppn, location = self.translator.lpn_to_ppn(lpn)
@@ -1838,8 +1921,12 @@ class Ftl(ftlbuilder.FtlBuilder):
 
 
     def lba_write(self, lpn, data=None):
+        if self.store_data is True:
+            data = [data]
+        else:
+            data = None
         yield self.env.process(
-                self.write_ext(Extent(lpn_start=lpn, lpn_count=1), [data]))
+                self.write_ext(Extent(lpn_start=lpn, lpn_count=1), data))
 
         yield self.env.process(self.garbage_collector.clean())
 
@@ -1852,6 +1939,9 @@ class Ftl(ftlbuilder.FtlBuilder):
             sys.stdout.flush()
             self.pre_written_bytes = self.written_bytes
 
+        if self.store_data is False:
+            data = None
+
         extents = split_ext(self.conf.n_pages_per_data_group(), extent)
         data_group_procs = []
         for data_group_ext in extents:
@@ -2038,11 +2128,15 @@ class Ftl(ftlbuilder.FtlBuilder):
             self.log_mapping_table.add_mapping(lpn, ppn)
 
     def _remap_oob(self, new_mappings):
-        for lpn, new_ppn in new_mappings.items():
+        old_ppns = []
+        for lpn in new_mappings.keys():
             found, old_ppn, loc = self.translator.lpn_to_ppn(lpn)
             if found == False:
                 old_ppn = None
-            self.oob.remap(lpn = lpn, old_ppn = old_ppn, new_ppn = new_ppn)
+            old_ppns.append(old_ppn)
+
+        self.oob.remap_many(lpns = new_mappings.keys(), old_ppns = old_ppns,
+                new_ppns = new_mappings.values())
 
 
 
@@ -2074,12 +2168,14 @@ class Ftl(ftlbuilder.FtlBuilder):
         req = self.logical_block_locks.get_request(block_id)
         yield req
 
+        ppns_to_wipe = []
         for lpn in extent.lpn_iter():
             found, ppn, loc = self.translator.lpn_to_ppn(lpn)
             if found == True:
                 if loc == IN_LOG_BLOCK:
                     self.translator.log_mapping_table.remove_lpn(lpn)
-                self.oob.wipe_ppn(ppn)
+                ppns_to_wipe.append(ppn)
+        self.oob.wipe_ppns(ppns_to_wipe)
 
         self.logical_block_locks.release_request(block_id, req)
 
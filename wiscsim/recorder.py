@@ -153,6 +153,16 @@ class Recorder(object):
                 collections.Counter())
         counter_dict[item_name] += addition
 
+    def merge_general_accumulator(self, accumulator):
+        """
+        Add the counts of another general accumulator, such as the one of
+        a simulation shard, to this one
+        """
+        for counter_set_name, counter_set in accumulator.items():
+            counter_dict = self.general_accumulator.setdefault(
+                    counter_set_name, collections.Counter())
+            counter_dict.update(counter_set)
+
     @switchable
     def add_to_timer(self, counter_set_name, item_name, addition):
         self.add_to_general_accumulater(counter_set_name, item_name, addition)
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 import abc
 import argparse
+import copy
+import multiprocessing
 import random
 import simpy
 import sys
+import traceback
 import os
 import csv
 import pprint
@@ -95,6 +98,142 @@ class SimulatorDESNew(Simulator):
             gclog.classify_lpn_in_gclog()
 
 
+class SimulatorNkftlSharded(Simulator):
+    """
+    Data groups of nkftl2 own their log blocks and mappings, and only share
+    free blocks and channels. This simulator splits the trace by data group
+    and simulates n_simulation_shards shards in worker processes. Each
+    shard is a SimulatorDESNew run on a device with 1/n of the blocks. The
+    counters of all shards are added up.
+
+    Channels are not shared between shards, so the time of a shard is not
+    the time of the whole device. Use it for counts, such as WAF.
+    """
+    def __init__(self, conf, event_iter):
+        super(SimulatorNkftlSharded, self).__init__(conf, event_iter)
+
+        if self.conf['ftl_type'] != 'nkftl2':
+            raise ValueError("SimulatorNkftlSharded only runs nkftl2, not {}"\
+                .format(self.conf['ftl_type']))
+
+        self.n_shards = self.conf['n_simulation_shards']
+        n_blocks_per_plane = self.conf['flash_config']['n_blocks_per_plane']
+        if n_blocks_per_plane % self.n_shards != 0:
+            raise ValueError("n_blocks_per_plane ({}) is not a multiple of "
+                "n_simulation_shards ({})".format(n_blocks_per_plane,
+                    self.n_shards))
+        # data group g goes to shard g % n_shards. Each shard has to get
+        # as many data groups as its 1/n of the blocks has.
+        n_datagroups = self.conf.n_datagroups_per_dev()
+        if n_datagroups % self.n_shards != 0:
+            raise ValueError("number of data groups ({}) is not a multiple "
+                "of n_simulation_shards ({})".format(n_datagroups,
+                    self.n_shards))
+
+    def get_sim_type(self):
+        return "NkftlSharded"
+
+    def shard_config(self, shard_id):
+        conf = copy.deepcopy(self.conf)
+        conf['flash_config']['n_blocks_per_plane'] /= self.n_shards
+        conf['simulator_class'] = 'SimulatorDESNew'
+        conf['result_dir'] = os.path.join(self.conf['result_dir'],
+                'shard-{}'.format(shard_id))
+        return conf
+
+    def run(self):
+        # Workers are forked and inherit self.event_iter. Each one reads
+        # the whole trace and keeps only the events of its shard, so the
+        # parent does not hold or pickle a copy of the trace per shard.
+        queue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=run_simulation_shard,
+                args=(self.shard_config(i), self.event_iter, self.n_shards,
+                    i, queue))
+                for i in range(self.n_shards)]
+        for worker in workers:
+            worker.start()
+        results = [None] * self.n_shards
+        try:
+            for _ in range(self.n_shards):
+                shard_id, result, error = queue.get()
+                if error is not None:
+                    raise RuntimeError("shard {} failed:\n{}".format(
+                        shard_id, error))
+                results[shard_id] = result
+        except:
+            for worker in workers:
+                worker.terminate()
+            raise
+        finally:
+            for worker in workers:
+                worker.join()
+
+        for result in results:
+            self.recorder.merge_general_accumulator(
+                    result['general_accumulator'])
+        self.recorder.set_result_by_one_key('simulation_duration',
+                max(result['simulation_duration'] for result in results))
+        self.recorder.set_result_by_one_key('n_simulation_shards',
+                self.n_shards)
+
+        self.recorder.close()
+
+
+def run_simulation_shard(conf, event_iter, n_shards, shard_id, queue):
+    "run in worker processes of SimulatorNkftlSharded"
+    try:
+        simulator = SimulatorDESNew(conf,
+                shard_events(conf, event_iter, n_shards, shard_id))
+        simulator.run()
+        queue.put((shard_id, simulator.recorder.get_result_summary(), None))
+    except Exception:
+        queue.put((shard_id, None, traceback.format_exc()))
+
+
+def shard_events(conf, event_iter, n_shards, shard_id):
+    """
+    Iterate the events of shard shard_id. Data group g goes to shard
+    g % n_shards and is data group g / n_shards in that shard, so each
+    shard has a compact logical space. Requests across data groups are
+    split. Other events go to all shards.
+    """
+    sector_size = conf['sector_size']
+    n_secs_per_group = conf.n_pages_per_data_group() * conf.page_size \
+            / sector_size
+
+    for event in event_iter:
+        if not isinstance(event, hostevent.Event) or \
+                event.operation not in (OP_READ, OP_WRITE, OP_DISCARD):
+            yield event
+            continue
+
+        if event.offset < 0:
+            # padding, Host skips it as well
+            continue
+
+        sector = event.sector
+        end = event.sector + event.sector_count
+        while sector < end:
+            dgn = sector / n_secs_per_group
+            piece_end = min(end, (dgn + 1) * n_secs_per_group)
+
+            if dgn % n_shards == shard_id:
+                local_sector = (dgn / n_shards) * n_secs_per_group + \
+                        sector % n_secs_per_group
+                yield hostevent.Event(
+                    sector_size = sector_size,
+                    pid = event.pid,
+                    operation = event.operation,
+                    offset = local_sector * sector_size,
+                    size = (piece_end - sector) * sector_size,
+                    timestamp = event.timestamp,
+                    pre_wait_time = event.pre_wait_time,
+                    sync = event.sync,
+                    action = event.action)
+
+            sector = piece_end
+
+
 def create_simulator(simulator_class, conf, event_iter):
     cls = eval(simulator_class)
     return cls(conf, event_iter)
@@ -204,6 +343,10 @@ class SimulatorNonDESe2e(SimulatorNonDES):
     def __init__(self, conf, event_iter):
         super(SimulatorNonDESe2e, self).__init__(conf, event_iter)
 
+        if self.conf['store_page_data'] is False:
+            raise RuntimeError("NonDESe2e checks page data, so it needs "
+                    "store_page_data")
+
         self.lsn_to_data = {}
 
     def get_sim_type(self):
@@ -61,6 +61,14 @@ class Ssd(SsdBase):
         self.gc_sleep_timer = 0
         self.gc_sleep_duration = 10
 
+        self.idle_detector = NCQIdleDetector(self.env)
+        self._background_gc = self.conf['background_gc']
+        self._background_gc_idle_time = self.conf['background_gc_idle_time']
+        if self._background_gc is True and \
+                self.conf['ftl_type'] != 'dftldes':
+            raise NotImplementedError("background_gc is only supported "
+                    "by dftldes")
+
     def _create_ftl(self):
         if self.conf['ftl_type'] == 'dftldes':
             return dftldes.Ftl(self.conf, self.recorder, self.flash_controller,
@@ -90,6 +98,7 @@ class Ssd(SsdBase):
 
             slot_req = self.ncq.slots.request()
             yield slot_req
+            self.idle_detector.request_started()
 
             # handle host_event case by case
             operation = host_event.get_operation()
@@ -179,6 +188,7 @@ class Ssd(SsdBase):
                         data)
 
             elif operation == OP_END_SSD_PROCESS:
+                self.idle_detector.request_finished()
                 self.ncq.slots.release(slot_req)
                 break
 
@@ -241,6 +251,7 @@ class Ssd(SsdBase):
                 # valid ratio
                 self.gc_sleep_timer = self.gc_sleep_duration
 
+            self.idle_detector.request_finished()
             self.ncq.slots.release(slot_req)
 
     def _end_all_processes(self):
@@ -251,12 +262,34 @@ class Ssd(SsdBase):
         self._snapshot_erasure_count_dist = False
         self._do_wear_leveling = False
         self._snapshot_user_traffic = False
+        self._background_gc = False
 
     def _cleaner_process(self, forced=False):
         # things may have changed since last time we check, because of locks
         if forced is True or self.ftl.is_cleaning_needed():
             yield self.env.process(self.ftl.clean(forced))
 
+    def _background_gc_process(self):
+        """
+        Clean when the NCQ has been idle for background_gc_idle_time.
+        Cleaning stops as soon as a host request comes in and resumes at
+        the next idle period.
+        """
+        while self._background_gc is True:
+            yield self.env.process(
+                self.idle_detector.wait_idle(self._background_gc_idle_time))
+            if self._background_gc is False:
+                break
+
+            if self.ftl.is_background_cleaning_needed() is True:
+                self.recorder.count_me("gc", "background.invoked")
+                yield self.env.process(
+                    self.ftl.clean_in_background(self.idle_detector.is_idle))
+
+            if self.idle_detector.is_idle():
+                # nothing more to do in this idle period
+                yield self.idle_detector.arrival_event()
+
     def _wear_leveling_process(self):
         print 'wear leveling process start'
         while self._do_wear_leveling is True:
@@ -302,6 +335,10 @@ class Ssd(SsdBase):
         p = self.env.process( self._user_traffic_size_snapshot_process() )
         procs.append(p)
 
+        if self._background_gc is True:
+            p = self.env.process( self._background_gc_process() )
+            procs.append(p)
+
         yield simpy.events.AllOf(self.env, procs)
 
 
@@ -1,4 +1,6 @@
-from collections import Counter
+from collections import Counter, OrderedDict
+import heapq
+import itertools
 
 TFREE = 'TAGFREE'
 
@@ -6,28 +8,248 @@ LEAST_ERASED = 'least'
 MOST_ERASED = 'most'
 
 
-class TagBlockPool(object):
-    def __init__(self, n, tags):
-        self._tag_subpool = {tag:[] for tag in tags}
-        self._tag_subpool[TFREE] = range(n)
+class EraseCountBuckets(object):
+    """
+    Blocks grouped by erase count, with the smallest and largest counts
+    kept, so the least or most erased block is found without sorting all
+    blocks.
+
+    Among blocks of the same count, LEAST_ERASED picks the largest blocknum
+    and MOST_ERASED the smallest, as reversed(Counter.most_common()) and
+    Counter.most_common() did.
+    """
+    def __init__(self):
+        # {erase count: set of blocknum}
+        self._buckets = {}
+        # {erase count: heap of blocknum} and {erase count: heap of
+        # -blocknum}. A block is added to a count at most once, as counts
+        # only grow, so entries of removed blocks are just skipped later.
+        self._low_heaps = {}
+        self._high_heaps = {}
+        self._min_cnt = None
+        self._max_cnt = None
+
+    def add_blocks(self, blocks, count):
+        bucket = self._buckets.get(count)
+        if bucket is None:
+            bucket = self._new_bucket(count)
+        bucket.update(blocks)
+
+        low_heap = self._low_heaps[count]
+        high_heap = self._high_heaps[count]
+        low_heap.extend(blocks)
+        high_heap.extend(-blocknum for blocknum in blocks)
+        heapq.heapify(low_heap)
+        heapq.heapify(high_heap)
+
+    def add(self, blocknum, count):
+        bucket = self._buckets.get(count)
+        if bucket is None:
+            bucket = self._new_bucket(count)
+        bucket.add(blocknum)
+        heapq.heappush(self._low_heaps[count], blocknum)
+        heapq.heappush(self._high_heaps[count], -blocknum)
+
+    def remove(self, blocknum, count):
+        bucket = self._buckets[count]
+        bucket.remove(blocknum)
+        if len(bucket) > 0:
+            return
+
+        del self._buckets[count]
+        del self._low_heaps[count]
+        del self._high_heaps[count]
+        if len(self._buckets) == 0:
+            self._min_cnt = None
+            self._max_cnt = None
+        elif count == self._min_cnt:
+            self._min_cnt = min(self._buckets)
+        elif count == self._max_cnt:
+            self._max_cnt = max(self._buckets)
+
+    def _new_bucket(self, count):
+        bucket = set()
+        self._buckets[count] = bucket
+        self._low_heaps[count] = []
+        self._high_heaps[count] = []
+        if self._min_cnt is None or count < self._min_cnt:
+            self._min_cnt = count
+        if self._max_cnt is None or count > self._max_cnt:
+            self._max_cnt = count
+        return bucket
+
+    def pick(self, choice=LEAST_ERASED):
+        if choice == LEAST_ERASED:
+            count = self._min_cnt
+            heaps = self._high_heaps
+            sign = -1
+        elif choice == MOST_ERASED:
+            count = self._max_cnt
+            heaps = self._low_heaps
+            sign = 1
+        else:
+            raise NotImplementedError
+
+        if count is None:
+            return None
 
+        bucket = self._buckets[count]
+        heap = heaps[count]
+        while sign * heap[0] not in bucket:
+            heapq.heappop(heap)
+        return sign * heap[0]
+
+    def least_or_most_erased_blocks(self, choice, nblocks):
+        if nblocks == 1:
+            blocknum = self.pick(choice)
+            return [] if blocknum is None else [blocknum]
+
+        if choice not in (LEAST_ERASED, MOST_ERASED):
+            raise NotImplementedError
+
+        return [blocknum for _, blocknum in
+                itertools.islice(iter_buckets(self._buckets, choice), nblocks)]
+
+
+def iter_buckets(buckets, choice=LEAST_ERASED):
+    """
+    Yield (erase count, blocknum) from buckets ({erase count: set of
+    blocknum}) in the order of reversed(Counter.most_common()) for
+    LEAST_ERASED and Counter.most_common() for MOST_ERASED. A bucket is
+    sorted only when the iteration gets to it.
+    """
+    if choice not in (LEAST_ERASED, MOST_ERASED):
+        raise NotImplementedError
+
+    for count in sorted(buckets, reverse=(choice == MOST_ERASED)):
+        bucket = buckets.get(count, ())
+        for blocknum in sorted(bucket, reverse=(choice == LEAST_ERASED)):
+            yield count, blocknum
+
+
+class EraseCountHistogram(object):
+    """
+    {erase count: number of blocks}, with the smallest and largest counts
+    and the sum of all counts kept up to date, so wear checks do not go
+    through every block.
+    """
+    def __init__(self):
+        self.dist = Counter()
+        self.min_cnt = None
+        self.max_cnt = None
+        self.total = 0
+
+    def add(self, count):
+        self.dist[count] += 1
+        self.total += count
+        if self.min_cnt is None or count < self.min_cnt:
+            self.min_cnt = count
+        if self.max_cnt is None or count > self.max_cnt:
+            self.max_cnt = count
+
+    def remove(self, count):
+        self.dist[count] -= 1
+        self.total -= count
+        if self.dist[count] > 0:
+            return
+
+        del self.dist[count]
+        if len(self.dist) == 0:
+            self.min_cnt = None
+            self.max_cnt = None
+        elif count == self.min_cnt:
+            self.min_cnt = min(self.dist)
+        elif count == self.max_cnt:
+            self.max_cnt = max(self.dist)
+
+
+class ErasureCounter(Counter):
+    """
+    {blocknum: erase count}. Every change of a count is also applied to the
+    histograms.
+    """
+    def __init__(self, histograms):
+        super(ErasureCounter, self).__init__()
+        self._histograms = histograms
+
+    def __setitem__(self, blocknum, count):
+        old_count = self.get(blocknum)
+        for histogram in self._histograms:
+            if old_count is not None:
+                histogram.remove(old_count)
+            histogram.add(count)
+        super(ErasureCounter, self).__setitem__(blocknum, count)
+
+    def __delitem__(self, blocknum):
+        if blocknum in self:
+            for histogram in self._histograms:
+                histogram.remove(self[blocknum])
+        super(ErasureCounter, self).__delitem__(blocknum)
+
+    def copy(self):
+        return Counter(self)
+
+
+class TagBlockPool(object):
+    def __init__(self, n, tags, erasure_hists=()):
+        """
+        erasure_hists are histograms shared with other pools, for example a
+        device-wide one. They are updated with this pool's erase counts.
+        """
+        # {tag: OrderedDict of blocknum}, used as ordered sets so that
+        # moving a block between tags is O(1) and blocks stay in the order
+        # they got the tag
+        self._tag_subpool = {tag:OrderedDict() for tag in tags}
+        self._tag_subpool[TFREE] = OrderedDict.fromkeys(range(n))
+        # {blocknum: tag}, so the tag of a block is known without
+        # searching the subpools
+        self._block_tag = [TFREE] * n
+
+        # {erase count: number of blocks} of this pool
+        self._erasure_hist = EraseCountHistogram()
         # {blocknum: count}
-        self._erasure_cnt = Counter()
+        self._erasure_cnt = ErasureCounter(
+                [self._erasure_hist] + list(erasure_hists))
         # have to put the block number in the counter
         # otherwise, if a free block is never used, it won't
         # appear in the counter.
         for block in range(n):
             self._erasure_cnt[block] = 0
 
+        # free blocks by erase count, for picking free blocks
+        self._free_buckets = EraseCountBuckets()
+        self._free_buckets.add_blocks(range(n), 0)
+        # {tag: {erase count: set of blocknum}} of the other tags. A block
+        # is only erased after it goes back to TFREE, so its count does
+        # not change while it stays in one of these.
+        self._used_buckets = {tag:{} for tag in tags if tag != TFREE}
+
     def get_blocks_of_tag(self, tag):
-        return self._tag_subpool[tag]
+        return self._tag_subpool[tag].keys()
 
     def change_tag(self, blocknum, src, dst):
-        self._tag_subpool[src].remove(blocknum)
-        self._tag_subpool[dst].append(blocknum)
+        del self._tag_subpool[src][blocknum]
+        self._tag_subpool[dst][blocknum] = None
+        self._block_tag[blocknum] = dst
+
+        count = self._erasure_cnt[blocknum]
+        if src == TFREE:
+            self._free_buckets.remove(blocknum, count)
+        else:
+            buckets = self._used_buckets[src]
+            bucket = buckets[count]
+            bucket.remove(blocknum)
+            if len(bucket) == 0:
+                del buckets[count]
 
         if dst == TFREE:
-            self._erasure_cnt[blocknum] += 1
+            self._erasure_cnt[blocknum] = count + 1
+            self._free_buckets.add(blocknum, count + 1)
+        else:
+            self._used_buckets[dst].setdefault(count, set()).add(blocknum)
+
+    def get_tag(self, blocknum):
+        return self._block_tag[blocknum]
 
     def count_blocks(self, tag):
         return len(self._tag_subpool[tag])
@@ -60,27 +282,29 @@ class TagBlockPool(object):
             return None
 
     def get_least_or_most_erased_blocks(self, tag, choice, nblocks):
-        if choice == LEAST_ERASED:
-            blocks_by_cnt = reversed(self._erasure_cnt.most_common())
-        elif choice == MOST_ERASED:
-            blocks_by_cnt = self._erasure_cnt.most_common()
-        else:
-            raise NotImplementedError
+        if tag == TFREE:
+            return self._free_buckets.least_or_most_erased_blocks(
+                    choice, nblocks)
 
-        tag_blocks = self.get_blocks_of_tag(tag)
+        return [blocknum for _, blocknum in
+                itertools.islice(self.iter_blocks_by_erasure(tag, choice),
+                    nblocks)]
 
-        # iterate from least used to most used
-        blocks = []
-        for blocknum, count in blocks_by_cnt:
-            if blocknum in tag_blocks:
-                blocks.append(blocknum)
-                if len(blocks) == nblocks:
-                    break
+    def iter_blocks_by_erasure(self, tag, choice=LEAST_ERASED):
+        """
+        Yield (erase count, blocknum) of blocks of tag, least erased first
+        for LEAST_ERASED. Blocks that change tag during the iteration may
+        or may not be yielded.
+        """
+        if tag == TFREE:
+            buckets = self._free_buckets._buckets
+        else:
+            buckets = self._used_buckets[tag]
 
-        return blocks
+        return iter_buckets(buckets, choice)
 
     def get_erasure_count_dist(self):
-        return Counter(self._erasure_cnt.values())
+        return Counter(self._erasure_hist.dist)
 
 
 class CurrentBlock(object):
@@ -107,8 +331,8 @@ class CurrentBlock(object):
 
 
 class BlockPoolWithCurBlocks(TagBlockPool):
-    def __init__(self, n, tags, n_pages_per_block):
-        super(BlockPoolWithCurBlocks, self).__init__(n, tags)
+    def __init__(self, n, tags, n_pages_per_block, erasure_hists=()):
+        super(BlockPoolWithCurBlocks, self).__init__(n, tags, erasure_hists)
         self._n_pages_per_block = n_pages_per_block
 
         # {TAG1: {0: CurrentBlock obj, 1: CurrentBlock obj},
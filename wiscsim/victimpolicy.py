@@ -0,0 +1,238 @@
+"""
+GC victim selection policies.
+
+The FTL gives the candidate blocks as (block_type, blocknum), either in a
+list or in a BlockCandidates, and a policy yields them back, best victim
+first. The policy learns about a block through two functions given by the
+FTL:
+
+    valid_ratio_func(blocknum): fraction of valid pages in the block
+    age_func(blocknum): time since the block was last modified. Larger is
+        older. The unit is up to the FTL.
+
+Candidates are yielded lazily, so a caller that stops after a few victims
+only pays for what it took. Greedy, cost_benefit, fifo and
+windowed_greedy look at every candidate. d_choices only looks at the ones
+it samples, so a BlockCandidates does not list the others.
+
+A policy draws its samples from its own random.Random seeded with
+conf['gc_victim_seed'], so runs are reproducible. Keep one policy for all
+GC rounds; a new policy starts over from the same seed.
+"""
+import heapq
+import random
+
+GREEDY = 'greedy'
+COST_BENEFIT = 'cost_benefit'
+FIFO = 'fifo'
+WINDOWED_GREEDY = 'windowed_greedy'
+D_CHOICES = 'd_choices'
+
+def benefit_cost(valid_ratio, age):
+    """
+    benefit/cost = age * (1-u) / 2u, from the LFS and DFTL papers
+    """
+    if valid_ratio == 0:
+        # empty block is always the best deal
+        return float("inf")
+    if valid_ratio == 1:
+        return 0
+    return age * (1 - valid_ratio) / (2 * valid_ratio)
+
+
+class CandidateList(object):
+    "Candidates in a list of (block_type, blocknum)"
+    def __init__(self, candidates):
+        self._candidates = list(candidates)
+        self._index = {block: i
+                for i, (_, block) in enumerate(self._candidates)}
+
+    def __iter__(self):
+        return iter(list(self._candidates))
+
+    def discard(self, block):
+        i = self._index.pop(block, None)
+        if i is None:
+            return
+        # swap the last candidate in
+        last = self._candidates.pop()
+        if i < len(self._candidates):
+            self._candidates[i] = last
+            self._index[last[1]] = i
+
+    def sample(self, rng, k):
+        "Return up to k candidates picked at random"
+        return rng.sample(self._candidates, min(k, len(self._candidates)))
+
+
+class BlockCandidates(object):
+    """
+    Candidates among a dense array of block numbers that the FTL keeps up
+    to date, such as FlashBitmap2.garbage_block_array(). The array may hold
+    blocks that are not candidates. Subclasses define
+
+        candidate_type(blocknum): block_type if the block is a candidate,
+            otherwise None
+
+    sample() draws positions of the array without replacement, so it only
+    looks up the blocks it draws.
+    """
+    def __init__(self, blocks):
+        self._blocks = blocks
+        self._discarded = set()
+
+    def candidate_type(self, blocknum):
+        raise NotImplementedError
+
+    def __iter__(self):
+        for block in list(self._blocks):
+            if block in self._discarded:
+                continue
+            block_type = self.candidate_type(block)
+            if block_type is not None:
+                yield block_type, block
+
+    def discard(self, block):
+        self._discarded.add(block)
+
+    def sample(self, rng, k):
+        "Return up to k candidates picked at random"
+        blocks = self._blocks
+        n = len(blocks)
+        sampled = []
+        # Fisher-Yates shuffle of the positions, stopped after k
+        # candidates. Only the moved positions are kept.
+        moved = {}
+        for i in xrange(n):
+            if len(sampled) == k:
+                break
+            j = rng.randrange(i, n)
+            pos = moved.get(j, j)
+            moved[j] = moved.get(i, i)
+
+            block = blocks[pos]
+            if block in self._discarded:
+                continue
+            block_type = self.candidate_type(block)
+            if block_type is not None:
+                sampled.append((block_type, block))
+        return sampled
+
+
+def as_candidates(candidates):
+    if isinstance(candidates, (CandidateList, BlockCandidates)):
+        return candidates
+    return CandidateList(candidates)
+
+
+class VictimPolicy(object):
+    def __init__(self, conf, valid_ratio_func, age_func):
+        self.conf = conf
+        self.valid_ratio = valid_ratio_func
+        self.age = age_func
+        self.rng = random.Random(conf['gc_victim_seed'])
+
+    def victims(self, candidates):
+        """
+        candidates is a list of (block_type, blocknum) or a BlockCandidates.
+        It may be changed.
+        Yield (block_type, blocknum), best victim first.
+        """
+        raise NotImplementedError
+
+    def _iter_by_key(self, candidates, key_func):
+        heap = [key_func(block_type, block) + (block_type, block)
+                for block_type, block in candidates]
+        heapq.heapify(heap)
+        while len(heap) > 0:
+            item = heapq.heappop(heap)
+            yield item[-2], item[-1]
+
+
+class GreedyPolicy(VictimPolicy):
+    "Fewest valid pages first"
+    def victims(self, candidates):
+        return self._iter_by_key(candidates,
+                lambda block_type, block: (self.valid_ratio(block),))
+
+
+class CostBenefitPolicy(VictimPolicy):
+    "Largest benefit/cost first"
+    def victims(self, candidates):
+        return self._iter_by_key(candidates,
+                lambda block_type, block: (-benefit_cost(
+                    self.valid_ratio(block), self.age(block)),))
+
+
+class FifoPolicy(VictimPolicy):
+    "Oldest block first, regardless of how many valid pages it has"
+    def victims(self, candidates):
+        return self._iter_by_key(candidates,
+                lambda block_type, block: (-self.age(block),))
+
+
+class WindowedGreedyPolicy(VictimPolicy):
+    """
+    Greedy among the conf['gc_victim_window'] oldest candidates. When a
+    victim is taken, the next oldest candidate joins the window.
+    """
+    def victims(self, candidates):
+        window_size = self.conf['gc_victim_window']
+        by_age = self._iter_by_key(candidates,
+                lambda block_type, block: (-self.age(block),))
+
+        window = []
+        while True:
+            for block_type, block in by_age:
+                heapq.heappush(window,
+                        (self.valid_ratio(block), block_type, block))
+                if len(window) >= window_size:
+                    break
+
+            if len(window) == 0:
+                break
+
+            _, block_type, block = heapq.heappop(window)
+            yield block_type, block
+
+
+class DChoicesPolicy(VictimPolicy):
+    """
+    Sample conf['gc_victim_d_choices'] candidates at random and take the one
+    with the fewest valid pages. It costs O(d) per victim and its write
+    amplification is close to greedy.
+    """
+    def victims(self, candidates):
+        candidates = as_candidates(candidates)
+        d = self.conf['gc_victim_d_choices']
+
+        while True:
+            sampled = candidates.sample(self.rng, d)
+            if len(sampled) == 0:
+                break
+
+            _, block_type, block = min(
+                    (self.valid_ratio(block), block_type, block)
+                    for block_type, block in sampled)
+            candidates.discard(block)
+
+            yield block_type, block
+
+
+_POLICIES = {
+        GREEDY: GreedyPolicy,
+        COST_BENEFIT: CostBenefitPolicy,
+        FIFO: FifoPolicy,
+        WINDOWED_GREEDY: WindowedGreedyPolicy,
+        D_CHOICES: DChoicesPolicy,
+        }
+
+
+def create_victim_policy(conf, valid_ratio_func, age_func):
+    name = conf['gc_victim_policy']
+    try:
+        policy_class = _POLICIES[name]
+    except KeyError:
+        raise NotImplementedError("gc_victim_policy {} is not supported"
+                .format(name))
+    return policy_class(conf, valid_ratio_func, age_func)